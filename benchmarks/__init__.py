@@ -0,0 +1 @@
+"""Performance benchmarks for Foodly (run as ``python -m benchmarks.<name>``)."""
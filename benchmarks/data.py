@@ -0,0 +1,140 @@
+"""Deterministic synthetic data for benchmarks.
+
+    python -m benchmarks.data foodly_bench.db [--foods 5000] [--lots 2000] [--days 365] [--seed 1]
+
+``generate`` fills a migrated database with ``foods`` catalogue rows (Italian
+names built from a fixed vocabulary, unique barcodes), ``lots`` pantry lots
+and ``days`` days of consumption logs ending on ``end``. The same arguments
+always produce the same rows, so timings taken on different commits compare
+like with like.
+"""
+import argparse
+import random
+import sqlite3
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, List, Optional, Union
+
+from foodly.core.migrations import migrate
+
+END_DAY = date(2025, 12, 31)
+
+# alimento base -> (kcal, prot, carb, fat, fibra) medi per 100 g
+BASE_FOODS: Dict[str, tuple] = {
+    "Riso basmati": (350, 7.5, 78, 0.9, 1.3),
+    "Pasta di semola": (359, 12.5, 71, 2.0, 3.0),
+    "Petto di pollo": (110, 23, 0, 1.5, 0),
+    "Tonno al naturale": (116, 25, 0, 1.0, 0),
+    "Yogurt bianco": (61, 3.5, 4.7, 3.3, 0),
+    "Mele golden": (52, 0.3, 14, 0.2, 2.4),
+    "Latte parzialmente scremato": (46, 3.3, 4.9, 1.6, 0),
+    "Pane integrale": (247, 13, 41, 3.4, 7.0),
+    "Gallette di mais": (381, 8, 77, 3.6, 3.0),
+    "Prosciutto crudo": (269, 26, 0, 18, 0),
+    "Mozzarella": (280, 18, 3, 22, 0),
+    "Lenticchie secche": (352, 25, 51, 1.1, 14),
+    "Ceci in scatola": (120, 7, 16, 2.5, 5.0),
+    "Fiocchi d'avena": (372, 13, 59, 7.0, 10),
+    "Banane": (89, 1.1, 23, 0.3, 2.6),
+    "Uova": (143, 12.6, 0.7, 9.5, 0),
+    "Salmone affumicato": (117, 18, 0, 4.3, 0),
+    "Olio extravergine di oliva": (884, 0, 0, 100, 0),
+    "Parmigiano reggiano": (392, 33, 0, 28, 0),
+    "Biscotti secchi": (416, 8, 76, 8.5, 3.0),
+}
+QUALIFIERS = ["", "integrale", "biologico", "light", "classico", "senza lattosio", "al limone", "piccante", "bio", "extra"]
+BRANDS = [None, "Conad", "Coop", "Esselunga", "Barilla", "Mutti", "Granarolo", "Rio Mare", "Mulino Bianco", "Galbani"]
+LOCATIONS = ["dispensa", "frigo", "freezer"]
+MEALS = ["breakfast", "lunch", "dinner", "snack"]
+
+
+def food_rows(n: int, rng: random.Random) -> List[tuple]:
+    bases = list(BASE_FOODS.items())
+    rows = []
+    for i in range(n):
+        name, (kcal, prot, carb, fat, fiber) = bases[i % len(bases)]
+        qualifier = QUALIFIERS[(i // len(bases)) % len(QUALIFIERS)]
+        # oltre il vocabolario i nomi restano distinti con un numero di variante
+        variant = i // (len(bases) * len(QUALIFIERS))
+        full = " ".join(p for p in (name, qualifier, f"v{variant}" if variant else "") if p)
+        macros = [round(v * rng.uniform(0.85, 1.15), 2) for v in (kcal, prot, carb, fat, fiber)]
+        rows.append((
+            full, rng.choice(BRANDS), f"80{i:011d}", *macros,
+            round(rng.uniform(0, 20), 1), round(rng.uniform(0, 10), 1), round(rng.uniform(0, 800)),
+        ))
+    return rows
+
+
+def generate(
+    conn: sqlite3.Connection,
+    foods: int = 5000,
+    lots: int = 2000,
+    days: int = 365,
+    logs_per_day: int = 6,
+    seed: int = 1,
+    end: date = END_DAY,
+) -> Dict[str, int]:
+    """Fill ``conn`` (migrated here if needed) and return the row counts."""
+    rng = random.Random(seed)
+    migrate(conn)
+    conn.execute("INSERT OR IGNORE INTO user_settings(id) VALUES (1)")
+    conn.executemany(
+        """
+        INSERT INTO foods(name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g,
+                          sugar_100g, satfat_100g, sodium_mg_100g, source, last_updated)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'bench', '2025-01-01T00:00:00')
+        """,
+        food_rows(foods, rng),
+    )
+    conn.executemany(
+        "INSERT INTO pantry(food_id, qty_g, package_g, location, best_before, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+        [
+            (
+                rng.randint(1, foods), rng.choice([50, 100, 125, 250, 500, 1000]), rng.choice([None, 125.0, 500.0]),
+                rng.choice(LOCATIONS), (end + timedelta(days=rng.randint(-10, 180))).isoformat(),
+                f"{(end - timedelta(days=rng.randint(0, days))).isoformat()} 10:00:00",
+            )
+            for _ in range(lots)
+        ],
+    )
+    start = end - timedelta(days=days - 1)
+    conn.executemany(
+        "INSERT INTO consumption_logs(ts, food_id, grams, meal) VALUES (?, ?, ?, ?)",
+        [
+            (
+                f"{(start + timedelta(days=d)).isoformat()}T{7 + 2 * k:02d}:{rng.randint(0, 59):02d}:00",
+                rng.randint(1, foods), float(rng.choice([30, 50, 80, 100, 150, 200])), MEALS[k % len(MEALS)],
+            )
+            for d in range(days)
+            for k in range(logs_per_day)
+        ],
+    )
+    conn.commit()
+    return {"foods": foods, "pantry": lots, "consumption_logs": days * logs_per_day}
+
+
+def build_db(path: Union[str, Path] = ":memory:", **params) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    generate(conn, **params)
+    return conn
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Genera un database sintetico per i benchmark.")
+    parser.add_argument("path", help="file SQLite da creare (non deve esistere)")
+    parser.add_argument("--foods", type=int, default=5000)
+    parser.add_argument("--lots", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args(argv)
+    if Path(args.path).exists():
+        parser.error(f"{args.path} esiste già")
+    conn = build_db(args.path, foods=args.foods, lots=args.lots, days=args.days, seed=args.seed)
+    counts = {t: conn.execute(f"SELECT COUNT(*) FROM {t}").fetchone()[0] for t in ("foods", "pantry", "consumption_logs")}
+    conn.close()
+    print(counts)
+
+
+if __name__ == "__main__":
+    main()
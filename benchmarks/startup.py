@@ -0,0 +1,136 @@
+"""Cold-start benchmark of the two services.
+
+    python -m benchmarks.startup [--runs 5]
+
+Starts a fresh interpreter per run and, for the agent and the web UI, measures
+
+- ``import_ms``: importing the service module (``foodly.agent.main`` or
+  ``foodly.app.main``);
+- ``startup_ms``: running its lifespan startup (schema check, clients);
+- ``first_request_ms``: serving a first ``GET`` through the ASGI app;
+- ``process_ms``: the whole child process, interpreter start-up included;
+
+once on a database that does not exist yet (``fresh``: migrations and seed
+data) and once on an up-to-date one (``current``: a single version check).
+Prints the medians and lists the heavy optional modules (numpy, jinja2, httpx)
+that the process had loaded by the end of its first request.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+ROOT = Path(__file__).parent.parent
+SERVICES = {
+    "agent": ("foodly.agent.main", "/tools/summary"),
+    "web": ("foodly.app.main", "/api/pantry"),
+}
+HEAVY_MODULES = ("numpy", "jinja2", "httpx")
+METRICS = ("import_ms", "startup_ms", "first_request_ms", "process_ms")
+
+
+async def _get(app, path: str) -> int:
+    # richiesta ASGI diretta: TestClient importerebbe httpx e falserebbe la misura
+    scope = {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "GET",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [], "client": ("127.0.0.1", 0), "server": ("127.0.0.1", 80),
+    }
+    status: List[int] = []
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            status.append(message["status"])
+
+    await app(scope, receive, send)
+    return status[0]
+
+
+def _child(service: str, db: str) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    import asyncio
+    import importlib
+
+    from foodly.core import db as core_db
+
+    core_db.DB_PATH = Path(db)
+    module_name, path = SERVICES[service]
+    app = importlib.import_module(module_name).app
+    t_import = time.perf_counter()
+    timings: Dict[str, float] = {}
+
+    async def main():
+        async with app.router.lifespan_context(app):
+            timings["started"] = time.perf_counter()
+            timings["status"] = await _get(app, path)
+            timings["served"] = time.perf_counter()
+
+    asyncio.run(main())
+    return {
+        "import_ms": (t_import - t0) * 1000,
+        "startup_ms": (timings["started"] - t_import) * 1000,
+        "first_request_ms": (timings["served"] - timings["started"]) * 1000,
+        "status": timings["status"],
+        "heavy_modules": [m for m in HEAVY_MODULES if m in sys.modules],
+    }
+
+
+def _run_child(service: str, db: Path) -> Dict[str, Any]:
+    t0 = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable, "-m", "benchmarks.startup", "--child", service, str(db)],
+        check=True, capture_output=True, text=True, cwd=ROOT,
+    )
+    result = json.loads(out.stdout)
+    result["process_ms"] = (time.perf_counter() - t0) * 1000
+    if result["status"] != 200:
+        raise RuntimeError(f"{service}: prima richiesta con stato {result['status']}")
+    return result
+
+
+def run(runs: int = 5) -> Dict[str, Dict[str, Any]]:
+    results: Dict[str, Dict[str, Any]] = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp_dir = Path(tmp)
+        for service in SERVICES:
+            current = tmp_dir / f"{service}-current.db"
+            _run_child(service, current)  # crea e migra il database una volta
+            for state in ("fresh", "current"):
+                samples = [
+                    _run_child(service, tmp_dir / f"{service}-fresh-{n}.db" if state == "fresh" else current)
+                    for n in range(runs)
+                ]
+                summary: Dict[str, Any] = {m: round(statistics.median(s[m] for s in samples), 2) for m in METRICS}
+                summary["heavy_modules"] = samples[-1]["heavy_modules"]
+                results[f"{service}.{state}"] = summary
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["--child"]:
+        print(json.dumps(_child(argv[1], argv[2])))
+        return
+    parser = argparse.ArgumentParser(description="Misura l'avvio a freddo di agente e Web UI.")
+    parser.add_argument("--runs", type=int, default=5, help="processi per servizio e stato del database")
+    args = parser.parse_args(argv)
+    results = run(args.runs)
+    for name, res in results.items():
+        print(
+            f"{name:14s} import {res['import_ms']:7.1f} ms  startup {res['startup_ms']:6.1f} ms  "
+            f"prima richiesta {res['first_request_ms']:6.1f} ms  processo {res['process_ms']:7.1f} ms",
+            file=sys.stderr,
+        )
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
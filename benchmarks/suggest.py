@@ -0,0 +1,151 @@
+"""suggest_from_pantry: vectorized scoring vs. the original per-row Python loop.
+
+    python -m benchmarks.suggest [--rows 10000] [--repeat 20]
+
+Builds an in-memory database with ``--rows`` pantry lots, checks that both
+implementations return the same suggestion and prints the timings.
+"""
+import argparse
+import random
+import sqlite3
+import time
+from typing import Dict, Optional
+
+from foodly.agent.tools import day_summary, suggest_from_pantry
+from foodly.core.migrations import migrate
+
+
+# Implementazione originale (scoring con closure Python + sort completo), usata come riferimento
+def legacy_suggest_from_pantry(conn: sqlite3.Connection, date_str: Optional[str] = None) -> Dict[str, any]:
+    from foodly.core.calculations import compute_targets
+    totals = day_summary(conn, date_str)
+    targets = compute_targets(conn)
+    resid = {
+        "kcal": max(0.0, targets["kcal"] - totals["kcal"]),
+        "prot_g": max(0.0, targets["prot_g"] - totals["prot_g"]),
+        "carb_g": max(0.0, targets["carb_g"] - totals["carb_g"]),
+        "fat_g": max(0.0, targets["fat_g"] - totals["fat_g"]),
+        "fiber_g": max(0.0, targets["fiber_g"] - totals["fiber_g"]),
+    }
+    # Candidati: join dispensa + foods (qty>0)
+    rows = conn.execute(
+        """
+        SELECT f.id as food_id, f.name, p.qty_g, f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g, f.fiber_100g
+        FROM pantry p JOIN foods f ON p.food_id=f.id
+        WHERE p.qty_g > 0
+        ORDER BY f.name
+        """
+    ).fetchall()
+    candidates = [dict(r) for r in rows]
+    if not candidates:
+        return {"options": [], "residuals": resid, "note": "Dispensa vuota o esaurita."}
+
+    # Strategy: quale macro è più carente?
+    deficits = sorted([(k, v) for k,v in resid.items() if k!="kcal"], key=lambda x: -x[1])
+    main_def = deficits[0][0] if deficits else "prot_g"
+
+    def score(food):
+        # preferenza in base al deficit principale e penalità grasse se fat è già coperto
+        p = food["prot_100g"]; c = food["carb_100g"]; f = food["fat_100g"]; fib = food.get("fiber_100g", 0.0)
+        kcal = max(1e-6, food["kcal_100g"])  # prevenire div zero
+        s = 0.0
+        if main_def == "prot_g": s += (p/kcal)*3 + fib*0.02
+        if main_def == "carb_g": s += (c/kcal)*3 + fib*0.03
+        if main_def == "fat_g":  s += (f/kcal)*3
+        if resid["fiber_g"] > 5: s += fib*0.05
+        if resid["fat_g"] <= 0: s -= (f/kcal)  # penalizza grassi se già a target
+        return s
+
+    ranked = sorted(candidates, key=score, reverse=True)[:5]
+
+    # Quantità proposta: prova a coprire ~80% del deficit principale con un singolo alimento
+    options = []
+    for food in ranked:
+        if main_def == "prot_g": per100 = food["prot_100g"]
+        elif main_def == "carb_g": per100 = food["carb_100g"]
+        else: per100 = food["fat_100g"]
+        target_cover = 0.8 * resid[main_def]
+        grams = 0
+        if per100 > 0:
+            grams = min(food["qty_g"], max(0.0, target_cover / per100 * 100.0))
+            # Arrotonda a step da 5 g
+            grams = 5 * round(grams/5)
+        if grams <= 0: continue
+        # Calcolo impatti
+        factor = grams/100.0
+        delta = {
+            "kcal": round(food["kcal_100g"]*factor, 1),
+            "prot_g": round(food["prot_100g"]*factor, 1),
+            "carb_g": round(food["carb_100g"]*factor, 1),
+            "fat_g": round(food["fat_100g"]*factor, 1),
+            "fiber_g": round(food.get("fiber_100g",0)*factor, 1),
+        }
+        options.append({
+            "food_id": food["food_id"],
+            "name": food["name"],
+            "grams": grams,
+            "delta": delta
+        })
+    return {"options": options[:3], "residuals": resid, "main_deficit": main_def}
+
+
+def build_db(rows: int, seed: int = 1) -> sqlite3.Connection:
+    rng = random.Random(seed)
+    conn = sqlite3.connect(":memory:")
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.execute("INSERT INTO user_settings(id) VALUES (1)")
+    n_foods = max(1, rows // 4)
+    conn.executemany(
+        "INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g) VALUES (?,?,?,?,?,?)",
+        [
+            (f"Alimento {i:06d}", rng.uniform(20, 600), rng.uniform(0, 40), rng.uniform(0, 90),
+             rng.uniform(0, 40), rng.choice([0.0, rng.uniform(0, 15)]))
+            for i in range(n_foods)
+        ],
+    )
+    conn.executemany(
+        "INSERT INTO pantry(food_id, qty_g) VALUES (?, ?)",
+        [(rng.randint(1, n_foods), rng.choice([50, 100, 125, 250, 500, 1000])) for _ in range(rows)],
+    )
+    conn.commit()
+    return conn
+
+
+def _fetch_candidates(conn: sqlite3.Connection):
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.execute(
+        "SELECT f.id, p.qty_g, f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g, f.fiber_100g "
+        "FROM pantry p JOIN foods f ON p.food_id=f.id WHERE p.qty_g > 0 ORDER BY f.name"
+    ).fetchall()
+
+
+def _timeit(fn, conn, repeat: int) -> float:
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn(conn)
+        best = min(best, time.perf_counter() - t0)
+    return best
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args(argv)
+
+    conn = build_db(args.rows)
+    assert suggest_from_pantry(conn) == legacy_suggest_from_pantry(conn)
+    legacy = _timeit(legacy_suggest_from_pantry, conn, args.repeat)
+    vectorized = _timeit(suggest_from_pantry, conn, args.repeat)
+    fetch = _timeit(_fetch_candidates, conn, args.repeat)
+    print(f"pantry rows: {args.rows}")
+    print(f"legacy:      {legacy * 1000:8.2f} ms")
+    print(f"vectorized:  {vectorized * 1000:8.2f} ms  ({legacy / vectorized:.1f}x)")
+    print(f"  of which candidate fetch: {fetch * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,223 @@
+"""Benchmark suite with a stored baseline and a regression gate.
+
+    python -m benchmarks.suite [--foods 5000] [--lots 2000] [--days 365] [--repeat 30]
+                               [--only PATTERN] [--out benchmarks/results.json]
+                               [--baseline benchmarks/baseline.json] [--threshold 0.25]
+                               [--update-baseline]
+
+Builds the synthetic database of :mod:`benchmarks.data` in a temporary
+directory and times
+
+- ``micro.*``: the hot functions called directly on a pooled connection
+  (``day_summary``, ``tool_find_food``, ``tool_consume``, ``suggest_from_pantry``,
+  ``naive_parse``);
+- ``http.*``: agent and web endpoints through ``TestClient``.
+
+Each benchmark runs ``--warmup`` untimed calls and ``--repeat`` timed ones; the
+median is compared with the baseline. A benchmark regresses when its median
+exceeds the baseline by more than ``--threshold`` (25% by default) and by more
+than ``MIN_DELTA_MS``; any regression makes the command exit with status 1.
+Results are only compared with a baseline taken with the same data sizes.
+"""
+import argparse
+import fnmatch
+import json
+import platform
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.data import END_DAY, build_db
+
+HERE = Path(__file__).parent
+DEFAULT_BASELINE = HERE / "baseline.json"
+DEFAULT_OUT = HERE / "results.json"
+DEFAULT_THRESHOLD = 0.25
+# differenze sotto questa soglia sono rumore, anche se in percentuale sono grandi
+MIN_DELTA_MS = 0.05
+
+PARAMS = ("foods", "lots", "days", "seed")
+MESSAGES = [
+    "ho mangiato 150 g di riso basmati e 100 g di petto di pollo",
+    "aggiungi 2 vasetti di yogurt bianco da 125 g, 1 kg di pasta di semola e 3 mele da 150 g",
+    "ho bevuto 200 ml di latte parzialmente scremato",
+]
+
+
+def measure(fn: Callable[[], Any], repeat: int, warmup: int = 3) -> Dict[str, float]:
+    for _ in range(warmup):
+        fn()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append((time.perf_counter() - t0) * 1000)
+    times.sort()
+    return {
+        "median_ms": round(statistics.median(times), 4),
+        "p95_ms": round(times[min(len(times) - 1, int(0.95 * len(times)))], 4),
+        "min_ms": round(times[0], 4),
+        "runs": repeat,
+    }
+
+
+def micro_benchmarks(conn: sqlite3.Connection) -> Dict[str, Callable[[], Any]]:
+    from foodly.agent.main import naive_parse
+    from foodly.agent.tools import day_summary, suggest_from_pantry, tool_consume, tool_find_food
+    from foodly.core.models import Consume, FindFood
+
+    day = END_DAY.isoformat()
+    messages = iter(MESSAGES * 1_000_000)
+    # l'alimento con più lotti in dispensa: il decremento FIFO li attraversa tutti
+    food_id = conn.execute(
+        "SELECT food_id FROM pantry GROUP BY food_id ORDER BY COUNT(*) DESC, food_id LIMIT 1"
+    ).fetchone()[0]
+
+    def consume():
+        # consumo annullato a ogni iterazione: si parte sempre dagli stessi dati
+        tool_consume(conn, Consume(food_id=food_id, grams=1000))
+        conn.rollback()
+
+    return {
+        "micro.day_summary": lambda: day_summary(conn, day),
+        "micro.tool_find_food": lambda: tool_find_food(conn, FindFood(query="pasta integrale", limit=10)),
+        "micro.tool_consume": consume,
+        "micro.suggest_from_pantry": lambda: suggest_from_pantry(conn, day),
+        "micro.suggest_from_pantry_combo": lambda: suggest_from_pantry(conn, day, mode="combo"),
+        "micro.naive_parse": lambda: naive_parse(conn, next(messages)),
+    }
+
+
+def http_benchmarks() -> Dict[str, Callable[[], Any]]:
+    from fastapi.testclient import TestClient
+
+    from foodly.agent import main as agent_main
+    from foodly.app import main as app_main
+
+    agent = TestClient(agent_main.app)
+    web = TestClient(app_main.app)
+    day = END_DAY.isoformat()
+    # polling di un dashboard: la stessa richiesta con l'ETag già ricevuto
+    etag = web.get("/api/summary", params={"date_str": day}).headers["etag"]
+
+    def call(client, method, url, status=200, **kwargs):
+        def run():
+            resp = client.request(method, url, **kwargs)
+            if resp.status_code != status:
+                raise RuntimeError(f"{method} {url}: {resp.status_code} {resp.text[:200]}")
+        return run
+
+    return {
+        "http.agent.summary": call(agent, "GET", "/tools/summary", params={"date_str": day}),
+        "http.agent.find_food": call(agent, "GET", "/tools/find_food", params={"query": "pollo"}),
+        "http.agent.suggest": call(agent, "GET", "/tools/suggest", params={"date_str": day}),
+        "http.agent.chat_dry_run": call(
+            agent, "POST", "/agent/chat", json={"user_message": MESSAGES[0], "date_str": day, "dry_run": True}
+        ),
+        "http.web.summary": call(web, "GET", "/api/summary", params={"date_str": day}),
+        "http.web.summary_not_modified": call(
+            web, "GET", "/api/summary", status=304, params={"date_str": day}, headers={"If-None-Match": etag}
+        ),
+        "http.web.foods_page": call(web, "GET", "/api/foods", params={"q": "pasta"}),
+        "http.web.pantry_page": call(web, "GET", "/api/pantry"),
+    }
+
+
+def run_suite(params: Dict[str, int], repeat: int, warmup: int = 3, only: Optional[str] = None) -> Dict[str, Any]:
+    from foodly.core import db as core_db
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = Path(tmp) / "bench.db"
+        t0 = time.perf_counter()
+        build_db(path, foods=params["foods"], lots=params["lots"], days=params["days"], seed=params["seed"]).close()
+        setup_s = time.perf_counter() - t0
+
+        previous = core_db.DB_PATH
+        core_db.DB_PATH = path
+        conn = core_db.get_db()
+        try:
+            benches = {**micro_benchmarks(conn), **http_benchmarks()}
+            results = {}
+            for name, fn in benches.items():
+                if only and not fnmatch.fnmatch(name, only):
+                    continue
+                results[name] = measure(fn, repeat, warmup)
+                print(f"{name:36s} {results[name]['median_ms']:10.3f} ms  (p95 {results[name]['p95_ms']:.3f})", file=sys.stderr)
+        finally:
+            conn.close()
+            core_db.close_pools()
+            core_db.DB_PATH = previous
+
+    return {
+        "meta": {
+            "params": params,
+            "repeat": repeat,
+            "setup_s": round(setup_s, 3),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+        },
+        "results": results,
+    }
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], threshold: float = DEFAULT_THRESHOLD) -> List[Dict[str, Any]]:
+    """Benchmarks whose median got slower than the baseline beyond ``threshold``."""
+    regressions = []
+    for name, res in current["results"].items():
+        base = baseline["results"].get(name)
+        if base is None:
+            continue
+        now, before = res["median_ms"], base["median_ms"]
+        if now > before * (1 + threshold) and now - before > MIN_DELTA_MS:
+            regressions.append({"name": name, "baseline_ms": before, "current_ms": now, "ratio": round(now / before, 2)})
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Suite di benchmark di Foodly con confronto sulla baseline.")
+    parser.add_argument("--foods", type=int, default=5000)
+    parser.add_argument("--lots", type=int, default=2000)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=30)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--only", help="esegue solo i benchmark il cui nome corrisponde al pattern (es. 'micro.*')")
+    parser.add_argument("--out", type=Path, default=DEFAULT_OUT, help="file JSON dei risultati")
+    parser.add_argument("--baseline", type=Path, default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="rallentamento tollerato (0.25 = +25%%)")
+    parser.add_argument("--update-baseline", action="store_true", help="salva i risultati come nuova baseline")
+    args = parser.parse_args(argv)
+
+    params = {p: getattr(args, p) for p in PARAMS}
+    current = run_suite(params, args.repeat, args.warmup, args.only)
+    args.out.write_text(json.dumps(current, indent=2) + "\n")
+    print(f"risultati: {args.out}", file=sys.stderr)
+
+    if args.update_baseline:
+        args.baseline.write_text(json.dumps(current, indent=2) + "\n")
+        print(f"baseline aggiornata: {args.baseline}", file=sys.stderr)
+        return 0
+    if not args.baseline.exists():
+        print("nessuna baseline: usare --update-baseline per crearla", file=sys.stderr)
+        return 0
+    baseline = json.loads(args.baseline.read_text())
+    if baseline["meta"]["params"] != params:
+        print(f"baseline con dati diversi ({baseline['meta']['params']}): confronto saltato", file=sys.stderr)
+        return 0
+    regressions = compare(current, baseline, args.threshold)
+    for r in regressions:
+        print(f"REGRESSIONE {r['name']}: {r['baseline_ms']:.3f} -> {r['current_ms']:.3f} ms (x{r['ratio']})", file=sys.stderr)
+    if not regressions:
+        print(f"nessuna regressione oltre il {args.threshold:.0%}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,137 @@
+"""Write load test: pooled connections against the single writer.
+
+    python -m benchmarks.writes [--threads 16] [--ops 200] [--foods 500] [--lots 2000]
+
+Runs ``--threads`` threads that each log ``--ops`` consumptions (log row plus
+FIFO pantry decrement, the agent's most frequent write) on a fresh synthetic
+database, twice:
+
+- ``direct``: every write takes a pooled connection, runs ``tool_consume`` and
+  commits, as the handlers did before :mod:`foodly.core.writer`; concurrent
+  transactions wait on SQLite's lock through ``busy_timeout``;
+- ``writer``: every write is queued to the writer, which group-commits.
+
+Prints throughput, latency percentiles and ``database is locked`` errors for
+each mode, plus the writer's average batch size.
+"""
+import argparse
+import json
+import random
+import statistics
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional
+
+from benchmarks.data import build_db
+
+
+def _consume_op(foods: int, seed: int) -> Callable[[sqlite3.Connection], Any]:
+    from foodly.agent.tools import tool_consume
+    from foodly.core.models import Consume
+
+    rng = random.Random(seed)
+
+    def op(conn):
+        return tool_consume(conn, Consume(food_id=rng.randint(1, foods), grams=rng.choice([30.0, 50.0, 100.0])))
+
+    return op
+
+
+def run_mode(mode: str, path: Path, threads: int, ops: int, foods: int) -> Dict[str, Any]:
+    from foodly.core import db as core_db
+    from foodly.core import writer
+
+    latencies: List[float] = []
+    errors: List[str] = []
+    lock = threading.Lock()
+    start = threading.Barrier(threads + 1)
+
+    def worker(n: int):
+        op = _consume_op(foods, n)
+        mine, failed = [], []
+        start.wait()
+        for _ in range(ops):
+            t0 = time.perf_counter()
+            try:
+                if mode == "writer":
+                    writer.write(op)
+                else:
+                    conn = core_db.get_db()
+                    try:
+                        op(conn)
+                        conn.commit()
+                    finally:
+                        conn.close()
+            except sqlite3.OperationalError as e:
+                failed.append(str(e))
+                continue
+            mine.append((time.perf_counter() - t0) * 1000)
+        with lock:
+            latencies.extend(mine)
+            errors.extend(failed)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    start.wait()
+    t0 = time.perf_counter()
+    for w in workers:
+        w.join()
+    elapsed = time.perf_counter() - t0
+
+    latencies.sort()
+    result = {
+        "ops": len(latencies),
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "ops_per_s": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(statistics.median(latencies), 3) if latencies else None,
+        "p99_ms": round(latencies[min(len(latencies) - 1, int(0.99 * len(latencies)))], 3) if latencies else None,
+    }
+    if mode == "writer":
+        stats = writer.get_writer(path).stats()
+        result["avg_batch"] = stats["avg_batch"]
+    return result
+
+
+def run(threads: int = 16, ops: int = 200, foods: int = 500, lots: int = 2000) -> Dict[str, Dict[str, Any]]:
+    from foodly.core import db as core_db
+    from foodly.core import writer
+
+    results = {}
+    previous = core_db.DB_PATH
+    try:
+        for mode in ("direct", "writer"):
+            with tempfile.TemporaryDirectory() as tmp:
+                path = Path(tmp) / "writes.db"
+                build_db(path, foods=foods, lots=lots, days=30).close()
+                core_db.DB_PATH = path
+                try:
+                    results[mode] = run_mode(mode, path, threads, ops, foods)
+                finally:
+                    writer.close_writers()
+                    core_db.close_pools()
+    finally:
+        core_db.DB_PATH = previous
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Confronta scritture concorrenti dirette e tramite il writer.")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--ops", type=int, default=200, help="scritture per thread")
+    parser.add_argument("--foods", type=int, default=500)
+    parser.add_argument("--lots", type=int, default=2000)
+    args = parser.parse_args(argv)
+    results = run(args.threads, args.ops, args.foods, args.lots)
+    for mode, res in results.items():
+        print(f"{mode:7s} {res['ops_per_s']:9.1f} op/s  p50 {res['p50_ms']} ms  p99 {res['p99_ms']} ms  errori {res['errors']}", file=sys.stderr)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,192 @@
+"""Idempotency keys for agent chat and tool writes.
+
+A client that retries ``/agent/chat`` or a ``/tools/*`` write after a timeout
+sends the same idempotency key again (``ChatRequest.idempotency_key`` or the
+``Idempotency-Key`` header). The first request claims the key in the
+``idempotency_keys`` table and, once done, stores its serialized response
+there; retries within ``ttl`` get that response back without running the
+tools or calling the LLM again.
+
+Duplicates that arrive while the first request is still running wait for it:
+inside a process they await the same future, across processes they poll the
+row. A ``pending`` row is a lease of ``LEASE_S`` seconds, so a key claimed by a
+crashed worker can be claimed again once the lease expires. Reusing a key with
+a different payload is an error. Expired rows are purged every
+``PURGE_INTERVAL_S`` seconds. Keys are per user: each shard has its own table.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from foodly.core import metrics, writer
+from foodly.core.context import current_user
+
+IDEMPOTENCY_TTL_S = float(os.getenv("FOODLY_IDEMPOTENCY_TTL", str(24 * 3600)))
+# durata massima di una richiesta in corso (LLM con retry compresi) prima che un altro possa rieseguirla
+LEASE_S = 120.0
+POLL_S = 0.05
+PURGE_INTERVAL_S = 300.0
+
+Response = Dict[str, Any]
+
+
+class IdempotencyMismatch(ValueError):
+    """The key was already used for a different request."""
+
+
+class IdempotencyInProgress(RuntimeError):
+    """Another worker still holds the key."""
+
+
+def fingerprint(payload: Any) -> str:
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"), default=str)
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+class IdempotencyStore:
+    def __init__(self, ttl: float = IDEMPOTENCY_TTL_S, lease: float = LEASE_S):
+        self.ttl = ttl
+        self.lease = lease
+        # chiave -> (fingerprint, future del primo richiedente) per le richieste in corso in questo processo
+        self._inflight: Dict[Tuple[Optional[str], str], Tuple[str, "asyncio.Future[Response]"]] = {}
+        self._lock = threading.Lock()
+        self._last_purge = 0.0
+        self.executed = 0
+        self.replayed = 0
+        self.coalesced = 0
+        self.purged = 0
+
+    def claim(self, key: str, fp: str) -> Tuple[str, Any]:
+        """``("claimed", token)``, ``("done", response)`` or ``("pending", None)``."""
+        return writer.write(self._claim, key, fp, time.time())
+
+    def _claim(self, conn, key: str, fp: str, now: float) -> Tuple[str, Any]:
+        # la chiave si prende se è nuova o scaduta (risposta vecchia o lease abbandonato)
+        claimed = conn.execute(
+            """
+            INSERT INTO idempotency_keys(key, fingerprint, status, response, created_at, expires_at)
+            VALUES (?, ?, 'pending', NULL, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET
+                fingerprint = excluded.fingerprint, status = 'pending', response = NULL,
+                created_at = excluded.created_at, expires_at = excluded.expires_at
+            WHERE idempotency_keys.expires_at <= excluded.created_at
+            """,
+            (key, fp, now, now + self.lease),
+        ).rowcount
+        row = None if claimed else conn.execute(
+            "SELECT fingerprint, status, response FROM idempotency_keys WHERE key = ?", (key,)
+        ).fetchone()
+        if claimed:
+            return "claimed", now
+        if row["fingerprint"] != fp:
+            raise IdempotencyMismatch(f"chiave di idempotenza già usata per una richiesta diversa: {key}")
+        if row["status"] == "done":
+            return "done", json.loads(row["response"])
+        return "pending", None
+
+    def complete(self, key: str, token: float, response: Response):
+        writer.write(self._complete, key, token, response)
+
+    def _complete(self, conn, key: str, token: float, response: Response):
+        now = time.time()
+        # solo se il lease è ancora nostro
+        conn.execute(
+            "UPDATE idempotency_keys SET status = 'done', response = ?, expires_at = ? "
+            "WHERE key = ? AND status = 'pending' AND created_at = ?",
+            (json.dumps(response, ensure_ascii=False), now + self.ttl, key, token),
+        )
+        with self._lock:
+            purge = now - self._last_purge >= PURGE_INTERVAL_S
+            if purge:
+                self._last_purge = now
+        if purge:
+            self.purge(conn, now)
+
+    @staticmethod
+    def _release(conn, key: str, token: float):
+        # richiesta fallita o senza effetti: un retry deve rieseguirla
+        conn.execute("DELETE FROM idempotency_keys WHERE key = ? AND status = 'pending' AND created_at = ?", (key, token))
+
+    def purge(self, conn, now: Optional[float] = None) -> int:
+        """Delete expired responses and abandoned leases."""
+        now = time.time() if now is None else now
+        n = conn.execute("DELETE FROM idempotency_keys WHERE expires_at <= ?", (now,)).rowcount
+        with self._lock:
+            self.purged += n
+        return n
+
+    async def _settle(self, key: str, fp: str, fn: Callable[[], Awaitable[Tuple[Response, bool]]]) -> Response:
+        deadline = time.monotonic() + self.lease
+        while True:
+            state, value = await writer.awrite(self._claim, key, fp, time.time())
+            if state == "done":
+                self.replayed += 1
+                return value
+            if state == "claimed":
+                break
+            # in corso in un altro processo: si aspetta la sua risposta
+            if time.monotonic() >= deadline:
+                raise IdempotencyInProgress(f"richiesta con chiave {key} ancora in corso")
+            await asyncio.sleep(POLL_S)
+        try:
+            response, store = await fn()
+        except BaseException:
+            await writer.awrite(self._release, key, value)
+            raise
+        self.executed += 1
+        if store:
+            await writer.awrite(self._complete, key, value, response)
+        else:
+            await writer.awrite(self._release, key, value)
+        return response
+
+    async def run(self, scope: str, key: str, payload: Any, fn: Callable[[], Awaitable[Tuple[Response, bool]]]) -> Response:
+        """Run ``fn`` once per ``(scope, key)`` and return its (stored) response.
+
+        ``fn`` returns ``(response, store)``; with ``store`` false (nothing was
+        executed, e.g. the LLM did not answer) the key is released so that a
+        retry runs again.
+        """
+        key = f"{scope}:{key}"
+        fp = fingerprint(payload)
+        # la stessa chiave di due utenti sono due richieste diverse
+        local = (current_user(), key)
+        inflight = self._inflight.get(local)
+        if inflight is not None:
+            if inflight[0] != fp:
+                raise IdempotencyMismatch(f"chiave di idempotenza già usata per una richiesta diversa: {key}")
+            self.coalesced += 1
+            return await asyncio.shield(inflight[1])
+        future: "asyncio.Future[Response]" = asyncio.get_running_loop().create_future()
+        self._inflight[local] = (fp, future)
+        try:
+            response = await self._settle(key, fp, fn)
+            future.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # già propagata qui: niente avviso se nessuno la aspettava
+            raise
+        finally:
+            del self._inflight[local]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ttl_s": self.ttl,
+            "in_flight": len(self._inflight),
+            "executed": self.executed,
+            "replayed": self.replayed,
+            "coalesced": self.coalesced,
+            "purged": self.purged,
+        }
+
+
+idempotency_store = IdempotencyStore()
+metrics.register_stats("foodly_idempotency", idempotency_store.stats, ("in_flight", "executed", "replayed", "coalesced", "purged"))
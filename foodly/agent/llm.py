@@ -0,0 +1,179 @@
+"""Async LLM backend for the agent.
+
+One :class:`OpenAICompatibleBackend` per process talks to any server exposing
+the OpenAI ``/chat/completions`` API through a single pooled
+``httpx.AsyncClient``, so connections (and TLS sessions) are reused across
+requests. Each call has a timeout, is retried with exponential backoff and
+jitter on timeouts, connection errors and 408/429/5xx answers (honouring
+``Retry-After``), and waits on a semaphore that caps how many LLM calls are in
+flight at once.
+
+The backend is pluggable: :func:`set_backend` installs any object with async
+``complete()``/``aclose()`` methods, and ``FOODLY_LLM_BASE_URL`` can point the
+default backend at a local stub server for tests and benchmarks.
+``httpx`` is imported on the first call, not when the agent starts.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Protocol
+
+from foodly.core import metrics
+
+if TYPE_CHECKING:
+    import httpx
+
+LLM_BASE_URL = os.getenv("FOODLY_LLM_BASE_URL", "https://api.openai.com/v1")
+LLM_MODEL = os.getenv("FOODLY_LLM_MODEL", "gpt-4o-mini")
+LLM_TIMEOUT_S = float(os.getenv("FOODLY_LLM_TIMEOUT", "30"))
+LLM_MAX_RETRIES = int(os.getenv("FOODLY_LLM_MAX_RETRIES", "2"))
+LLM_CONCURRENCY = int(os.getenv("FOODLY_LLM_CONCURRENCY", "8"))
+
+RETRY_STATUS = {408, 409, 429, 500, 502, 503, 504}
+BACKOFF_BASE_S = 0.5
+BACKOFF_MAX_S = 8.0
+
+Message = Dict[str, Any]
+
+
+class LLMError(RuntimeError):
+    """The LLM provider could not produce an answer (after retries)."""
+
+
+class LLMBackend(Protocol):
+    model: str
+
+    async def complete(
+        self, api_key: str, messages: List[Message], tools: Optional[List[Dict[str, Any]]] = None
+    ) -> Message: ...
+
+    async def aclose(self) -> None: ...
+
+
+class OpenAICompatibleBackend:
+    def __init__(
+        self,
+        base_url: str = LLM_BASE_URL,
+        model: str = LLM_MODEL,
+        timeout: float = LLM_TIMEOUT_S,
+        max_retries: int = LLM_MAX_RETRIES,
+        concurrency: int = LLM_CONCURRENCY,
+        transport: Optional[httpx.AsyncBaseTransport] = None,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.model = model
+        self.timeout = timeout
+        self.max_retries = max(0, max_retries)
+        self.concurrency = max(1, concurrency)
+        self._transport = transport
+        self._client: Optional[httpx.AsyncClient] = None
+        self._sem = asyncio.Semaphore(self.concurrency)
+        self.calls = 0
+        self.retries = 0
+        self.failures = 0
+        self.in_flight = 0
+
+    def _http(self) -> httpx.AsyncClient:
+        import httpx
+
+        # creato alla prima chiamata, dentro l'event loop che lo userà
+        if self._client is None or self._client.is_closed:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=httpx.Timeout(self.timeout, connect=min(self.timeout, 5.0)),
+                limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency),
+                transport=self._transport,
+            )
+        return self._client
+
+    def _backoff(self, attempt: int, resp: Optional[httpx.Response]) -> float:
+        retry_after = resp.headers.get("retry-after") if resp is not None else None
+        if retry_after:
+            try:
+                return min(float(retry_after), BACKOFF_MAX_S)
+            except ValueError:
+                pass
+        # full jitter: evita che i client ritentino tutti insieme
+        return random.uniform(0, min(BACKOFF_MAX_S, BACKOFF_BASE_S * 2 ** attempt))
+
+    async def complete(
+        self, api_key: str, messages: List[Message], tools: Optional[List[Dict[str, Any]]] = None
+    ) -> Message:
+        """Return the assistant message of a chat completion (``content``, ``tool_calls``)."""
+        payload: Dict[str, Any] = {"model": self.model, "messages": messages}
+        if tools:
+            payload["tools"] = tools
+            payload["tool_choice"] = "auto"
+        headers = {"Authorization": f"Bearer {api_key}"}
+        import httpx
+
+        self.calls += 1
+        error: Optional[Exception] = None
+        for attempt in range(self.max_retries + 1):
+            resp = None
+            # il semaforo copre solo la richiesta, non l'attesa tra un tentativo e l'altro
+            async with self._sem:
+                self.in_flight += 1
+                try:
+                    resp = await self._http().post("/chat/completions", json=payload, headers=headers)
+                except httpx.TransportError as e:
+                    error = e
+                finally:
+                    self.in_flight -= 1
+            if metrics.enabled():
+                metrics.llm_attempts.inc(str(resp.status_code) if resp is not None else "transport_error")
+            if resp is not None:
+                if resp.status_code not in RETRY_STATUS:
+                    if resp.is_error:
+                        self.failures += 1
+                        raise LLMError(f"LLM HTTP {resp.status_code}: {resp.text[:200]}")
+                    try:
+                        return resp.json()["choices"][0]["message"]
+                    except (ValueError, KeyError, IndexError) as e:
+                        self.failures += 1
+                        raise LLMError("risposta LLM non valida") from e
+                error = LLMError(f"LLM HTTP {resp.status_code}")
+            if attempt < self.max_retries:
+                self.retries += 1
+                await asyncio.sleep(self._backoff(attempt, resp))
+        self.failures += 1
+        raise LLMError(f"LLM non raggiungibile dopo {self.max_retries + 1} tentativi: {error}") from error
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "model": self.model,
+            "concurrency": self.concurrency,
+            "in_flight": self.in_flight,
+            "calls": self.calls,
+            "retries": self.retries,
+            "failures": self.failures,
+        }
+
+
+_backend: Optional[LLMBackend] = None
+
+
+def get_backend() -> LLMBackend:
+    global _backend
+    if _backend is None:
+        _backend = OpenAICompatibleBackend()
+    return _backend
+
+
+def set_backend(backend: Optional[LLMBackend]) -> Optional[LLMBackend]:
+    """Install ``backend`` (``None`` restores the default) and return the previous one."""
+    global _backend
+    previous, _backend = _backend, backend
+    return previous
+
+
+async def aclose_backend():
+    if _backend is not None:
+        await _backend.aclose()
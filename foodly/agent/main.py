@@ -1,19 +1,40 @@
 from __future__ import annotations
+import asyncio
 import os
+import queue
 import sqlite3
-import re
 import json
-from typing import Any, Dict, List
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, List, Optional, Tuple
 
-from fastapi import FastAPI, Body
+from fastapi import Body, Depends, FastAPI, Header, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
 
-from foodly.core.db import get_db
+from foodly.agent import llm
+from foodly.agent.idempotency import IdempotencyInProgress, IdempotencyMismatch, idempotency_store
+from foodly.agent.matcher import extract_items
+from foodly.agent.plan_cache import plan_cache, plan_key
+
+from foodly.core import metrics, tenancy, writer
+from foodly.core.barcode import barcode_cache
+from foodly.core.context import QUERY_COUNT_HEADER, current_context, request_scope
+from foodly.core.db import db_session, get_db, init_db
+from foodly.core.httpcache import cached_json
 from foodly.core.calculations import compute_targets
+from foodly.core.search import search_foods
 from foodly.core.models import (
     AddToPantry,
     Consume,
+    ConsumeBatch,
+    FindByBarcode,
     FindFood,
     Summary,
+    SuggestMode,
     ToolCall,
     ChatRequest,
     ChatResponse,
@@ -21,12 +42,42 @@ from foodly.core.models import (
 from foodly.agent.tools import (
     tool_add_to_pantry,
     tool_consume,
+    tool_consume_batch,
+    tool_find_by_barcode,
     tool_find_food,
     day_summary,
     suggest_from_pantry,
 )
 
-app = FastAPI(title="Foodly Agent")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema verificato all'avvio, non all'import: con lo schema aggiornato è una sola PRAGMA.
+    # Nessuna richiesta è ancora servita, quindi si può bloccare il loop
+    if not tenancy.REQUIRE_USER:
+        init_db()
+    yield
+    # chiude il client HTTP condiviso verso il provider LLM
+    await llm.aclose_backend()
+    # scrive le operazioni ancora in coda
+    await run_in_threadpool(writer.close_writers)
+
+
+app = FastAPI(title="Foodly Agent", lifespan=lifespan)
+
+
+@app.middleware("http")
+async def request_context(request: Request, call_next):
+    # memo condiviso da riepilogo, target e suggerimento + conteggio query della richiesta
+    with request_scope() as ctx:
+        response = await call_next(request)
+    response.headers[QUERY_COUNT_HEADER] = str(ctx.queries)
+    return response
+
+
+metrics.instrument(app, "agent")
+tenancy.route_by_user(app)
 
 SYSTEM_PROMPT = (
     "Agisci come Coach nutrizionale conversazionale. Capisci richieste in italiano; "
@@ -40,224 +91,520 @@ SYSTEM_PROMPT = (
     "10) Mantieni la tenuta d'inventario: non proporre quantità superiori alla dispensa e aggiorna sempre lo stock con add_to_pantry/consume."
 )
 
-TOOLS_SCHEMA = [
-    {
-        "type": "function",
-        "function": {
-            "name": "add_to_pantry",
-            "description": "Aggiunge quantità in grammi alla dispensa per un food_id.",
-            "parameters": AddToPantry.model_json_schema(),
+@lru_cache(maxsize=None)
+def tools_schema() -> List[Dict[str, Any]]:
+    # schemi JSON dei modelli generati alla prima chiamata LLM, non all'avvio
+    return [
+        {
+            "type": "function",
+            "function": {
+                "name": "add_to_pantry",
+                "description": "Aggiunge quantità in grammi alla dispensa per un food_id.",
+                "parameters": AddToPantry.model_json_schema(),
+            },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "consume",
-            "description": "Registra consumo in grammi e decrementa la dispensa FIFO.",
-            "parameters": Consume.model_json_schema(),
+        {
+            "type": "function",
+            "function": {
+                "name": "consume",
+                "description": "Registra consumo in grammi e decrementa la dispensa FIFO.",
+                "parameters": Consume.model_json_schema(),
+            },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "find_food",
-            "description": "Cerca alimenti per nome (LIKE).",
-            "parameters": FindFood.model_json_schema(),
+        {
+            "type": "function",
+            "function": {
+                "name": "consume_batch",
+                "description": "Registra più consumi (es. un pasto intero) in un'unica operazione atomica e decrementa la dispensa FIFO.",
+                "parameters": ConsumeBatch.model_json_schema(),
+            },
         },
-    },
-    {
-        "type": "function",
-        "function": {
-            "name": "daily_summary",
-            "description": "Restituisce riepilogo per la data.",
-            "parameters": Summary.model_json_schema(),
+        {
+            "type": "function",
+            "function": {
+                "name": "find_food",
+                "description": "Cerca alimenti per nome o marca (full-text, senza accenti, singolare/plurale), ordinati per pertinenza.",
+                "parameters": FindFood.model_json_schema(),
+            },
         },
-    },
-]
-
-ADD_PAT = re.compile(r"aggiung[ei]|metti(?: .+)? in dispensa", re.I)
-CONS_PAT = re.compile(r"(ho )?(mangiato|consumato|usa|consuma)", re.I)
-# numeri seguiti da g o ml
-GRAMS_PAT = re.compile(r"(\d+)(?:\s)?(g|ml)\b", re.I)
-# es. "2 x", "2 vasetti", "2 bottiglie"
-QTY_PAT = re.compile(
-    r"(\d+)\s*(?:x|scatolette?|confezioni?|vasetti|lattine|bottiglie)", re.I
-)
-# es. "2 vasetti da 125 g"
-MULTI_PAT = re.compile(
-    r"(\d+)\s*(?:x|scatolette?|confezioni?|vasetti|lattine|bottiglie).*?da\s*(\d+)\s*(g|ml)",
-    re.I,
-)
-
-FOOD_KEYS = [
-    "tonno",
-    "gallette",
-    "prosciutto",
-    "riso",
-    "pollo",
-    "yogurt",
-    "latte",
-]
-
+        {
+            "type": "function",
+            "function": {
+                "name": "find_by_barcode",
+                "description": "Risolve uno o più codici a barre (EAN) negli alimenti del catalogo; null per i codici sconosciuti.",
+                "parameters": FindByBarcode.model_json_schema(),
+            },
+        },
+        {
+            "type": "function",
+            "function": {
+                "name": "daily_summary",
+                "description": "Restituisce riepilogo per la data.",
+                "parameters": Summary.model_json_schema(),
+            },
+        },
+    ]
 
 def naive_parse(conn: sqlite3.Connection, text: str) -> List[ToolCall]:
-    text = text.strip()
+    # Un solo passaggio sul trie del catalogo: tutte le coppie (alimento, quantità) del messaggio
     actions: List[ToolCall] = []
-    # Trova alimento per nome
-    def find_id(name: str) -> int | None:
-        r = conn.execute("SELECT id FROM foods WHERE name LIKE ? LIMIT 1", (f"%{name}%",)).fetchone()
-        return int(r[0]) if r else None
-
-    if ADD_PAT.search(text):
-        grams = 0.0
-        mq = MULTI_PAT.search(text)
-        if mq:
-            qty = float(mq.group(1))
-            grams = qty * float(mq.group(2))
+    for item in extract_items(conn, text):
+        fid = item.food_id
+        if fid is None:
+            # parola fuori catalogo: ricerca full-text (unico accesso al DB)
+            r = search_foods(conn, item.query, 1, columns=("id",))
+            fid = int(r[0]["id"]) if r else None
+        if fid is None:
+            continue
+        if item.intent == "add":
+            actions.append(ToolCall(name="add_to_pantry", arguments=AddToPantry(food_id=fid, qty_g=item.grams).model_dump()))
         else:
-            m = GRAMS_PAT.search(text)
-            if m:
-                grams = float(m.group(1))
-            mq = QTY_PAT.search(text)
-            if mq and grams == 0.0:
-                qty = float(mq.group(1))
-                # deduci 56 g se parla di tonno
-                grams = qty * (56.0 if "tonno" in text.lower() else 100.0)
-        # identifica food
-        food = None
-        for key in FOOD_KEYS:
-            if key in text.lower():
-                food = key; break
-        if food is None:
-            # fallback: prima parola ‘alimento’ dopo verbo
-            tokens = re.split(r"\s+", text)
-            if len(tokens) > 1:
-                food = tokens[-1]
-        fid = find_id(food) if food else None
-        if fid and grams>0:
-            actions.append(ToolCall(name="add_to_pantry", arguments=AddToPantry(food_id=fid, qty_g=grams).model_dump()))
-        return actions
-
-    if CONS_PAT.search(text):
-        grams = 0.0
-        m = GRAMS_PAT.search(text)
-        if m:
-            grams = float(m.group(1))
-        food = None
-        for key in FOOD_KEYS:
-            if key in text.lower():
-                food = key; break
-        fid = find_id(food) if food else None
-        if fid and grams>0:
-            actions.append(ToolCall(name="consume", arguments=Consume(food_id=fid, grams=grams).model_dump()))
-        return actions
-
-    # default: nessuna azione → solo riepilogo/suggerimento
-    return []
+            actions.append(ToolCall(name="consume", arguments=Consume(food_id=fid, grams=item.grams).model_dump()))
+    return actions
 
 
-def execute_actions(conn: sqlite3.Connection, actions: List[ToolCall], dry: bool=False) -> List[Dict[str, Any]]:
-    results = []
-    if dry:
-        return [{"name": a.name, "status": "dry_run", "arguments": a.arguments} for a in actions]
+def _run_action(conn: sqlite3.Connection, a: ToolCall) -> Dict[str, Any]:
+    if a.name == "add_to_pantry":
+        p = AddToPantry(**a.arguments); tool_add_to_pantry(conn, p); return {"name": a.name, "status": "ok"}
+    elif a.name == "consume":
+        c = Consume(**a.arguments); tool_consume(conn, c); return {"name": a.name, "status": "ok"}
+    elif a.name == "consume_batch":
+        b = ConsumeBatch(**a.arguments); shortfall = tool_consume_batch(conn, b.items); return {"name": a.name, "status": "ok", "shortfall": shortfall}
+    elif a.name == "find_food":
+        q = FindFood(**a.arguments); data = tool_find_food(conn, q); return {"name": a.name, "status": "ok", "data": data}
+    elif a.name == "find_by_barcode":
+        q = FindByBarcode(**a.arguments); data = tool_find_by_barcode(conn, q); return {"name": a.name, "status": "ok", "data": data}
+    elif a.name == "daily_summary":
+        q = Summary(**a.arguments); data = day_summary(conn, q.date_str); return {"name": a.name, "status": "ok", "data": data}
+    return {"name": a.name, "status": "unknown_tool"}
+
+
+def iter_actions(conn: sqlite3.Connection, actions: List[ToolCall], dry: bool=False) -> Iterator[Dict[str, Any]]:
+    # un risultato per azione, appena eseguita (il commit resta al chiamante)
     for a in actions:
-        if a.name == "add_to_pantry":
-            p = AddToPantry(**a.arguments); tool_add_to_pantry(conn, p); results.append({"name": a.name, "status": "ok"})
-        elif a.name == "consume":
-            c = Consume(**a.arguments); tool_consume(conn, c); results.append({"name": a.name, "status": "ok"})
-        elif a.name == "find_food":
-            q = FindFood(**a.arguments); data = tool_find_food(conn, q); results.append({"name": a.name, "status": "ok", "data": data})
-        elif a.name == "daily_summary":
-            q = Summary(**a.arguments); data = day_summary(conn, q.date_str); results.append({"name": a.name, "status": "ok", "data": data})
-        else:
-            results.append({"name": a.name, "status": "unknown_tool"})
-    return results
+        if dry:
+            yield {"name": a.name, "status": "dry_run", "arguments": a.arguments}
+            continue
+        t0 = time.perf_counter()
+        status = "error"
+        try:
+            result = _run_action(conn, a)
+            status = result["status"]
+        finally:
+            if metrics.enabled():
+                # nomi sconosciuti raggruppati: l'etichetta non cresce con l'input dell'LLM
+                tool = a.name if status != "unknown_tool" else "unknown"
+                metrics.tool_latency.observe(time.perf_counter() - t0, tool, status)
+        yield result
 
 
-@app.post("/agent/chat", response_model=ChatResponse)
-def agent_chat(req: ChatRequest = Body(...)):
-    conn = get_db()
+def execute_actions(conn: sqlite3.Connection, actions: List[ToolCall], dry: bool=False) -> List[Dict[str, Any]]:
+    return list(iter_actions(conn, actions, dry))
 
-    # 1) Determina azioni da eseguire (LLM o fallback rule-based)
-    actions: List[ToolCall] = []
-    if req.use_rule_based:
-        actions = naive_parse(conn, req.user_message)
-    else:
-        api_key = os.getenv("FOODLY_API")
-        if not api_key:
-            r = conn.execute("SELECT llm_api_key FROM user_settings WHERE id=1").fetchone()
-            api_key = r["llm_api_key"] if r and r["llm_api_key"] else None
-        if not api_key:
-            conn.close()
-            return ChatResponse(actions=[], results={}, message="Imposta la variabile FOODLY_API nelle impostazioni e riprova.")
-        conn.execute("UPDATE user_settings SET llm_api_key=? WHERE id=1", (api_key,))
-        conn.commit()
+
+def _emit_actions(conn: sqlite3.Connection, actions: List[ToolCall], emit: Callable[[Dict[str, Any]], None]):
+    # operazione del writer: passa ogni risultato a emit senza aspettare la fine del turno
+    for result in iter_actions(conn, actions):
+        emit(result)
+
+
+def _llm_api_key() -> str | None:
+    api_key = os.getenv("FOODLY_API")
+    conn = get_db()
+    try:
+        r = conn.execute("SELECT llm_api_key FROM user_settings WHERE id=1").fetchone()
+        stored = r["llm_api_key"] if r and r["llm_api_key"] else None
+        api_key = api_key or stored
+    finally:
         conn.close()
-        from openai import OpenAI
-        client = OpenAI(api_key=api_key)
-        prompt = SYSTEM_PROMPT
-        if req.require_confirm:
-            prompt += " L'utente richiede conferma per operazioni critiche."
-        resp = client.chat.completions.create(
-            model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": prompt},
+    # scrive solo se la chiave dell'ambiente è nuova
+    if api_key and api_key != stored:
+        writer.write(_store_api_key, api_key)
+    return api_key
+
+
+def _store_api_key(conn: sqlite3.Connection, api_key: str):
+    conn.execute("UPDATE user_settings SET llm_api_key=? WHERE id=1", (api_key,))
+
+
+def _system_prompt(req: ChatRequest) -> str:
+    prompt = SYSTEM_PROMPT
+    if req.require_confirm:
+        prompt += " L'utente richiede conferma per operazioni critiche."
+    return prompt
+
+
+async def _llm_plan(api_key: str, req: ChatRequest) -> List[ToolCall]:
+    t0 = time.perf_counter()
+    outcome = "error"
+    try:
+        msg = await llm.get_backend().complete(
+            api_key,
+            [
+                {"role": "system", "content": _system_prompt(req)},
                 {"role": "user", "content": req.user_message},
             ],
-            tools=TOOLS_SCHEMA,
-            tool_choice="auto",
+            tools=tools_schema(),
         )
-        msg = resp.choices[0].message
-        for tc in getattr(msg, "tool_calls", []) or []:
-            try:
-                args = json.loads(tc.function.arguments)
-            except Exception:
-                args = {}
-            actions.append(ToolCall(name=tc.function.name, arguments=args))
-
-    # 2) Esegui tools
-    results = execute_actions(conn, actions, dry=req.dry_run)
-    conn.commit(); conn.close()
-
-    # 3) Riepilogo e suggerimento
+        outcome = "ok"
+    finally:
+        if metrics.enabled():
+            metrics.llm_latency.observe(time.perf_counter() - t0, outcome)
+    actions: List[ToolCall] = []
+    for tc in msg.get("tool_calls") or []:
+        fn = tc.get("function") or {}
+        try:
+            args = json.loads(fn.get("arguments") or "{}")
+        except Exception:
+            args = {}
+        actions.append(ToolCall(name=fn.get("name", ""), arguments=args))
+    return actions
+
+
+async def _cached_plan(api_key: str, req: ChatRequest) -> List[ToolCall]:
+    # stesso messaggio normalizzato + stesso prompt/strumenti/modello => stesso piano
+    key = plan_key(req.user_message, _system_prompt(req), tools_schema(), req.require_confirm, llm.get_backend().model)
+    if req.bypass_cache:
+        plan_cache.bypassed += 1
+    else:
+        actions = await run_in_threadpool(plan_cache.get, key)
+        if actions is not None:
+            return actions
+    actions = await _llm_plan(api_key, req)
+    await run_in_threadpool(plan_cache.put, key, actions)
+    return actions
+
+
+async def _idempotent(scope: str, key: str, payload: Dict[str, Any], fn) -> Dict[str, Any]:
+    try:
+        return await idempotency_store.run(scope, key, payload, fn)
+    except IdempotencyMismatch as e:
+        raise HTTPException(status_code=422, detail=str(e))
+    except IdempotencyInProgress as e:
+        raise HTTPException(status_code=409, detail=str(e))
+
+
+async def _answer_chat(req: ChatRequest) -> Tuple[ChatResponse, bool]:
+    # il flag dice se il turno è stato eseguito (e quindi va ricordato per i retry)
+    # 1) Determina azioni da eseguire (LLM o fallback rule-based).
+    # La chiamata LLM è asincrona: non occupa né un thread né una connessione del pool.
+    actions: List[ToolCall] = []
+    if not req.use_rule_based:
+        api_key = await run_in_threadpool(_llm_api_key)
+        if not api_key:
+            return ChatResponse(actions=[], results={}, message="Imposta la variabile FOODLY_API nelle impostazioni e riprova."), False
+        try:
+            actions = await _cached_plan(api_key, req)
+        except llm.LLMError:
+            return ChatResponse(actions=[], results={}, message="Il modello linguistico non risponde, riprova tra poco."), False
+    return await run_in_threadpool(_chat_turn, req, actions), True
+
+
+@app.post("/agent/chat", response_model=ChatResponse)
+async def agent_chat(req: ChatRequest = Body(...)):
+    if not req.idempotency_key:
+        return (await _answer_chat(req))[0]
+
+    async def turn():
+        resp, executed = await _answer_chat(req)
+        return resp.model_dump(mode="json"), executed
+
+    # un retry con la stessa chiave riceve la risposta salvata: niente strumenti né LLM
+    payload = req.model_dump(mode="json", exclude={"idempotency_key"})
+    return ChatResponse(**await _idempotent("chat", req.idempotency_key, payload, turn))
+
+
+@app.get("/agent/plan_cache")
+def http_plan_cache_stats():
+    return {"data": plan_cache.stats()}
+
+
+def _chat_turn(req: ChatRequest, actions: List[ToolCall]) -> ChatResponse:
     conn = get_db()
+    try:
+        if req.use_rule_based:
+            actions = naive_parse(conn, req.user_message)
+        return _run_turn(conn, req, actions)
+    finally:
+        conn.close()
+
+
+def _turn_events(conn: sqlite3.Connection, req: ChatRequest, actions: List[ToolCall]) -> Iterator[Tuple[str, Any]]:
+    # 2) Esegui tools: tutte le azioni in una sola operazione del writer (tutte o nessuna)
+    if req.dry_run:
+        for result in iter_actions(conn, actions, dry=True):
+            yield "tool_result", result
+    else:
+        # ogni risultato esce appena l'azione è eseguita; il commit del turno arriva prima del riepilogo
+        results: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        end = object()
+        future = writer.submit(_emit_actions, actions, results.put)
+        future.add_done_callback(lambda _: results.put(end))
+        result = results.get()
+        while result is not end:
+            yield "tool_result", result
+            result = results.get()
+        # errore di un'azione o del commit: niente è stato scritto
+        future.result()
+
+    # 3) Riepilogo e suggerimento (stessa connessione, dati appena confermati)
     totals = day_summary(conn, req.date_str)
     targets = compute_targets(conn)
-    sugg = suggest_from_pantry(conn, req.date_str)
-    conn.close()
+    yield "summary", {"totals": totals, "targets": targets}
+    sugg = suggest_from_pantry(conn, req.date_str, mode=req.suggest_mode.value)
+    yield "suggestion", sugg
 
     # 4) Messaggio sintetico
-    def pct(part, whole):
-        return round(100*part/whole) if whole>0 else 0
+    yield "message", {"message": _compose_message(totals, targets, sugg)}
+
+
+def _compose_message(totals: Dict[str, float], targets: Dict[str, float], sugg: Dict[str, Any]) -> str:
     msg = (
         f"Riepilogo: {round(totals['kcal'])}/{round(targets['kcal'])} kcal — "
         f"P {round(totals['prot_g'])}/{round(targets['prot_g'])} g, "
         f"C {round(totals['carb_g'])}/{round(targets['carb_g'])} g, "
         f"F {round(totals['fat_g'])}/{round(targets['fat_g'])} g. "
     )
-    if sugg.get("options"):
+    if sugg.get("options") and sugg.get("mode") == "combo":
+        d = sugg["total_delta"]
+        foods = " + ".join(f"{o['grams']} g di {o['name']}" for o in sugg["options"])
+        msg += f"Proposta: {foods} (≈ +{d['kcal']} kcal, +{d['prot_g']}P, +{d['carb_g']}C, +{d['fat_g']}F)."
+    elif sugg.get("options"):
         o = sugg["options"][0]
         msg += f"Proposta: {o['grams']} g di {o['name']} (≈ +{o['delta']['kcal']} kcal, +{o['delta']['prot_g']}P, +{o['delta']['carb_g']}C, +{o['delta']['fat_g']}F)."
     else:
         msg += sugg.get("note", "")
+    return msg
+
+
+def _add_event(resp: Dict[str, Any], event: str, data: Any):
+    # ricompone i campi di ChatResponse dagli eventi del turno
+    if event == "actions":
+        resp["actions"] = data
+    elif event == "tool_result":
+        resp["results"]["tool_results"].append(data)
+    elif event == "summary":
+        resp["results"].update(data)
+    elif event == "suggestion":
+        resp["results"]["suggestion"] = data
+    elif event == "message":
+        resp["message"] = data["message"]
+
+
+def _response_events(resp: Dict[str, Any]) -> Iterator[Tuple[str, Any]]:
+    # inverso di _add_event: gli eventi di un turno già eseguito, dalla risposta salvata
+    results = resp["results"]
+    yield "actions", resp["actions"]
+    for result in results.get("tool_results", []):
+        yield "tool_result", result
+    if "totals" in results:
+        yield "summary", {"totals": results["totals"], "targets": results["targets"]}
+    if "suggestion" in results:
+        yield "suggestion", results["suggestion"]
+    yield "message", {"message": resp["message"]}
+
+
+def _run_turn(conn: sqlite3.Connection, req: ChatRequest, actions: List[ToolCall]) -> ChatResponse:
+    resp: Dict[str, Any] = {"actions": actions, "results": {"tool_results": []}, "message": ""}
+    for event, data in _turn_events(conn, req, actions):
+        _add_event(resp, event, data)
+    return ChatResponse(**resp)
+
+
+async def chat_events(req: ChatRequest) -> AsyncIterator[Tuple[str, Any]]:
+    """Events of one chat turn, each one as soon as it is ready.
+
+    ``actions`` (right after parsing/planning), one ``tool_result`` per action,
+    ``summary`` (totals and targets), ``suggestion``, ``message`` and finally
+    ``done`` with the elapsed time; ``error`` replaces the rest on failure.
+    """
+    t0 = time.perf_counter()
+    actions: List[ToolCall] = []
+    if not req.use_rule_based:
+        api_key = await run_in_threadpool(_llm_api_key)
+        if not api_key:
+            yield "message", {"message": "Imposta la variabile FOODLY_API nelle impostazioni e riprova."}
+            yield "done", {"elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+            return
+        try:
+            actions = await _cached_plan(api_key, req)
+        except llm.LLMError:
+            yield "error", {"message": "Il modello linguistico non risponde, riprova tra poco."}
+            return
+    conn = await run_in_threadpool(get_db)
+    try:
+        if req.use_rule_based:
+            actions = await run_in_threadpool(naive_parse, conn, req.user_message)
+        yield "actions", [a.model_dump() for a in actions]
+        # ogni passo del turno gira nel threadpool; l'evento parte appena pronto
+        events = _turn_events(conn, req, actions)
+        while True:
+            item = await run_in_threadpool(next, events, None)
+            if item is None:
+                break
+            yield item
+    except Exception as e:
+        yield "error", {"message": f"Errore durante l'esecuzione: {e}"}
+        return
+    finally:
+        await run_in_threadpool(conn.close)
+    ctx = current_context()
+    done = {"elapsed_ms": round((time.perf_counter() - t0) * 1000, 1)}
+    if ctx is not None:
+        done["queries"] = ctx.queries
+    yield "done", done
+
+
+async def open_chat_stream(req: ChatRequest) -> AsyncIterator[Tuple[str, Any]]:
+    """Events of the turn ``req``, honouring its idempotency key like ``/agent/chat``.
+
+    Without a key this is :func:`chat_events`. With one, the turn starts right
+    away (``HTTPException`` 409/422 are raised here, before any event) and its
+    events are streamed as it runs; a retry gets the stored response back as
+    ``actions`` ... ``message`` events and a ``done`` marked ``replayed``.
+    """
+    if not req.idempotency_key:
+        return chat_events(req)
+    t0 = time.perf_counter()
+    queue: asyncio.Queue = asyncio.Queue()
+
+    async def turn():
+        resp: Dict[str, Any] = {"actions": [], "results": {"tool_results": []}, "message": ""}
+        seen = set()
+        try:
+            async for event, data in chat_events(req):
+                queue.put_nowait((event, data))
+                _add_event(resp, event, data)
+                seen.add(event)
+        finally:
+            queue.put_nowait(None)
+        # come in agent_chat: si ricorda solo un turno che ha eseguito le azioni
+        return ChatResponse(**resp).model_dump(mode="json"), "actions" in seen and "error" not in seen
 
-    return ChatResponse(actions=actions, results={"tool_results": results, "totals": totals, "targets": targets, "suggestion": sugg}, message=msg)
+    payload = req.model_dump(mode="json", exclude={"idempotency_key"})
+    task = asyncio.ensure_future(_idempotent("chat", req.idempotency_key, payload, turn))
+    # il turno prosegue anche se il client si disconnette: il retry troverà la risposta salvata
+    task.add_done_callback(lambda t: t.cancelled() or t.exception())
+    first = asyncio.ensure_future(queue.get())
+    await asyncio.wait((task, first), return_when=asyncio.FIRST_COMPLETED)
+    if not first.done():
+        # risposta salvata (o di una richiesta gemella): turn non è mai partito
+        first.cancel()
+        response = await task
 
+        async def replay():
+            for item in _response_events(response):
+                yield item
+            yield "done", {"elapsed_ms": round((time.perf_counter() - t0) * 1000, 1), "replayed": True}
+
+        return replay()
+
+    async def live():
+        item = first.result()
+        while item is not None:
+            yield item
+            item = await queue.get()
+        await task
+
+    return live()
+
+
+def encode_event(event: str, data: Any, fmt: str = "ndjson") -> bytes:
+    data = jsonable_encoder(data)
+    if fmt == "sse":
+        return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode()
+    return (json.dumps({"event": event, "data": data}, ensure_ascii=False) + "\n").encode()
+
+
+STREAM_MEDIA_TYPES = {"ndjson": "application/x-ndjson", "sse": "text/event-stream"}
+# niente cache né buffering dei proxy (nginx) sullo stream
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def stream_format(request: Request, fmt: Optional[str]) -> str:
+    if fmt in STREAM_MEDIA_TYPES:
+        return fmt
+    return "sse" if "text/event-stream" in request.headers.get("accept", "") else "ndjson"
+
+
+@app.post("/agent/chat/stream")
+async def agent_chat_stream(request: Request, req: ChatRequest = Body(...), format: Optional[str] = Query(None, pattern="^(ndjson|sse)$")):
+    fmt = stream_format(request, format)
+    events = await open_chat_stream(req)
+
+    async def body():
+        async for event, data in events:
+            yield encode_event(event, data, fmt)
+
+    return StreamingResponse(body(), media_type=STREAM_MEDIA_TYPES[fmt], headers=STREAM_HEADERS)
+
+
+async def _tool_write(scope: str, key: Optional[str], payload: Any, write) -> Dict[str, Any]:
+    if not key:
+        return await writer.awrite(write)
+
+    async def execute():
+        return await writer.awrite(write), True
+
+    return await _idempotent(scope, key, payload.model_dump(mode="json"), execute)
 
 @app.post("/tools/add_to_pantry")
-def http_add_to_pantry(p: AddToPantry):
-    conn = get_db(); tool_add_to_pantry(conn, p); conn.commit(); conn.close()
-    return {"status": "ok"}
+async def http_add_to_pantry(p: AddToPantry, idempotency_key: Optional[str] = Header(None)):
+    def write(conn):
+        tool_add_to_pantry(conn, p); return {"status": "ok"}
+    return await _tool_write("add_to_pantry", idempotency_key, p, write)
 
 @app.post("/tools/consume")
-def http_consume(c: Consume):
-    conn = get_db(); tool_consume(conn, c); conn.commit(); conn.close()
-    return {"status": "ok"}
+async def http_consume(c: Consume, idempotency_key: Optional[str] = Header(None)):
+    def write(conn):
+        tool_consume(conn, c); return {"status": "ok"}
+    return await _tool_write("consume", idempotency_key, c, write)
+
+@app.post("/tools/consume_batch")
+async def http_consume_batch(b: ConsumeBatch, idempotency_key: Optional[str] = Header(None)):
+    def write(conn):
+        shortfall = tool_consume_batch(conn, b.items)
+        return {"status": "ok", "logged": len(b.items), "shortfall": shortfall}
+    return await _tool_write("consume_batch", idempotency_key, b, write)
 
 @app.get("/tools/find_food")
-def http_find_food(query: str, limit: int = 10):
-    conn = get_db(); data = tool_find_food(conn, FindFood(query=query, limit=limit)); conn.close(); return {"data": data}
+def http_find_food(query: str, limit: int = 10, conn: sqlite3.Connection = Depends(db_session)):
+    data = tool_find_food(conn, FindFood(query=query, limit=limit)); return {"data": data}
+
+@app.get("/tools/food_by_barcode")
+def http_food_by_barcode(barcode: str, conn: sqlite3.Connection = Depends(db_session)):
+    data = tool_find_by_barcode(conn, FindByBarcode(barcodes=[barcode]))
+    food = next(iter(data.values()))
+    if food is None:
+        raise HTTPException(status_code=404, detail=f"Barcode sconosciuto: {barcode}")
+    return {"data": food}
+
+@app.post("/tools/food_by_barcode")
+def http_foods_by_barcode(q: FindByBarcode, conn: sqlite3.Connection = Depends(db_session)):
+    data = tool_find_by_barcode(conn, q); return {"data": data}
+
+@app.get("/tools/barcode_cache")
+def http_barcode_cache_stats():
+    return {"data": barcode_cache.stats()}
+
+@app.get("/tools/idempotency")
+def http_idempotency_stats():
+    return {"data": idempotency_store.stats()}
+
+@app.get("/tools/suggest")
+def http_suggest(
+    date_str: str | None = None,
+    mode: SuggestMode = SuggestMode.single,
+    max_items: int = Query(3, ge=1, le=5),
+    conn: sqlite3.Connection = Depends(db_session),
+):
+    return {"data": suggest_from_pantry(conn, date_str, mode=mode.value, max_items=max_items)}
 
 @app.get("/tools/summary")
-def http_summary(date_str: str | None = None):
-    conn = get_db(); data = day_summary(conn, date_str); conn.close(); return {"data": data}
+def http_summary(request: Request, date_str: str | None = None, conn: sqlite3.Connection = Depends(db_session)):
+    date_str = date_str or date.today().isoformat()
+
+    def build():
+        return {"data": day_summary(conn, date_str)}
+
+    return cached_json(request, conn, "tools_summary", date_str, build, tables=("daily_totals",))
@@ -0,0 +1,315 @@
+"""Catalogue-driven matcher for the rule-based parser.
+
+Food names and aliases are compiled into a token trie (one node per folded
+word), so a message is matched against the whole catalogue in a single
+left-to-right pass, keeping the longest name at each position. Each food is
+reachable by:
+
+- its full name ("gallette di mais") and every alias in ``food_aliases``;
+- its head word ("gallette") and the singular/plural variants of that word
+  ("galletta"), with a lower priority so an exact name always wins;
+- any other word of the name ("pollo" for "petto di pollo"), last of all.
+
+The same pass tokenizes quantities (``150 g``, ``2 vasetti da 125 g``,
+``1 kg``, ``2 etti``) and splits the message into items on separators ("e",
+",", "poi", ...) that are not part of a food name, so "150 g di riso e 100 g
+di pollo" yields two items without touching the database.
+
+Matchers are cached per database file together with the ``table_versions``
+counters of ``foods`` and ``food_aliases``. Those are bumped by triggers, so
+they also see writes from other connections and processes (e.g. an import run
+by the web app): each parse costs one primary-key read, and the trie is
+compiled again only after foods or aliases were added, renamed or deleted.
+"""
+import re
+import sqlite3
+import threading
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+
+from foodly.core.db import db_path, on_evict, table_versions
+from foodly.core.search import STOPWORDS, fold
+
+# tabelle da cui è compilato il trie
+SOURCE_TABLES = ("foods", "food_aliases")
+
+# priorità: nome completo < alias < parola principale < sua variante singolare/plurale < altre parole
+NAME, ALIAS, HEAD, VARIANT, WORD = range(5)
+
+UNITS = {
+    "g": 1.0, "gr": 1.0, "grammo": 1.0, "grammi": 1.0, "ml": 1.0,
+    "cl": 10.0, "hg": 100.0, "etto": 100.0, "etti": 100.0,
+    "kg": 1000.0, "chilo": 1000.0, "chili": 1000.0, "l": 1000.0, "litro": 1000.0, "litri": 1000.0,
+}
+PACKAGES = {
+    "x", "scatoletta", "scatolette", "confezione", "confezioni", "vasetto", "vasetti",
+    "lattina", "lattine", "bottiglia", "bottiglie", "barattolo", "barattoli",
+    "pacco", "pacchi", "pacchetto", "pacchetti", "busta", "buste",
+}
+NUMBER_WORDS = {"un": 1, "uno": 1, "una": 1, "due": 2, "tre": 3, "quattro": 4, "cinque": 5, "sei": 6, "mezzo": 0.5, "mezza": 0.5}
+SEPARATORS = {",", ";", "+", "e", "ed", "poi", "piu", "inoltre"}
+ADD_WORDS = ("aggiung",)
+CONSUME_WORDS = {"mangiato", "consumato", "bevuto", "usa", "usato", "consuma"}
+FILLER_WORDS = {"ho", "abbiamo", "metti", "dispensa", "oggi", "anche", "poi"}
+
+# grammi per confezione quando il messaggio non li indica
+PACKAGE_G = {"tonno": 56.0}
+DEFAULT_PACKAGE_G = 100.0
+
+_TOKEN = re.compile(r"(\d+(?:[.,]\d+)?)|([a-z]+)|([,;+])")
+_END = ""  # chiave del nodo terminale nel trie
+
+
+def tokenize(text: str) -> List[str]:
+    return [m.group(0) for m in _TOKEN.finditer(fold(text))]
+
+
+def variants(word: str) -> List[str]:
+    """Italian singular/plural forms of ``word`` (tonno/tonni, galletta/gallette, ...)."""
+    if len(word) < 4 or not word.isalpha():
+        return []
+    out = []
+    for end, alts in (
+        ("che", ("ca",)), ("ghe", ("ga",)), ("chi", ("co",)), ("ghi", ("go",)),
+        ("ca", ("che",)), ("ga", ("ghe",)), ("co", ("chi",)), ("go", ("ghi",)),
+        ("o", ("i",)), ("a", ("e",)), ("e", ("a", "i")), ("i", ("o", "e")),
+    ):
+        if word.endswith(end):
+            out = [word[: -len(end)] + alt for alt in alts]
+            break
+    return [w for w in out if w not in STOPWORDS and w not in UNITS and w not in PACKAGES]
+
+
+@dataclass
+class Item:
+    intent: str                     # "add" | "consume"
+    food_id: Optional[int]          # None: alimento non in catalogo, vedi query
+    grams: float
+    query: Optional[str] = None     # ultima parola utile, per la ricerca full-text
+
+
+class FoodMatcher:
+    def __init__(self):
+        self.trie: Dict[str, dict] = {}
+        self.heads: Dict[int, str] = {}
+        self.food_watermark = 0
+        self.alias_watermark = 0
+        self.foods = 0
+        self._lock = threading.Lock()
+
+    def _insert(self, tokens: List[str], food_id: int, rank: Tuple[int, int, int]):
+        if not tokens:
+            return
+        node = self.trie
+        for tok in tokens:
+            node = node.setdefault(tok, {})
+        current = node.get(_END)
+        # a parità di chiave vince il nome più specifico: priorità, poi nome più corto, poi id
+        if current is None or rank < current[1]:
+            node[_END] = (food_id, rank)
+
+    def add_food(self, food_id: int, name: str):
+        tokens = tokenize(name)
+        words = [t for t in tokens if t.isalpha()]
+        if not words:
+            return
+        self.foods += 1
+        size = len(tokens)
+        self._insert(tokens, food_id, (NAME, size, food_id))
+        head = next((w for w in words if w not in STOPWORDS), words[0])
+        self.heads[food_id] = head
+        self._insert([head], food_id, (HEAD, size, food_id))
+        i = tokens.index(head)
+        for v in variants(head):
+            self._insert([v], food_id, (VARIANT, size, food_id))
+            self._insert(tokens[:i] + [v] + tokens[i + 1:], food_id, (VARIANT, size, food_id))
+        for w in words[words.index(head) + 1:]:
+            if w not in STOPWORDS and len(w) >= 3:
+                self._insert([w], food_id, (WORD, size, food_id))
+
+    def add_alias(self, food_id: int, alias: str):
+        tokens = tokenize(alias)
+        self._insert(tokens, food_id, (ALIAS, len(tokens), food_id))
+
+    def refresh(self, conn: sqlite3.Connection) -> int:
+        """Load foods and aliases added since the last call; returns how many."""
+        with self._lock:
+            rows = conn.execute(
+                "SELECT id, name FROM foods WHERE id > ? ORDER BY id", (self.food_watermark,)
+            ).fetchall()
+            for food_id, name in rows:
+                if name:
+                    self.add_food(food_id, name)
+                self.food_watermark = food_id
+            try:
+                aliases = conn.execute(
+                    "SELECT id, food_id, alias FROM food_aliases WHERE id > ? ORDER BY id", (self.alias_watermark,)
+                ).fetchall()
+            except sqlite3.OperationalError as e:
+                if "no such table" not in str(e):
+                    raise
+                aliases = []
+            for alias_id, food_id, alias in aliases:
+                self.add_alias(food_id, alias)
+                self.alias_watermark = alias_id
+            return len(rows) + len(aliases)
+
+    def matches(self, tokens: List[str]) -> List[Tuple[int, int, int]]:
+        """Longest catalogue matches as ``(start, end, food_id)``, left to right."""
+        found = []
+        i, n = 0, len(tokens)
+        while i < n:
+            node, best, j = self.trie, None, i
+            while j < n and tokens[j] in node:
+                node = node[tokens[j]]
+                j += 1
+                if _END in node:
+                    best = (i, j, node[_END][0])
+            if best:
+                found.append(best)
+                i = best[1]
+            else:
+                i += 1
+        return found
+
+    def extract(self, text: str) -> List[Item]:
+        tokens = tokenize(text)
+        spans = self.matches(tokens)
+        inside = {}
+        for start, end, food_id in spans:
+            for k in range(start, end):
+                inside[k] = (start, food_id)
+
+        items: List[Item] = []
+        intent: Optional[str] = None
+        seg = _Segment()
+        for k, tok in enumerate(tokens):
+            if k not in inside and tok in SEPARATORS:
+                intent = seg.flush(items, intent)
+                seg = _Segment()
+                continue
+            if k in inside:
+                start, food_id = inside[k]
+                if start == k and seg.food_id is None:
+                    seg.food_id, seg.head = food_id, self.heads.get(food_id, tokens[k])
+                continue
+            # numero subito prima del nome: pezzi ("3 mele da 150 g")
+            if inside.get(k + 1, (None,))[0] == k + 1 and not seg.count:
+                seg.count = _number(tok) or 0.0
+            seg.feed(tokens, k)
+        seg.flush(items, intent)
+        return items
+
+
+class _Segment:
+    """Quantities, food and verb of one item of the message."""
+
+    def __init__(self):
+        self.food_id: Optional[int] = None
+        self.head = ""
+        self.intent: Optional[str] = None
+        self.grams = 0.0
+        self.count = 0.0
+        self.per_package = 0.0
+        self.last_word: Optional[str] = None
+        self._metti = False
+
+    def feed(self, tokens: List[str], k: int):
+        tok = tokens[k]
+        nxt = tokens[k + 1] if k + 1 < len(tokens) else ""
+        if tok.startswith(ADD_WORDS):
+            self.intent = "add"
+        elif tok in CONSUME_WORDS:
+            self.intent = "consume"
+        elif tok == "metti":
+            self._metti = True
+        elif tok == "dispensa" and self._metti:
+            self.intent = "add"
+        value = _number(tok)
+        if value is None:
+            if tok.isalpha() and not (
+                tok in STOPWORDS or tok in UNITS or tok in PACKAGES or tok in FILLER_WORDS
+                or tok in CONSUME_WORDS or tok.startswith(ADD_WORDS)
+            ):
+                self.last_word = tok
+            return
+        if nxt in UNITS:
+            grams = value * UNITS[nxt]
+            if k > 0 and tokens[k - 1] == "da":
+                self.per_package = grams
+            elif not self.grams:
+                self.grams = grams
+        elif nxt in PACKAGES and not self.count:
+            self.count = value
+
+    def flush(self, items: List[Item], intent: Optional[str]) -> Optional[str]:
+        # un elemento senza verbo eredita quello precedente ("aggiungi riso e pollo")
+        intent = self.intent or intent
+        if intent is None or (self.food_id is None and self.last_word is None):
+            return intent
+        if self.count and self.per_package:
+            grams = self.count * self.per_package
+        elif self.grams:
+            grams = self.grams
+        elif self.per_package:
+            grams = self.per_package
+        elif self.count:
+            grams = self.count * PACKAGE_G.get(self.head, DEFAULT_PACKAGE_G)
+        else:
+            grams = 0.0
+        if grams > 0:
+            query = None if self.food_id is not None else self.last_word
+            items.append(Item(intent, self.food_id, grams, query))
+        return intent
+
+
+def _number(tok: str) -> Optional[float]:
+    if tok[0].isdigit():
+        return float(tok.replace(",", "."))
+    return NUMBER_WORDS.get(tok)
+
+
+_matchers: Dict[Hashable, Tuple[Tuple[int, ...], FoodMatcher]] = {}
+_matchers_lock = threading.Lock()
+
+
+def get_matcher(conn: sqlite3.Connection) -> FoodMatcher:
+    key = db_path(conn)
+    # database in memoria: nessuna identità stabile, il matcher non viene tenuto
+    if key is None:
+        matcher = FoodMatcher()
+        matcher.refresh(conn)
+        return matcher
+    # contatori letti prima dei dati: una scrittura nel mezzo causa al più una ricompilazione in più
+    versions = table_versions(conn, SOURCE_TABLES)
+    with _matchers_lock:
+        cached = _matchers.get(key)
+    if cached is not None and cached[0] == versions:
+        return cached[1]
+    # nuovo trie costruito a parte: chi usa quello vecchio non vede uno stato a metà
+    matcher = FoodMatcher()
+    matcher.refresh(conn)
+    with _matchers_lock:
+        _matchers[key] = (versions, matcher)
+    return matcher
+
+
+def invalidate(conn: Optional[sqlite3.Connection] = None):
+    """Forget the compiled matcher of ``conn``'s database (all of them without ``conn``)."""
+    with _matchers_lock:
+        if conn is None:
+            _matchers.clear()
+        else:
+            _matchers.pop(db_path(conn), None)
+
+
+def _evict(path):
+    with _matchers_lock:
+        _matchers.pop(path, None)
+
+
+on_evict(_evict)
+
+
+def extract_items(conn: sqlite3.Connection, text: str) -> List[Item]:
+    return get_matcher(conn).extract(text)
@@ -0,0 +1,196 @@
+"""Combination suggestions: 1..N pantry foods sized to close all residual targets.
+
+The problem is a box-constrained least squares: find grams ``x`` with
+``0 <= x <= pantry qty`` minimizing the distance between the nutrients they add
+and the residual kcal/protein/carbs/fat/fiber, each nutrient scaled by its
+daily target so a gram of fat and a kcal weigh comparably.
+
+1. The continuous relaxation over every candidate is solved with accelerated
+   projected gradient (FISTA); its solution shortlists the foods that matter.
+2. Every subset of at most ``max_items`` shortlisted foods is re-solved in one
+   batched, vectorized run and the closest one wins (fewer foods on near ties).
+3. Grams are rounded to ``step_g`` steps, trying floor/ceil per food.
+
+Each phase checks ``time_budget_s``; when the budget runs out the best answer
+found so far is returned, so the call stays within tens of milliseconds even
+with hundreds of candidates.
+"""
+import itertools
+import sqlite3
+import time
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+NUTRIENTS = ("kcal", "prot_g", "carb_g", "fat_g", "fiber_g")
+
+SHORTLIST_PER_ITEM = 3
+# un alimento in più deve ridurre la distanza almeno di questo per essere preferito
+ITEM_PENALTY = 1e-3
+
+
+def _fista(
+    A: np.ndarray, r: np.ndarray, upper: np.ndarray, step: np.ndarray, iters: int, deadline: float,
+    tol_g: float = 0.05,
+) -> np.ndarray:
+    """Projected FISTA for min ||A x - r||^2, 0 <= x <= upper, batched over a leading axis.
+
+    ``A`` is (batch, nutrients, vars), ``upper`` (batch, vars) and ``step`` (batch,)
+    the inverse Lipschitz constant of each problem. Stops early once no variable
+    moves by more than ``tol_g`` grams or when ``deadline`` has passed.
+    """
+    x = np.zeros_like(upper)
+    y = x.copy()
+    t = 1.0
+    for i in range(iters):
+        grad = np.einsum("bnv,bn->bv", A, np.einsum("bnv,bv->bn", A, y) - r)
+        x_next = np.clip(y - step[:, None] * grad, 0.0, upper)
+        t_next = (1 + (1 + 4 * t * t) ** 0.5) / 2
+        y = x_next + ((t - 1) / t_next) * (x_next - x)
+        moved = np.abs(x_next - x).max(initial=0.0)
+        x, t = x_next, t_next
+        if i % 10 == 9 and (moved < tol_g or time.perf_counter() > deadline):
+            break
+    return x
+
+
+def _distance(A: np.ndarray, r: np.ndarray, x: np.ndarray) -> np.ndarray:
+    return np.linalg.norm(np.einsum("...nv,...v->...n", A, x) - r, axis=-1)
+
+
+def optimize_combination(
+    per_gram: np.ndarray,
+    available: np.ndarray,
+    residual: np.ndarray,
+    scale: np.ndarray,
+    max_items: int = 3,
+    step_g: float = 5.0,
+    time_budget_s: float = 0.05,
+    iters: int = 300,
+) -> Dict[str, Any]:
+    """Pick at most ``max_items`` columns of ``per_gram`` and their grams.
+
+    ``per_gram`` is (nutrients, candidates), ``available`` the grams on hand per
+    candidate, ``residual`` the nutrients still missing and ``scale`` the
+    per-nutrient normalization. Returns indices, grams and solver stats.
+    """
+    t0 = time.perf_counter()
+    deadline = t0 + time_budget_s
+    A = per_gram / scale[:, None]
+    r = residual / scale
+    n = A.shape[1]
+    stats = {"candidates": n, "subsets": 0, "timed_out": False}
+
+    # 1) rilassamento continuo su tutti i candidati
+    lipschitz = max(float(np.linalg.eigvalsh(A @ A.T)[-1]), 1e-12)
+    x = _fista(A[None], r[None], available[None], np.array([1.0 / lipschitz]), iters, deadline)[0]
+    weight = x * np.linalg.norm(A, axis=0)
+    order = np.argsort(-weight, kind="stable")
+    shortlist = [int(i) for i in order[: max_items * SHORTLIST_PER_ITEM] if weight[i] > 0]
+    if not shortlist:
+        stats["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+        return {"indices": [], "grams": [], "distance": float(np.linalg.norm(r)), "stats": stats}
+
+    # 2) tutti i sottoinsiemi della shortlist fino a max_items, risolti in un unico batch
+    subsets = [
+        c for k in range(1, max_items + 1) for c in itertools.combinations(shortlist, k)
+    ]
+    if time.perf_counter() > deadline:
+        subsets = [tuple(shortlist[:max_items])]
+        stats["timed_out"] = True
+    idx = np.full((len(subsets), max_items), -1)
+    for s, combo in enumerate(subsets):
+        idx[s, : len(combo)] = combo
+    mask = idx >= 0
+    A_sub = np.where(mask[:, None, :], A[:, np.maximum(idx, 0)].transpose(1, 0, 2), 0.0)
+    upper = np.where(mask, available[np.maximum(idx, 0)], 0.0)
+    # passo sicuro: 1 / norma di Frobenius al quadrato >= 1 / costante di Lipschitz
+    step = 1.0 / np.maximum(np.einsum("bnv,bnv->b", A_sub, A_sub), 1e-12)
+    x_sub = _fista(A_sub, np.broadcast_to(r, (len(subsets), len(r))), upper, step, iters, deadline)
+    cost = _distance(A_sub, r, x_sub) + ITEM_PENALTY * mask.sum(axis=1)
+    best = int(np.argmin(cost))
+    stats["subsets"] = len(subsets)
+
+    cols = [int(i) for i in idx[best][mask[best]]]
+    A_best = A[:, cols]
+    x_best = x_sub[best][mask[best]]
+
+    # 3) arrotondamento a step_g: tutte le combinazioni floor/ceil (al massimo 2^max_items)
+    lo = np.floor(x_best / step_g) * step_g
+    hi = np.minimum(lo + step_g, np.floor(available[cols] / step_g) * step_g)
+    best_grams, best_dist = lo, float(_distance(A_best, r, lo))
+    for choice in itertools.product((0, 1), repeat=len(cols)):
+        if time.perf_counter() > deadline:
+            stats["timed_out"] = True
+            break
+        grams = np.where(np.array(choice, dtype=bool), hi, lo)
+        dist = float(_distance(A_best, r, grams))
+        if dist < best_dist:
+            best_grams, best_dist = grams, dist
+
+    keep = best_grams > 0
+    stats["elapsed_ms"] = round((time.perf_counter() - t0) * 1000, 2)
+    return {
+        "indices": [c for c, k in zip(cols, keep) if k],
+        "grams": [int(g) for g in best_grams[keep]],
+        "distance": best_dist,
+        "stats": stats,
+    }
+
+
+def suggest_combination(
+    conn: sqlite3.Connection,
+    date_str: Optional[str] = None,
+    max_items: int = 3,
+    time_budget_s: float = 0.05,
+) -> Dict[str, Any]:
+    from foodly.agent.tools import day_summary, residuals
+    from foodly.core.calculations import compute_targets
+
+    totals = day_summary(conn, date_str)
+    targets = compute_targets(conn)
+    resid = residuals(totals, targets)
+    # Candidati: dispensa aggregata per alimento (i lotti dello stesso cibo si sommano)
+    rows = conn.execute(
+        """
+        SELECT f.id, f.name, SUM(p.qty_g) AS qty_g,
+               f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g, COALESCE(f.fiber_100g, 0)
+        FROM pantry p JOIN foods f ON p.food_id=f.id
+        WHERE p.qty_g > 0
+        GROUP BY f.id
+        ORDER BY f.name
+        """
+    ).fetchall()
+    base = {"mode": "combo", "residuals": resid}
+    if not rows:
+        return {**base, "options": [], "note": "Dispensa vuota o esaurita."}
+    if not any(resid.values()):
+        return {**base, "options": [], "note": "Obiettivi del giorno già raggiunti."}
+
+    per_100g = np.array([tuple(r)[3:] for r in rows], dtype=float).T
+    available = np.array([r[2] for r in rows], dtype=float)
+    residual = np.array([resid[k] for k in NUTRIENTS])
+    scale = np.maximum(np.array([targets[k] for k in NUTRIENTS]), 1.0)
+    result = optimize_combination(
+        per_100g / 100.0, available, residual, scale,
+        max_items=max_items, time_budget_s=time_budget_s,
+    )
+
+    options = []
+    added = dict.fromkeys(NUTRIENTS, 0.0)
+    for i, grams in zip(result["indices"], result["grams"]):
+        delta = {k: round(float(v) * grams / 100.0, 1) for k, v in zip(NUTRIENTS, per_100g[:, i])}
+        for k in NUTRIENTS:
+            added[k] += delta[k]
+        options.append({"food_id": rows[i][0], "name": rows[i][1], "grams": grams, "delta": delta})
+    return {
+        **base,
+        "options": options,
+        "total_delta": {k: round(v, 1) for k, v in added.items()},
+        "remaining": {k: round(resid[k] - added[k], 1) for k in NUTRIENTS},
+        "distance": {
+            "before": round(float(np.linalg.norm(residual / scale)), 4),
+            "after": round(result["distance"], 4),
+        },
+        "solver": result["stats"],
+    }
@@ -0,0 +1,166 @@
+"""Cache of LLM tool-call plans.
+
+Users repeat the same phrases ("ho mangiato 100 g di riso") and the LLM answers
+them with the same ``ToolCall`` list, so a plan is cached under a hash of the
+normalized message and of everything else that shapes the answer: system
+prompt, tools schema, ``require_confirm`` and model. Changing the prompt or a
+tool's schema therefore invalidates old plans by itself.
+
+Plans live in an in-process LRU in front of the ``plan_cache`` table, so they
+survive restarts and are shared between worker processes. Both layers expire
+entries after ``ttl`` seconds. Plans name food ids, so with per-user shards
+each user has their own table and the LRU keys carry the user too.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from foodly.core import metrics, writer
+from foodly.core.context import current_user
+from foodly.core.db import get_db
+from foodly.core.models import ToolCall
+
+PLAN_CACHE_SIZE = int(os.getenv("FOODLY_PLAN_CACHE_SIZE", "1024"))
+PLAN_CACHE_TTL_S = float(os.getenv("FOODLY_PLAN_CACHE_TTL", str(7 * 24 * 3600)))
+# righe massime nella tabella; la pulizia gira ogni PRUNE_EVERY inserimenti
+PLAN_CACHE_ROWS = 20 * PLAN_CACHE_SIZE
+PRUNE_EVERY = 256
+
+_SPACES = re.compile(r"\s+")
+_EDGE_PUNCT = re.compile(r"^[\s.,;:!?…]+|[\s.,;:!?…]+$")
+
+
+def normalize_message(text: str) -> str:
+    """Case, spacing and trailing punctuation do not change the plan."""
+    text = unicodedata.normalize("NFKC", text).casefold()
+    return _EDGE_PUNCT.sub("", _SPACES.sub(" ", text))
+
+
+def plan_key(message: str, system_prompt: str, tools: List[Dict[str, Any]], require_confirm: bool, model: str) -> str:
+    blob = json.dumps(
+        [normalize_message(message), system_prompt, tools, bool(require_confirm), model],
+        sort_keys=True, ensure_ascii=False, separators=(",", ":"),
+    )
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+def _touch(conn, key: str, now: float):
+    conn.execute("UPDATE plan_cache SET last_used=?, hits=hits+1 WHERE key=?", (now, key))
+
+
+def _memory_key(key: str) -> str:
+    # gli id degli alimenti sono dello shard dell'utente
+    user = current_user()
+    return key if user is None else f"{user}:{key}"
+
+
+class PlanCache:
+    def __init__(self, size: int = PLAN_CACHE_SIZE, ttl: float = PLAN_CACHE_TTL_S, max_rows: int = PLAN_CACHE_ROWS):
+        self.size = max(1, size)
+        self.ttl = ttl
+        self.max_rows = max_rows
+        self._entries: "OrderedDict[str, Tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts = 0
+        self.memory_hits = 0
+        self.db_hits = 0
+        self.misses = 0
+        self.bypassed = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _decode(actions: str) -> List[ToolCall]:
+        return [ToolCall(**a) for a in json.loads(actions)]
+
+    def _remember(self, key: str, created_at: float, actions: str):
+        self._entries[key] = (created_at, actions)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    def get(self, key: str) -> Optional[List[ToolCall]]:
+        now = time.time()
+        mkey = _memory_key(key)
+        with self._lock:
+            entry = self._entries.get(mkey)
+            if entry and now - entry[0] < self.ttl:
+                self._entries.move_to_end(mkey)
+                self.memory_hits += 1
+                return self._decode(entry[1])
+            if entry:
+                del self._entries[mkey]
+        conn = get_db()
+        try:
+            row = conn.execute(
+                "SELECT actions, created_at FROM plan_cache WHERE key=? AND created_at > ?", (key, now - self.ttl)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row:
+            writer.write(_touch, key, now)
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.db_hits += 1
+            self._remember(mkey, row["created_at"], row["actions"])
+        return self._decode(row["actions"])
+
+    def put(self, key: str, actions: List[ToolCall]):
+        now = time.time()
+        blob = json.dumps([a.model_dump() for a in actions], ensure_ascii=False)
+        with self._lock:
+            self._remember(_memory_key(key), now, blob)
+            self._puts += 1
+            prune = self._puts % PRUNE_EVERY == 0
+        writer.write(self._store, key, blob, now, prune)
+
+    def _store(self, conn, key: str, blob: str, now: float, prune: bool):
+        conn.execute(
+            "INSERT OR REPLACE INTO plan_cache(key, actions, created_at, last_used) VALUES (?,?,?,?)",
+            (key, blob, now, now),
+        )
+        if prune:
+            self.prune(conn, now)
+
+    def prune(self, conn, now: Optional[float] = None) -> int:
+        """Drop expired rows and the least recently used ones beyond ``max_rows``."""
+        now = time.time() if now is None else now
+        n = conn.execute("DELETE FROM plan_cache WHERE created_at <= ?", (now - self.ttl,)).rowcount
+        n += conn.execute(
+            "DELETE FROM plan_cache WHERE key IN "
+            "(SELECT key FROM plan_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+            (self.max_rows,),
+        ).rowcount
+        return n
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            hits = self.memory_hits + self.db_hits
+            lookups = hits + self.misses
+            return {
+                "size": self.size,
+                "entries": len(self._entries),
+                "ttl_s": self.ttl,
+                "memory_hits": self.memory_hits,
+                "db_hits": self.db_hits,
+                "misses": self.misses,
+                "bypassed": self.bypassed,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            }
+
+
+plan_cache = PlanCache()
+metrics.register_stats("foodly_plan_cache", plan_cache.stats, ("entries", "memory_hits", "db_hits", "misses", "evictions"))
@@ -1,8 +1,18 @@
+from __future__ import annotations
+
+import itertools
 import sqlite3
-from datetime import datetime
-from typing import Dict, Optional
+from typing import TYPE_CHECKING, Dict, List, Optional
+
+from foodly.core.barcode import foods_by_barcode
+from foodly.core.consumption import log_consumption
+from foodly.core.context import memoized
+from foodly.core.models import AddToPantry, Consume, FindByBarcode, FindFood
+from foodly.core.rollup import day_totals
+from foodly.core.search import search_foods
 
-from foodly.core.models import AddToPantry, Consume, FindFood
+if TYPE_CHECKING:
+    import numpy as np
 
 def tool_add_to_pantry(conn: sqlite3.Connection, p: AddToPantry):
     conn.execute(
@@ -12,121 +22,139 @@ def tool_add_to_pantry(conn: sqlite3.Connection, p: AddToPantry):
 
 
 def tool_consume(conn: sqlite3.Connection, c: Consume):
-    conn.execute(
-        "INSERT INTO consumption_logs(ts, food_id, grams, meal, note) VALUES (?,?,?,?,?)",
-        (datetime.utcnow().isoformat(), c.food_id, c.grams, c.meal.value, c.note)
-    )
-    # Decremento FIFO
-    remaining = c.grams
-    rows = conn.execute(
-        "SELECT id, qty_g FROM pantry WHERE food_id=? AND qty_g>0 ORDER BY COALESCE(best_before,'9999-12-31'), created_at",
-        (c.food_id,)
-    ).fetchall()
-    for r in rows:
-        if remaining <= 0: break
-        pid, qty = r["id"], float(r["qty_g"])
-        take = min(qty, remaining)
-        conn.execute("UPDATE pantry SET qty_g = qty_g - ? WHERE id=?", (take, pid))
-        remaining -= take
+    return tool_consume_batch(conn, [c])
+
+
+def tool_consume_batch(conn: sqlite3.Connection, items: List[Consume]) -> List[Dict[str, float]]:
+    # Log con executemany + decremento FIFO in un solo UPDATE; restituisce le mancanze per alimento
+    return log_consumption(conn, [(c.food_id, c.grams, c.meal.value, c.note) for c in items])
 
 
 def tool_find_food(conn: sqlite3.Connection, q: FindFood):
-    like = f"%{q.query.strip()}%"
-    rows = conn.execute(
-        "SELECT id, name, brand, kcal_100g, prot_100g, carb_100g, fat_100g FROM foods WHERE name LIKE ? ORDER BY name LIMIT ?",
-        (like, q.limit)
-    ).fetchall()
-    return [dict(r) for r in rows]
+    return search_foods(conn, q.query, q.limit)
+
+
+def tool_find_by_barcode(conn: sqlite3.Connection, q: FindByBarcode):
+    return foods_by_barcode(conn, q.barcodes)
 
 def day_summary(conn: sqlite3.Connection, date_str: Optional[str] = None):
-    from foodly.core.calculations import day_bounds
-    start, end = day_bounds(date_str)
-    totals = {"kcal":0.0, "prot_g":0.0, "carb_g":0.0, "fat_g":0.0, "fiber_g":0.0, "sodium_mg":0.0}
-    rows = conn.execute(
-        """
-        SELECT c.ts, c.grams, f.*
-        FROM consumption_logs c JOIN foods f ON c.food_id=f.id
-        WHERE c.ts BETWEEN ? AND ?
-        """, (start, end)
-    ).fetchall()
-    for r in rows:
-        g = float(r["grams"]) / 100.0
-        totals["kcal"] += r["kcal_100g"] * g
-        totals["prot_g"] += r["prot_100g"] * g
-        totals["carb_g"] += r["carb_100g"] * g
-        totals["fat_g"]  += r["fat_100g"] * g
-        totals["fiber_g"] += r["fiber_100g"] * g
-        totals["sodium_mg"] += r["sodium_mg_100g"] * g
-    return {k: round(v,1) for k,v in totals.items()}
-
-def suggest_from_pantry(conn: sqlite3.Connection, date_str: Optional[str] = None) -> Dict[str, any]:
-    from foodly.core.calculations import compute_targets
-    totals = day_summary(conn, date_str)
-    targets = compute_targets(conn)
-    resid = {
+    return day_totals(conn, date_str)
+
+def residuals(totals: Dict[str, float], targets: Dict[str, float]) -> Dict[str, float]:
+    return {
         "kcal": max(0.0, targets["kcal"] - totals["kcal"]),
         "prot_g": max(0.0, targets["prot_g"] - totals["prot_g"]),
         "carb_g": max(0.0, targets["carb_g"] - totals["carb_g"]),
         "fat_g": max(0.0, targets["fat_g"] - totals["fat_g"]),
         "fiber_g": max(0.0, targets["fiber_g"] - totals["fiber_g"]),
     }
-    # Candidati: join dispensa + foods (qty>0)
-    rows = conn.execute(
+
+@memoized
+def suggest_from_pantry(conn: sqlite3.Connection, date_str: Optional[str] = None, mode: str = "single", max_items: int = 3) -> Dict[str, any]:
+    if mode == "combo":
+        from foodly.agent.optimizer import suggest_combination
+        return suggest_combination(conn, date_str, max_items=max_items)
+    # numpy solo per i suggerimenti: l'avvio dell'agente non lo importa
+    import numpy as np
+    from foodly.core.calculations import compute_targets
+    totals = day_summary(conn, date_str)
+    targets = compute_targets(conn)
+    resid = residuals(totals, targets)
+    # Candidati: join dispensa + foods (qty>0), tuple semplici e senza nomi (letti solo per le opzioni)
+    cur = conn.cursor()
+    cur.row_factory = None
+    rows = cur.execute(
         """
-        SELECT f.id as food_id, f.name, p.qty_g, f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g, f.fiber_100g
+        SELECT f.id, p.qty_g, f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g, f.fiber_100g
         FROM pantry p JOIN foods f ON p.food_id=f.id
         WHERE p.qty_g > 0
         ORDER BY f.name
         """
     ).fetchall()
-    candidates = [dict(r) for r in rows]
-    if not candidates:
+    if not rows:
         return {"options": [], "residuals": resid, "note": "Dispensa vuota o esaurita."}
 
     # Strategy: quale macro è più carente?
     deficits = sorted([(k, v) for k,v in resid.items() if k!="kcal"], key=lambda x: -x[1])
     main_def = deficits[0][0] if deficits else "prot_g"
 
-    def score(food):
-        # preferenza in base al deficit principale e penalità grasse se fat è già coperto
-        p = food["prot_100g"]; c = food["carb_100g"]; f = food["fat_100g"]; fib = food.get("fiber_100g", 0.0)
-        kcal = max(1e-6, food["kcal_100g"])  # prevenire div zero
-        s = 0.0
-        if main_def == "prot_g": s += (p/kcal)*3 + fib*0.02
-        if main_def == "carb_g": s += (c/kcal)*3 + fib*0.03
-        if main_def == "fat_g":  s += (f/kcal)*3
-        if resid["fiber_g"] > 5: s += fib*0.05
-        if resid["fat_g"] <= 0: s -= (f/kcal)  # penalizza grassi se già a target
-        return s
+    # Matrice per colonne: qty, kcal, prot, carb, fat, fiber (una riga numpy per nutriente)
+    m = _candidate_matrix(rows)
+    qty, kcal_100g, p, c, f, fib = m
+    kcal = np.maximum(kcal_100g, 1e-6)  # prevenire div zero
+
+    # preferenza in base al deficit principale e penalità grasse se fat è già coperto
+    score = np.zeros(len(rows))
+    if main_def == "prot_g": score += (p/kcal)*3 + fib*0.02
+    if main_def == "carb_g": score += (c/kcal)*3 + fib*0.03
+    if main_def == "fat_g":  score += (f/kcal)*3
+    if resid["fiber_g"] > 5: score += fib*0.05
+    if resid["fat_g"] <= 0: score -= (f/kcal)  # penalizza grassi se già a target
 
-    ranked = sorted(candidates, key=score, reverse=True)[:5]
+    ranked = _top_k(score, 5)
 
     # Quantità proposta: prova a coprire ~80% del deficit principale con un singolo alimento
+    per100 = {"prot_g": p, "carb_g": c}.get(main_def, f)[ranked]
+    target_cover = 0.8 * resid[main_def]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        grams = np.minimum(qty[ranked], np.maximum(0.0, target_cover / per100 * 100.0))
+    # Arrotonda a step da 5 g
+    grams = np.where(per100 > 0, 5 * np.round(grams / 5), 0.0)
+
+    picked = [(rows[i], int(g)) for i, g in zip(ranked.tolist(), grams.tolist()) if g > 0][:3]
+    names = _food_names(conn, [food[0] for food, _ in picked])
     options = []
-    for food in ranked:
-        if main_def == "prot_g": per100 = food["prot_100g"]
-        elif main_def == "carb_g": per100 = food["carb_100g"]
-        else: per100 = food["fat_100g"]
-        target_cover = 0.8 * resid[main_def]
-        grams = 0
-        if per100 > 0:
-            grams = min(food["qty_g"], max(0.0, target_cover / per100 * 100.0))
-            # Arrotonda a step da 5 g
-            grams = 5 * round(grams/5)
-        if grams <= 0: continue
+    for food, g in picked:
+        food_id, _, kcal_i, prot_i, carb_i, fat_i, fib_i = food
         # Calcolo impatti
-        factor = grams/100.0
+        factor = g/100.0
         delta = {
-            "kcal": round(food["kcal_100g"]*factor, 1),
-            "prot_g": round(food["prot_100g"]*factor, 1),
-            "carb_g": round(food["carb_100g"]*factor, 1),
-            "fat_g": round(food["fat_100g"]*factor, 1),
-            "fiber_g": round(food.get("fiber_100g",0)*factor, 1),
+            "kcal": round(kcal_i*factor, 1),
+            "prot_g": round(prot_i*factor, 1),
+            "carb_g": round(carb_i*factor, 1),
+            "fat_g": round(fat_i*factor, 1),
+            "fiber_g": round((fib_i or 0)*factor, 1),
         }
         options.append({
-            "food_id": food["food_id"],
-            "name": food["name"],
-            "grams": grams,
+            "food_id": food_id,
+            "name": names[food_id],
+            "grams": g,
             "delta": delta
         })
-    return {"options": options[:3], "residuals": resid, "main_deficit": main_def}
+    return {"options": options, "residuals": resid, "main_deficit": main_def}
+
+
+def _food_names(conn: sqlite3.Connection, ids: List[int]) -> Dict[int, str]:
+    if not ids:
+        return {}
+    rows = conn.execute(
+        f"SELECT id, name FROM foods WHERE id IN ({','.join('?' * len(ids))})", ids
+    ).fetchall()
+    return {r[0]: r[1] for r in rows}
+
+
+def _candidate_matrix(rows) -> np.ndarray:
+    import numpy as np
+    n = len(rows)
+    flat = np.fromiter(itertools.chain.from_iterable(r[1:] for r in rows), dtype=float, count=n * 6)
+    m = np.ascontiguousarray(flat.reshape(n, 6).T)
+    m[5] = np.nan_to_num(m[5])  # fibra NULL -> 0
+    return m
+
+
+def _top_k(score: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the ``k`` best scores, best first; ties keep their original order.
+
+    Equivalent to a stable descending sort truncated to ``k`` but only the
+    selected entries are sorted (``argpartition`` is linear).
+    """
+    import numpy as np
+    n = len(score)
+    if n > k:
+        kth = score[np.argpartition(score, n - k)[n - k]]
+        above = np.flatnonzero(score > kth)
+        ties = np.flatnonzero(score == kth)[: k - len(above)]
+        idx = np.concatenate([above, ties])
+    else:
+        idx = np.arange(n)
+    return idx[np.lexsort((idx, -score[idx]))]
@@ -1,66 +1,90 @@
 from __future__ import annotations
-import httpx
+import os
 import sqlite3
+from contextlib import asynccontextmanager
 from datetime import datetime, date
+from functools import lru_cache
 from pathlib import Path
-from typing import Optional, Dict, Any
+from typing import TYPE_CHECKING, Optional, Dict, Any
 
-from fastapi import FastAPI, Form, Request
-from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse
+from fastapi import Depends, FastAPI, File, Form, HTTPException, Query, Request, UploadFile
+from fastapi import Path as PathParam
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import HTMLResponse, RedirectResponse, JSONResponse, StreamingResponse
 from fastapi.staticfiles import StaticFiles
-from fastapi.templating import Jinja2Templates
+from starlette.background import BackgroundTask
 
-from foodly.core.db import get_db, init_db
-from foodly.core.calculations import compute_targets
-from foodly.core.models import MealType
+from foodly.core import metrics, tenancy, writer
+from foodly.core.context import request_scope
+from foodly.core.db import db_session, init_db
+from foodly.core.importer import ONLINE_TXN_ROWS, detect_format, import_foods
+from foodly.core.calculations import compute_targets, progress
+from foodly.core.catalog import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, list_foods, list_pantry
+from foodly.core.consumption import log_consumption
+from foodly.core.export import ExportError, ExportUnavailable, export_filename, export_stream
+from foodly.core.export import MEDIA_TYPES as EXPORT_MEDIA_TYPES
+from foodly.core.httpcache import cached_json
+from foodly.core.models import ChatRequest, Granularity, MealType
+from foodly.core.rollup import day_totals, range_summary, rolling_averages
+
+if TYPE_CHECKING:
+    import httpx
 
 APP_DIR = Path(__file__).parent
 TEMPLATES_DIR = APP_DIR / "templates"
 STATIC_DIR = APP_DIR / "static"
 
-app = FastAPI(title="Foodly App")
+# Servizio agente: URL base, timeout e modalità nello stesso processo (niente hop HTTP)
+AGENT_URL = os.getenv("FOODLY_AGENT_URL", "http://127.0.0.1:8001")
+AGENT_TIMEOUT_S = float(os.getenv("FOODLY_AGENT_TIMEOUT", "60"))
+AGENT_IN_PROCESS = os.getenv("FOODLY_AGENT_IN_PROCESS", "0").lower() in ("1", "true", "yes")
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # schema verificato all'avvio, non all'import: con lo schema aggiornato è una sola PRAGMA.
+    # Nessuna richiesta è ancora servita, quindi si può bloccare il loop
+    if not tenancy.REQUIRE_USER:
+        init_db()
+    yield
+    client = getattr(app.state, "agent_client", None)
+    if client is not None:
+        await client.aclose()
+    if AGENT_IN_PROCESS:
+        from foodly.agent import llm
+        await llm.aclose_backend()
+    await run_in_threadpool(writer.close_writers)
+
 
-# Ensure folders
-TEMPLATES_DIR.mkdir(exist_ok=True)
-STATIC_DIR.mkdir(exist_ok=True)
+app = FastAPI(title="Foodly App", lifespan=lifespan)
+metrics.instrument(app, "web")
+tenancy.route_by_user(app)
 
-init_db()
+# la directory è versionata (.gitkeep); nessun controllo su disco all'import
+app.mount("/static", StaticFiles(directory=str(STATIC_DIR), check_dir=False), name="static")
 
-templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
-app.mount("/static", StaticFiles(directory=str(STATIC_DIR)), name="static")
+
+@lru_cache(maxsize=None)
+def _templates():
+    # jinja2 serve solo alle due pagine HTML: caricato alla prima richiesta
+    from fastapi.templating import Jinja2Templates
+    return Jinja2Templates(directory=str(TEMPLATES_DIR))
 
 def row_to_dict(r: sqlite3.Row) -> Dict[str, Any]:
     return {k: r[k] for k in r.keys()}
 
 @app.get("/", response_class=HTMLResponse)
 def index(request: Request):
-    conn = get_db()
-    foods = [row_to_dict(r) for r in conn.execute("SELECT * FROM foods ORDER BY name").fetchall()]
-    pantry = conn.execute(
-        """
-        SELECT p.id AS pid, f.name, f.id AS food_id, p.qty_g, COALESCE(p.package_g, 0) AS package_g, p.location
-        FROM pantry p JOIN foods f ON p.food_id=f.id
-        ORDER BY f.name
-        """
-    ).fetchall()
-    pantry = [row_to_dict(r) for r in pantry]
-    targets = compute_targets(conn)
-    today = date.today().isoformat()
-    conn.close()
-    return templates.TemplateResponse("index.html", {
-        "request": request,
-        "foods": foods,
-        "pantry": pantry,
-        "targets": targets,
-        "today": today,
+    # alimenti e dispensa arrivano a pagine da /api/foods e /api/pantry
+    return _templates().TemplateResponse(request, "index.html", {
+        "today": date.today().isoformat(),
+        "page_size": DEFAULT_PAGE_SIZE,
     })
 
 @app.get("/settings", response_class=HTMLResponse)
-def settings_page(request: Request):
-    conn = get_db()
+def settings_page(request: Request, conn: sqlite3.Connection = Depends(db_session)):
     s = conn.execute("SELECT * FROM user_settings WHERE id=1").fetchone()
-    conn.close()
-    return templates.TemplateResponse("settings.html", {"request": request, "s": s})
+    return _templates().TemplateResponse(request, "settings.html", {"s": s})
 
 @app.post("/settings")
 def update_settings(
@@ -74,8 +98,7 @@ def update_settings(
     fat_g_per_kg: float = Form(0.8),
     llm_api_key: Optional[str] = Form(None),
 ):
-    conn = get_db()
-    conn.execute(
+    writer.execute(
         """
         UPDATE user_settings
         SET weight_kg=?, height_cm=?, age=?, sex=?, activity_level=?, kcal_target=?,
@@ -94,8 +117,6 @@ def update_settings(
             llm_api_key,
         ),
     )
-    conn.commit()
-    conn.close()
     return RedirectResponse("/settings", status_code=303)
 
 @app.post("/api/foods")
@@ -112,18 +133,67 @@ def api_add_food(
     brand: Optional[str] = Form(None),
     barcode: Optional[str] = Form(None),
 ):
-    conn = get_db()
-    conn.execute(
-        """
-        INSERT INTO foods(name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sugar_100g, satfat_100g, sodium_mg_100g, source, last_updated)
-        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'manual', ?)
-        """,
-        (name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sugar_100g, satfat_100g, sodium_mg_100g, datetime.utcnow().isoformat())
-    )
-    conn.commit()
-    conn.close()
+    barcode = (barcode or "").strip() or None
+    try:
+        writer.execute(
+            """
+            INSERT INTO foods(name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sugar_100g, satfat_100g, sodium_mg_100g, source, last_updated)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, 'manual', ?)
+            """,
+            (name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sugar_100g, satfat_100g, sodium_mg_100g, datetime.utcnow().isoformat())
+        )
+    except sqlite3.IntegrityError:
+        raise HTTPException(status_code=409, detail=f"Barcode già presente: {barcode}")
     return RedirectResponse("/", status_code=303)
 
+@app.post("/api/foods/import")
+def api_import_foods(
+    file: UploadFile = File(...),
+    format: Optional[str] = Query(None, pattern="^(csv|tsv|jsonl)$"),
+    source: str = Query("import"),
+    bulk: bool = Query(False),
+    conn: sqlite3.Connection = Depends(db_session),
+):
+    fmt = format or detect_format(file.filename or "")
+    try:
+        if bulk:
+            # indici sospesi e una sola transazione: più veloce, ma le altre scritture aspettano fino alla fine
+            stats = import_foods(conn, file.file, fmt=fmt, food_source=source)
+        else:
+            stats = import_foods(
+                conn, file.file, fmt=fmt, food_source=source,
+                chunk_rows=ONLINE_TXN_ROWS, txn_rows=ONLINE_TXN_ROWS, rebuild_indexes=False,
+            )
+    except (UnicodeDecodeError, ValueError, OSError) as e:
+        raise HTTPException(status_code=400, detail=f"File non valido: {e}")
+    return stats
+
+@app.get("/api/foods")
+def api_list_foods(
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    conn: sqlite3.Connection = Depends(db_session),
+):
+    try:
+        return list_foods(conn, q, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/pantry")
+def api_list_pantry(
+    q: Optional[str] = None,
+    location: Optional[str] = None,
+    best_before: Optional[date] = Query(None, description="scadenza entro la data (inclusa)"),
+    cursor: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    conn: sqlite3.Connection = Depends(db_session),
+):
+    try:
+        return list_pantry(conn, q, location, best_before.isoformat() if best_before else None, cursor, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
 @app.post("/api/pantry")
 def api_add_pantry(
     food_id: int = Form(...),
@@ -132,13 +202,10 @@ def api_add_pantry(
     location: Optional[str] = Form(None),
     best_before: Optional[str] = Form(None),
 ):
-    conn = get_db()
-    conn.execute(
+    writer.execute(
         "INSERT INTO pantry(food_id, qty_g, package_g, location, best_before) VALUES (?,?,?,?,?)",
         (food_id, qty_g, package_g, location, best_before)
     )
-    conn.commit()
-    conn.close()
     return RedirectResponse("/", status_code=303)
 
 @app.post("/api/consume")
@@ -149,90 +216,168 @@ def api_consume(
     note: Optional[str] = Form(None),
 ):
     grams = max(0.0, grams)
-    conn = get_db()
-    # Log consumption
-    conn.execute(
-        "INSERT INTO consumption_logs(ts, food_id, grams, meal, note) VALUES (?,?,?,?,?)",
-        (datetime.utcnow().isoformat(), food_id, grams, meal.value, note)
-    )
-    # Decrement pantry FIFO by created_at
-    remaining = grams
-    rows = conn.execute(
-        "SELECT id, qty_g FROM pantry WHERE food_id=? AND qty_g>0 ORDER BY COALESCE(best_before, '9999-12-31'), created_at",
-        (food_id,)
-    ).fetchall()
-    for r in rows:
-        if remaining <= 0: break
-        pid, qty = r["id"], float(r["qty_g"])
-        take = min(qty, remaining)
-        conn.execute("UPDATE pantry SET qty_g = qty_g - ? WHERE id=?", (take, pid))
-        remaining -= take
-    conn.commit()
-    conn.close()
+    writer.write(log_consumption, [(food_id, grams, meal.value, note)])
     return RedirectResponse("/", status_code=303)
 
 @app.get("/api/summary")
-def api_summary(date_str: Optional[str] = None):
+def api_summary(request: Request, date_str: Optional[str] = None, conn: sqlite3.Connection = Depends(db_session)):
     if not date_str:
         date_str = date.today().isoformat()
-    day_start = date_str + "T00:00:00"
-    day_end = date_str + "T23:59:59"
-    conn = get_db()
-    totals = {"kcal":0.0, "prot_g":0.0, "carb_g":0.0, "fat_g":0.0, "fiber_g":0.0, "sodium_mg":0.0}
-    rows = conn.execute(
-        """
-        SELECT c.ts, c.grams, f.*
-        FROM consumption_logs c JOIN foods f ON c.food_id=f.id
-        WHERE c.ts BETWEEN ? AND ?
-        """,
-        (day_start, day_end)
-    ).fetchall()
-    for r in rows:
-        g = float(r["grams"]) / 100.0
-        totals["kcal"] += r["kcal_100g"] * g
-        totals["prot_g"] += r["prot_100g"] * g
-        totals["carb_g"] += r["carb_100g"] * g
-        totals["fat_g"]  += r["fat_100g"] * g
-        totals["fiber_g"] += r["fiber_100g"] * g
-        totals["sodium_mg"] += r["sodium_mg_100g"] * g
-
-    targets = compute_targets(conn)
-    conn.close()
-
-    def pct(part, whole):
-        return round(100*part/whole, 1) if whole > 0 else 0.0
-
-    response = {
-        "date": date_str,
-        "totals": {k: round(v, 1) for k, v in totals.items()},
-        "targets": targets,
-        "progress": {
-            "kcal_pct": pct(totals["kcal"], targets["kcal"]),
-            "prot_pct": pct(totals["prot_g"], targets["prot_g"]),
-            "carb_pct": pct(totals["carb_g"], targets["carb_g"]),
-            "fat_pct":  pct(totals["fat_g"], targets["fat_g"]),
-            "fiber_pct": pct(totals["fiber_g"], targets["fiber_g"]),
+
+    def build():
+        totals = day_totals(conn, date_str)
+        targets = compute_targets(conn)
+        return {
+            "date": date_str,
+            "totals": totals,
+            "targets": targets,
+            "progress": progress(totals, targets),
+        }
+
+    # i dashboard interrogano di continuo: 304 o risposta in cache finché i dati non cambiano
+    return cached_json(request, conn, "api_summary", date_str, build)
+
+
+@app.get("/api/summary/range")
+def api_summary_range(
+    request: Request,
+    start: date = Query(..., alias="from"),
+    end: date = Query(..., alias="to"),
+    granularity: Granularity = Granularity.day,
+    conn: sqlite3.Connection = Depends(db_session),
+):
+    def build():
+        targets = compute_targets(conn)
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "granularity": granularity.value,
+            "targets": targets,
+            "buckets": range_summary(conn, start, end, granularity.value, targets),
+            "rolling": rolling_averages(conn, end, targets=targets),
         }
-    }
-    return JSONResponse(response)
+
+    try:
+        return cached_json(request, conn, "api_summary_range", (start, end, granularity.value), build)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@app.get("/api/export/{kind}")
+def api_export(
+    kind: str = PathParam(..., pattern="^(consumption|pantry)$"),
+    format: str = Query("csv", pattern="^(csv|ndjson|parquet|arrow)$"),
+    start: Optional[date] = Query(None, alias="from"),
+    end: Optional[date] = Query(None, alias="to"),
+):
+    # connessione propria, tenuta per tutta la durata dello stream
+    try:
+        chunks = export_stream(kind, format, start, end)
+    except ExportUnavailable as e:
+        raise HTTPException(status_code=501, detail=str(e))
+    except ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    filename = export_filename(kind, format, start, end)
+    return StreamingResponse(
+        chunks,
+        media_type=EXPORT_MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+async def _chat_in_process(req: ChatRequest) -> Dict[str, Any]:
+    # stesso processo dell'agente: chiamata diretta all'handler, senza passare da HTTP
+    from foodly.agent.main import agent_chat
+    with request_scope():
+        resp = await agent_chat(req)
+    return resp.model_dump(mode="json")
+
+
+def _agent_client(app: FastAPI) -> httpx.AsyncClient:
+    # un solo client keep-alive verso l'agente, creato alla prima chat e chiuso dal lifespan
+    import httpx
+
+    client = getattr(app.state, "agent_client", None)
+    if client is None or client.is_closed:
+        client = app.state.agent_client = httpx.AsyncClient(
+            base_url=AGENT_URL,
+            timeout=AGENT_TIMEOUT_S,
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=20),
+        )
+    return client
 
 
 @app.post("/chat")
-async def chat(user_message: str = Form(...)):
+async def chat(
+    request: Request,
+    user_message: str = Form(...),
+    date_str: Optional[str] = Form(None),
+    use_rule_based: bool = Form(True),
+    idempotency_key: Optional[str] = Form(None),
+):
     """Endpoint to handle chat messages."""
-    agent_service_url = "http://127.0.0.1:8001/chat"
+    req = ChatRequest(
+        user_message=user_message, date_str=date_str or None, use_rule_based=use_rule_based,
+        idempotency_key=idempotency_key or None,
+    )
+    if AGENT_IN_PROCESS:
+        return JSONResponse(content=await _chat_in_process(req))
+    import httpx
+
     try:
-        async with httpx.AsyncClient() as client:
-            response = await client.post(
-                agent_service_url,
-                json={"message": user_message},
-                timeout=60.0,
-            )
-            response.raise_for_status()
-            agent_response = response.json()
-            return JSONResponse(content=agent_response)
-    except httpx.RequestError as e:
+        response = await _agent_client(request.app).post(
+            "/agent/chat", json=req.model_dump(mode="json"), headers=tenancy.forward_headers(request)
+        )
+        response.raise_for_status()
+        agent_response = response.json()
+        return JSONResponse(content=agent_response)
+    except httpx.HTTPError as e:
         return JSONResponse(
             status_code=500,
             content={"error": f"Error communicating with agent service: {e}"},
         )
+
+
+@app.post("/chat/stream")
+async def chat_stream(
+    request: Request,
+    user_message: str = Form(...),
+    date_str: Optional[str] = Form(None),
+    use_rule_based: bool = Form(True),
+    idempotency_key: Optional[str] = Form(None),
+    format: str = Query("ndjson", pattern="^(ndjson|sse)$"),
+):
+    """Relay the agent's event stream to the browser chunk by chunk, without buffering."""
+    from foodly.agent.main import STREAM_HEADERS, STREAM_MEDIA_TYPES, encode_event, open_chat_stream
+
+    req = ChatRequest(
+        user_message=user_message, date_str=date_str or None, use_rule_based=use_rule_based,
+        idempotency_key=idempotency_key or None,
+    )
+    media_type = STREAM_MEDIA_TYPES[format]
+    if AGENT_IN_PROCESS:
+        # con una chiave il turno parte già qui, nel contesto della richiesta
+        with request_scope():
+            stream = await open_chat_stream(req)
+
+        async def events():
+            with request_scope():
+                async for event, data in stream:
+                    yield encode_event(event, data, format)
+        return StreamingResponse(events(), media_type=media_type, headers=STREAM_HEADERS)
+
+    import httpx
+
+    client = _agent_client(request.app)
+    upstream = client.build_request(
+        "POST", "/agent/chat/stream", params={"format": format}, json=req.model_dump(mode="json"),
+        headers=tenancy.forward_headers(request),
+    )
+    try:
+        response = await client.send(upstream, stream=True)
+    except httpx.HTTPError as e:
+        return JSONResponse(status_code=500, content={"error": f"Error communicating with agent service: {e}"})
+    if response.is_error:
+        await response.aclose()
+        return JSONResponse(status_code=500, content={"error": f"Agent service answered {response.status_code}"})
+    return StreamingResponse(
+        response.aiter_raw(), media_type=media_type, headers=STREAM_HEADERS, background=BackgroundTask(response.aclose)
+    )
@@ -0,0 +1,123 @@
+"""Barcode lookup with an in-process cache of hot codes.
+
+Barcodes resolve through the unique partial index on ``foods.barcode``; a
+batch of codes is resolved with a single query. Recently resolved codes,
+including the ones not in the catalogue, are kept in an LRU per database file.
+
+The cache is validated against ``table_versions``: triggers bump the ``foods``
+counter on every insert, update or delete (the bulk importer bumps it once),
+so a lookup costs one primary-key read and any change to a food, made by this
+or another process, empties the cache.
+"""
+import json
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Dict, Iterable, Optional, Sequence, Tuple
+
+from foodly.core import metrics
+from foodly.core.db import db_path, on_evict, table_version
+from foodly.core.search import FOOD_COLUMNS
+
+BARCODE_CACHE_SIZE = int(os.getenv("FOODLY_BARCODE_CACHE_SIZE", "4096"))
+
+Food = Optional[Dict[str, Any]]
+
+
+def normalize_barcode(code: str) -> str:
+    return "".join(str(code).split())
+
+
+class BarcodeCache:
+    def __init__(self, size: int = BARCODE_CACHE_SIZE):
+        self.size = max(1, size)
+        self._entries: "OrderedDict[Tuple[Optional[Path], str], Food]" = OrderedDict()
+        self._versions: Dict[Optional[Path], int] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _check_version(self, db: Optional[Path], version: int):
+        if self._versions.get(db, version) != version:
+            for key in [k for k in self._entries if k[0] == db]:
+                del self._entries[key]
+            self.invalidations += 1
+        self._versions[db] = version
+
+    def lookup(self, conn: sqlite3.Connection, codes: Sequence[str]) -> Dict[str, Food]:
+        """Resolve ``codes`` to foods (``None`` when unknown), in input order."""
+        codes = list(dict.fromkeys(normalize_barcode(c) for c in codes))
+        db = db_path(conn)
+        version = table_version(conn, "foods")
+        found: Dict[str, Food] = {}
+        with self._lock:
+            self._check_version(db, version)
+            for code in codes:
+                key = (db, code)
+                if key in self._entries:
+                    self._entries.move_to_end(key)
+                    found[code] = self._entries[key]
+            self.hits += len(found)
+        missing = [c for c in codes if c not in found]
+        if missing:
+            # una sola query per tutto il lotto, sull'indice unico di foods.barcode
+            rows = conn.execute(
+                f"""
+                SELECT barcode, {", ".join(FOOD_COLUMNS)} FROM foods
+                WHERE barcode IN (SELECT value FROM json_each(?))
+                """,
+                (json.dumps(missing),),
+            ).fetchall()
+            resolved = {r[0]: dict(zip(FOOD_COLUMNS, tuple(r)[1:])) for r in rows}
+            with self._lock:
+                self.misses += len(missing)
+                # una modifica concorrente non deve lasciare in cache righe già vecchie
+                if db is not None and self._versions.get(db) == version:
+                    for code in missing:
+                        self._entries[(db, code)] = resolved.get(code)
+                        self._entries.move_to_end((db, code))
+                    while len(self._entries) > self.size:
+                        self._entries.popitem(last=False)
+            for code in missing:
+                found[code] = resolved.get(code)
+        return {c: found[c] for c in codes}
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._versions.clear()
+
+    def forget(self, db: Optional[Path]):
+        """Drop the codes cached for ``db`` (e.g. a shard that was closed)."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == db]:
+                del self._entries[key]
+            self._versions.pop(db, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+            }
+
+
+barcode_cache = BarcodeCache()
+on_evict(barcode_cache.forget)
+metrics.register_stats("foodly_barcode_cache", barcode_cache.stats, ("entries", "hits", "misses", "invalidations"))
+
+
+def food_by_barcode(conn: sqlite3.Connection, code: str) -> Food:
+    return barcode_cache.lookup(conn, [code])[normalize_barcode(code)]
+
+
+def foods_by_barcode(conn: sqlite3.Connection, codes: Iterable[str]) -> Dict[str, Food]:
+    return barcode_cache.lookup(conn, list(codes))
@@ -2,11 +2,14 @@ import sqlite3
 from datetime import date
 from typing import Dict, Tuple, Optional
 
+from foodly.core.context import memoized
+
 def bmr_mifflin(kg: float, cm: float, years: int, sex: str) -> float:
     base = 10*kg + 6.25*cm - 5*years
     return base + (5 if sex.upper() == 'M' else -161)
 
 
+@memoized
 def compute_targets(conn: sqlite3.Connection) -> Dict[str, float]:
     s = conn.execute("SELECT * FROM user_settings WHERE id=1").fetchone()
     kg = s["weight_kg"]; cm = s["height_cm"]; years = s["age"]; sex = s["sex"]; act = s["activity_level"]
@@ -27,6 +30,19 @@ def compute_targets(conn: sqlite3.Connection) -> Dict[str, float]:
     }
 
 
+def progress(totals: Dict[str, float], targets: Dict[str, float]) -> Dict[str, float]:
+    """Percentage of each target reached by ``totals``, rounded to one decimal."""
+    def pct(part, whole):
+        return round(100*part/whole, 1) if whole > 0 else 0.0
+    return {
+        "kcal_pct": pct(totals["kcal"], targets["kcal"]),
+        "prot_pct": pct(totals["prot_g"], targets["prot_g"]),
+        "carb_pct": pct(totals["carb_g"], targets["carb_g"]),
+        "fat_pct":  pct(totals["fat_g"], targets["fat_g"]),
+        "fiber_pct": pct(totals["fiber_g"], targets["fiber_g"]),
+    }
+
+
 def day_bounds(date_str: Optional[str] = None) -> Tuple[str, str]:
     """Return ISO 8601 start and end timestamps for the given day.
 
@@ -0,0 +1,119 @@
+"""Keyset-paginated listings of the food catalogue and of the pantry.
+
+Both listings are ordered by ``(name, id)`` and a page ends with an opaque
+cursor holding the last ``(name, id)`` seen; the next page starts strictly
+after it (``WHERE (name, id) > (?, ?)``), so every page is an index range
+scan however deep the client scrolls, and rows added meanwhile are neither
+skipped nor repeated. The name filter goes through the ``foods_fts`` index
+(accents and singular/plural folded, as in :mod:`foodly.core.search`).
+"""
+import base64
+import binascii
+import json
+import sqlite3
+from typing import Any, Dict, List, Optional, Tuple
+
+from foodly.core.search import fts_query
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+FOOD_LIST_COLUMNS = ("id", "name", "brand", "barcode", "kcal_100g", "prot_100g", "carb_100g", "fat_100g")
+
+
+def encode_cursor(name: str, row_id: int) -> str:
+    raw = json.dumps([name, row_id], ensure_ascii=False, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        name, row_id = json.loads(raw)
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError) as e:
+        raise ValueError(f"cursore non valido: {cursor!r}") from e
+    if not isinstance(name, str) or not isinstance(row_id, int):
+        raise ValueError(f"cursore non valido: {cursor!r}")
+    return name, row_id
+
+
+def _name_filter(conn: sqlite3.Connection, column: str, q: Optional[str]) -> Tuple[str, List[Any]]:
+    match = fts_query(q or "")
+    if not match:
+        return "", []
+    has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'foods_fts'").fetchone()
+    if has_fts:
+        return f" AND {column} IN (SELECT rowid FROM foods_fts WHERE foods_fts MATCH ?)", [match]
+    # schema senza indice full-text
+    return " AND f.name LIKE ?", [f"%{q.strip()}%"]
+
+
+def _fetch(conn: sqlite3.Connection, sql: str, params) -> List[sqlite3.Row]:
+    cur = conn.cursor()
+    cur.row_factory = sqlite3.Row
+    return cur.execute(sql, params).fetchall()
+
+
+def _page(rows: List[sqlite3.Row], limit: int, key: Tuple[str, str]) -> Dict[str, Any]:
+    items = [dict(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(last[key[0]], last[key[1]])
+    return {"items": items, "next_cursor": next_cursor}
+
+
+def list_foods(
+    conn: sqlite3.Connection,
+    q: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> Dict[str, Any]:
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    where, params = _name_filter(conn, "f.id", q)
+    if cursor:
+        where += " AND (f.name, f.id) > (?, ?)"
+        params += list(decode_cursor(cursor))
+    cols = ", ".join(f"f.{c}" for c in FOOD_LIST_COLUMNS)
+    # una riga in più dice se esiste la pagina successiva
+    rows = _fetch(
+        conn,
+        f"SELECT {cols} FROM foods f WHERE 1{where} ORDER BY f.name, f.id LIMIT ?",
+        (*params, limit + 1),
+    )
+    return _page(rows, limit, ("name", "id"))
+
+
+def list_pantry(
+    conn: sqlite3.Connection,
+    q: Optional[str] = None,
+    location: Optional[str] = None,
+    best_before: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: int = DEFAULT_PAGE_SIZE,
+) -> Dict[str, Any]:
+    """Pantry rows with their food; ``best_before`` keeps items expiring on or before that date."""
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    where, params = _name_filter(conn, "p.food_id", q)
+    if location:
+        where += " AND p.location = ? COLLATE NOCASE"
+        params.append(location.strip())
+    if best_before:
+        where += " AND p.best_before IS NOT NULL AND p.best_before <= ?"
+        params.append(best_before)
+    if cursor:
+        where += " AND (f.name, p.id) > (?, ?)"
+        params += list(decode_cursor(cursor))
+    rows = _fetch(
+        conn,
+        f"""
+        SELECT p.id AS pid, f.name, f.id AS food_id, p.qty_g, COALESCE(p.package_g, 0) AS package_g,
+               p.location, p.best_before
+        FROM pantry p JOIN foods f ON p.food_id = f.id
+        WHERE 1{where}
+        ORDER BY f.name, p.id
+        LIMIT ?
+        """,
+        (*params, limit + 1),
+    )
+    return _page(rows, limit, ("name", "pid"))
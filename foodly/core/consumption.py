@@ -0,0 +1,73 @@
+import json
+import sqlite3
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+# (food_id, grams, meal, note)
+LogRow = Tuple[int, float, str, Optional[str]]
+
+# Grammi richiesti per alimento, passati come JSON [[food_id, grams], ...]
+_NEED_CTE = """
+need(food_id, grams) AS (
+    SELECT json_extract(value, '$[0]'), json_extract(value, '$[1]') FROM json_each(?)
+)
+"""
+
+
+def log_consumption(conn: sqlite3.Connection, items: Iterable[LogRow]) -> List[Dict[str, float]]:
+    """Log every item and decrement the pantry FIFO, set-based.
+
+    All log rows go in with one ``executemany``; the pantry is then decremented
+    across lots with a single ``UPDATE ... FROM`` whose running sum per food
+    (earliest ``best_before`` first, then oldest lot) decides how much each lot
+    gives. Grams the pantry could not cover are returned per food as
+    ``[{"food_id": ..., "missing_g": ...}]``. The caller commits, so a whole
+    meal is one transaction.
+    """
+    rows = [(food_id, grams, meal, note) for food_id, grams, meal, note in items]
+    if not rows:
+        return []
+    ts = datetime.utcnow().isoformat()
+    conn.executemany(
+        "INSERT INTO consumption_logs(ts, food_id, grams, meal, note) VALUES (?,?,?,?,?)",
+        [(ts, *row) for row in rows],
+    )
+    need: Dict[int, float] = {}
+    for food_id, grams, _, _ in rows:
+        if grams > 0:
+            need[food_id] = need.get(food_id, 0.0) + grams
+    if not need:
+        return []
+    need_json = json.dumps([[food_id, grams] for food_id, grams in need.items()])
+
+    available = dict(conn.execute(
+        f"""
+        WITH {_NEED_CTE}
+        SELECT n.food_id, COALESCE(SUM(p.qty_g), 0)
+        FROM need n LEFT JOIN pantry p ON p.food_id = n.food_id AND p.qty_g > 0
+        GROUP BY n.food_id
+        """,
+        (need_json,),
+    ).fetchall())
+    conn.execute(
+        f"""
+        WITH {_NEED_CTE}, lots AS (
+            SELECT p.id, p.qty_g, n.grams,
+                   SUM(p.qty_g) OVER (
+                       PARTITION BY p.food_id
+                       ORDER BY COALESCE(p.best_before, '9999-12-31'), p.created_at, p.id
+                       ROWS UNBOUNDED PRECEDING
+                   ) - p.qty_g AS before
+            FROM need n JOIN pantry p ON p.food_id = n.food_id AND p.qty_g > 0
+        )
+        UPDATE pantry SET qty_g = qty_g - lots.take
+        FROM (SELECT id, MIN(qty_g, grams - before) AS take FROM lots WHERE before < grams) AS lots
+        WHERE pantry.id = lots.id
+        """,
+        (need_json,),
+    )
+    return [
+        {"food_id": food_id, "missing_g": round(grams - available.get(food_id, 0.0), 1)}
+        for food_id, grams in need.items()
+        if grams > available.get(food_id, 0.0)
+    ]
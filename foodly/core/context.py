@@ -0,0 +1,121 @@
+"""Request-scoped computation context.
+
+A chat turn asks for the same derived data several times: the day totals for
+the summary and again inside the pantry suggestion, the targets likewise.
+Inside ``with request_scope():`` functions decorated with :func:`memoized`
+compute each result once per (function, arguments, data version) and every
+connection lent by the pool counts the statements it runs, so a request can
+report how many queries it issued.
+
+The data version of a connection is its ``total_changes`` counter together
+with the number of batches committed by this process's writer
+(:mod:`foodly.core.writer`): any write made through the connection (including
+trigger side effects) or through the writer bumps it, so a value read before a
+write is never served after it. Commits by other processes are not tracked; a
+request sees the data as it was when it first read it, the same guarantee a
+read transaction would give. Outside a scope the decorated
+functions run unchanged. Memoized results are shared: treat them as read-only.
+"""
+import functools
+import sqlite3
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional, Tuple, TypeVar
+
+F = TypeVar("F", bound=Callable[..., Any])
+
+QUERY_COUNT_HEADER = "X-Foodly-Queries"
+
+
+class RequestContext:
+    def __init__(self):
+        self.memo: Dict[Hashable, Any] = {}
+        self.queries = 0
+        self.memo_hits = 0
+        self.memo_misses = 0
+        self._last_sql: Optional[str] = None
+
+    def _trace(self, sql: str):
+        # "--": istruzioni interne (FTS, trigger). Ogni sottoprogramma di trigger
+        # riporta di nuovo la scrittura che lo ha attivato: contata una volta sola.
+        if sql.startswith("--"):
+            return
+        if sql == self._last_sql and sql.lstrip()[:6].upper() != "SELECT":
+            return
+        self._last_sql = sql
+        self.queries += 1
+
+    def track(self, conn: sqlite3.Connection):
+        """Count the statements ``conn`` runs from now on (until it goes back to the pool)."""
+        conn.set_trace_callback(self._trace)
+
+    def stats(self) -> Dict[str, int]:
+        return {"queries": self.queries, "memo_hits": self.memo_hits, "memo_misses": self.memo_misses}
+
+
+_current: ContextVar[Optional[RequestContext]] = ContextVar("foodly_request_context", default=None)
+_user: ContextVar[Optional[str]] = ContextVar("foodly_user", default=None)
+
+
+def current_context() -> Optional[RequestContext]:
+    return _current.get()
+
+
+def current_user() -> Optional[str]:
+    return _user.get()
+
+
+@contextmanager
+def user_scope(user_id: Optional[str]) -> Iterator[None]:
+    """Route ``get_db()`` and the writer to ``user_id``'s shard inside the block."""
+    token = _user.set(user_id)
+    try:
+        yield
+    finally:
+        _user.reset(token)
+
+
+@contextmanager
+def request_scope() -> Iterator[RequestContext]:
+    ctx = RequestContext()
+    token = _current.set(ctx)
+    try:
+        yield ctx
+    finally:
+        _current.reset(token)
+
+
+_write_generation = 0
+
+
+def bump_write_generation():
+    global _write_generation
+    _write_generation += 1
+
+
+def data_version(conn: sqlite3.Connection) -> Tuple[int, int]:
+    return conn.total_changes, _write_generation
+
+
+def memoized(fn: F) -> F:
+    """Cache ``fn(conn, *args, **kwargs)`` for the current request scope."""
+    name = f"{fn.__module__}.{fn.__qualname__}"
+
+    @functools.wraps(fn)
+    def wrapper(conn: sqlite3.Connection, *args, **kwargs):
+        ctx = _current.get()
+        if ctx is None:
+            return fn(conn, *args, **kwargs)
+        key = (name, id(conn), args, tuple(sorted(kwargs.items())), data_version(conn))
+        try:
+            if key in ctx.memo:
+                ctx.memo_hits += 1
+                return ctx.memo[key]
+        except TypeError:
+            # argomenti non hashable: niente memo
+            return fn(conn, *args, **kwargs)
+        ctx.memo_misses += 1
+        result = ctx.memo[key] = fn(conn, *args, **kwargs)
+        return result
+
+    return wrapper  # type: ignore[return-value]
@@ -1,80 +1,372 @@
+import hashlib
+import os
+import re
 import sqlite3
+import threading
+import time
+from collections import OrderedDict
 from datetime import datetime
 from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from foodly.core import metrics
+from foodly.core.context import current_context, current_user
+from foodly.core.migrations import LATEST_VERSION, migrate, schema_version
 
 APP_DIR = Path(__file__).parent.parent.parent
 DB_PATH = APP_DIR / "foodly.db"
 
-def get_db():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
+POOL_SIZE = int(os.getenv("FOODLY_DB_POOL_SIZE", "8"))
+POOL_TIMEOUT_S = float(os.getenv("FOODLY_DB_POOL_TIMEOUT", "30"))
+
+# Un file SQLite per utente (shard), creato e migrato al primo accesso
+SHARDS_DIR = Path(os.getenv("FOODLY_SHARDS_DIR", str(APP_DIR / "shards")))
+MAX_OPEN_SHARDS = int(os.getenv("FOODLY_MAX_OPEN_SHARDS", "64"))
+SHARD_IDLE_S = float(os.getenv("FOODLY_SHARD_IDLE", "300"))
+SWEEP_INTERVAL_S = 10.0
+USER_ID_RE = re.compile(r"^[A-Za-z0-9][A-Za-z0-9_.@+-]{0,127}$")
+
+# Applicati a ogni nuova connessione del pool
+PRAGMAS = {
+    "journal_mode": "WAL",          # lettori e scrittore non si bloccano a vicenda
+    "synchronous": "NORMAL",        # sicuro con WAL, niente fsync a ogni commit
+    "cache_size": -16000,           # 16 MiB di page cache per connessione
+    "mmap_size": 128 * 1024 * 1024,
+    "busy_timeout": 5000,           # ms di attesa sul lock invece di fallire subito
+    "temp_store": "MEMORY",
+}
+
+
+class PooledConnection(sqlite3.Connection):
+    """SQLite connection owned by a :class:`ConnectionPool`.
+
+    ``close()`` hands the connection back to its pool instead of closing it, so
+    existing ``conn = get_db(); ...; conn.close()`` call sites keep working.
+    """
+
+    pool: Optional["ConnectionPool"] = None
+    owner: Optional[int] = None
+    checked_out: bool = False
+
+    def close(self):
+        if self.pool is None:
+            super().close()
+        else:
+            self.pool.release(self)
+
+    # con le metriche attive ogni cursore misura le proprie istruzioni;
+    # execute() del modulo C non passa da cursor(), quindi va ridefinito
+    def cursor(self, factory=None):
+        if factory is None:
+            factory = metrics.TimedCursor if metrics.enabled() else sqlite3.Cursor
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        if not metrics.enabled():
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not metrics.enabled():
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+class PoolClosed(RuntimeError):
+    """The pool was closed (e.g. its shard was evicted) while being used."""
+
+
+class ConnectionPool:
+    """Bounded pool of tuned connections to a single database file.
+
+    Idle connections are kept in LIFO order and a thread asking for a
+    connection gets back the one it released last when it is still idle, so the
+    page cache it warmed up is reused. When every connection is checked out the
+    caller waits up to ``timeout`` seconds for one to be released.
+    """
+
+    def __init__(self, path: Path, size: int = POOL_SIZE, timeout: float = POOL_TIMEOUT_S):
+        self.path = Path(path)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self._idle: List[PooledConnection] = []
+        self._open = 0
+        self._closed = False
+        self._cond = threading.Condition()
+        self.hits = 0
+        self.thread_hits = 0
+        self.misses = 0
+        self.waits = 0
+        self.wait_time_s = 0.0
+        self.last_used = time.monotonic()
+        # schema verificato (e shard migrato) al primo accesso, una volta sola
+        self.ready = False
+        self.init_lock = threading.Lock()
+
+    def _connect(self) -> PooledConnection:
+        conn = sqlite3.connect(self.path, factory=PooledConnection, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        for key, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {key}={value}")
+        conn.pool = self
+        return conn
+
+    def acquire(self) -> PooledConnection:
+        me = threading.get_ident()
+        with self._cond:
+            if self._closed:
+                raise PoolClosed(f"connection pool for {self.path} is closed")
+            if not self._idle and self._open >= self.size:
+                self.waits += 1
+                start = time.monotonic()
+                while not self._idle and self._open >= self.size:
+                    remaining = start + self.timeout - time.monotonic()
+                    if remaining <= 0:
+                        raise TimeoutError(f"no free connection to {self.path} after {self.timeout}s")
+                    self._cond.wait(remaining)
+                self.wait_time_s += time.monotonic() - start
+            conn = None
+            if self._idle:
+                for i in range(len(self._idle) - 1, -1, -1):
+                    if self._idle[i].owner == me:
+                        conn = self._idle.pop(i)
+                        self.thread_hits += 1
+                        break
+                else:
+                    conn = self._idle.pop()
+                self.hits += 1
+            else:
+                self._open += 1
+                self.misses += 1
+        if conn is None:
+            try:
+                conn = self._connect()
+            except Exception:
+                with self._cond:
+                    self._open -= 1
+                    self._cond.notify()
+                raise
+        conn.owner = me
+        conn.checked_out = True
+        return conn
+
+    def release(self, conn: PooledConnection):
+        if not conn.checked_out:
+            return
+        conn.checked_out = False
+        try:
+            conn.set_trace_callback(None)
+            # le modifiche non confermate vengono scartate, come con una close()
+            if conn.in_transaction:
+                conn.rollback()
+            healthy = True
+        except sqlite3.Error:
+            healthy = False
+        with self._cond:
+            if healthy and not self._closed:
+                self._idle.append(conn)
+            else:
+                self._open -= 1
+                sqlite3.Connection.close(conn)
+            self._cond.notify()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            for conn in self._idle:
+                sqlite3.Connection.close(conn)
+            self._open -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def in_use(self) -> int:
+        with self._cond:
+            return self._open - len(self._idle)
+
+    def stats(self) -> Dict[str, float]:
+        with self._cond:
+            return {
+                "size": self.size,
+                "open": self._open,
+                "idle": len(self._idle),
+                "in_use": self._open - len(self._idle),
+                "hits": self.hits,
+                "thread_hits": self.thread_hits,
+                "misses": self.misses,
+                "waits": self.waits,
+                "wait_time_s": round(self.wait_time_s, 6),
+            }
+
+
+_pools: "OrderedDict[Path, ConnectionPool]" = OrderedDict()
+_pools_lock = threading.Lock()
+_last_sweep = 0.0
+_evict_hooks: List[Callable[[Path], None]] = []
+
+
+def shard_path(user_id: str) -> Path:
+    """Shard file of ``user_id``; the name is a hash, so any valid id maps to a safe, distinct file."""
+    if not USER_ID_RE.match(user_id or ""):
+        raise ValueError(f"user id non valido: {user_id!r}")
+    digest = hashlib.sha256(user_id.encode()).hexdigest()
+    # due livelli di directory: migliaia di shard senza una cartella enorme
+    return SHARDS_DIR / digest[:2] / f"{digest[:32]}.db"
+
+
+def on_evict(hook: Callable[[Path], None]):
+    """Call ``hook(path)`` when the pool of a shard is closed for idleness or to make room."""
+    _evict_hooks.append(hook)
+
+
+def _pick_evictions(now: float, keep: Path) -> List[ConnectionPool]:
+    # pool degli shard dal meno recente; quello di default non viene mai chiuso
+    default = Path(DB_PATH)
+    shards = [(path, pool) for path, pool in _pools.items() if path != default]
+    excess = len(shards) - MAX_OPEN_SHARDS
+    victims = []
+    for path, pool in shards:
+        if path == keep or pool.in_use():
+            continue
+        if excess > 0 or now - pool.last_used >= SHARD_IDLE_S:
+            del _pools[path]
+            victims.append(pool)
+            excess -= 1
+    return victims
+
+
+def get_pool(path: Optional[Path] = None) -> ConnectionPool:
+    global _last_sweep
+    path = Path(path or DB_PATH)
+    now = time.monotonic()
+    victims: List[ConnectionPool] = []
+    with _pools_lock:
+        pool = _pools.get(path)
+        if pool is None:
+            pool = _pools[path] = ConnectionPool(path)
+            created = True
+        else:
+            _pools.move_to_end(path)
+            created = False
+        pool.last_used = now
+        if created or now - _last_sweep >= SWEEP_INTERVAL_S:
+            _last_sweep = now
+            victims = _pick_evictions(now, path)
+    for victim in victims:
+        victim.close()
+        for hook in _evict_hooks:
+            hook(victim.path)
+    return pool
+
+
+def _open_pool(user_id: Optional[str]) -> ConnectionPool:
+    pool = get_pool(None if user_id is None else shard_path(user_id))
+    if not pool.ready:
+        _prepare(pool)
+    return pool
+
+
+def resolve_db(user_id: Optional[str] = None) -> Path:
+    """Database file of ``user_id`` (by default the request's user), created and migrated if needed.
+
+    Without a user (single-tenant deployments, scripts) it is ``DB_PATH``.
+    """
+    return _open_pool(user_id if user_id is not None else current_user()).path
+
+
+def get_db(user_id: Optional[str] = None) -> PooledConnection:
+    """Pooled connection to ``user_id``'s shard; by default the request's user, or ``DB_PATH`` without one."""
+    if user_id is None:
+        user_id = current_user()
+    try:
+        conn = _open_pool(user_id).acquire()
+    except PoolClosed:
+        # shard chiuso da un'eviction concorrente: se ne riapre il pool
+        conn = _open_pool(user_id).acquire()
+    # dentro request_scope() le query della connessione vengono contate
+    ctx = current_context()
+    if ctx is not None:
+        ctx.track(conn)
     return conn
 
 
-def init_db():
+def db_session() -> Iterator[PooledConnection]:
+    """FastAPI dependency: lends a pooled connection for the request."""
     conn = get_db()
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+def db_path(conn: sqlite3.Connection) -> Optional[Path]:
+    """File behind ``conn``, to key per-database caches; ``None`` for in-memory databases."""
+    pool = getattr(conn, "pool", None)
+    if pool is not None:
+        return Path(pool.path)
+    path = conn.execute("PRAGMA database_list").fetchone()[2]
+    return Path(path) if path else None
+
+
+def table_version(conn: sqlite3.Connection, name: str) -> int:
+    """Change counter of table ``name`` kept by triggers (0 if not tracked)."""
+    row = conn.execute("SELECT version FROM table_versions WHERE name = ?", (name,)).fetchone()
+    return row[0] if row else 0
+
+
+def table_versions(conn: sqlite3.Connection, names: Sequence[str]) -> Tuple[int, ...]:
+    """Change counters of ``names`` in one query, in the same order."""
+    rows = dict(conn.execute(
+        f"SELECT name, version FROM table_versions WHERE name IN ({','.join('?' * len(names))})", tuple(names)
+    ).fetchall())
+    return tuple(rows.get(name, 0) for name in names)
+
+
+def pool_stats() -> Dict[str, Dict[str, float]]:
+    with _pools_lock:
+        pools = list(_pools.items())
+    return {str(path): pool.stats() for path, pool in pools}
+
+
+def _pool_samples():
+    stats = pool_stats()
+    return [
+        (f"foodly_db_pool_{key}", "gauge", f"Connection pool {key.replace('_', ' ')}.",
+         [({"db": path}, values[key]) for path, values in stats.items()])
+        for key in ("open", "in_use", "idle", "waits", "wait_time_s")
+    ]
+
+
+metrics.register_collector(_pool_samples)
+
+
+def close_pools():
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+def init_db(path: Optional[Path] = None):
+    """Create, migrate and seed the database at ``path`` (``DB_PATH``) unless its schema is already current."""
+    _prepare(get_pool(path))
+
+
+def _prepare(pool: ConnectionPool):
+    with pool.init_lock:
+        pool.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = pool.acquire()
+        try:
+            # schema aggiornato: una sola PRAGMA, niente DDL né controlli sui dati di esempio
+            if schema_version(conn) < LATEST_VERSION and migrate(conn):
+                _seed(conn)
+        finally:
+            conn.close()
+        pool.ready = True
+
+
+def _seed(conn: PooledConnection):
     cur = conn.cursor()
-    # Core tables
-    cur.executescript(
-        """
-        CREATE TABLE IF NOT EXISTS foods (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            name TEXT NOT NULL,
-            brand TEXT,
-            barcode TEXT,
-            kcal_100g REAL NOT NULL,
-            prot_100g REAL NOT NULL,
-            carb_100g REAL NOT NULL,
-            fat_100g REAL NOT NULL,
-            fiber_100g REAL DEFAULT 0,
-            sugar_100g REAL DEFAULT 0,
-            satfat_100g REAL DEFAULT 0,
-            sodium_mg_100g REAL DEFAULT 0,
-            source TEXT,
-            last_updated TEXT
-        );
-
-        CREATE TABLE IF NOT EXISTS pantry (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            food_id INTEGER NOT NULL,
-            qty_g REAL NOT NULL,
-            package_g REAL,
-            location TEXT,
-            best_before TEXT,
-            created_at TEXT DEFAULT (datetime('now')),
-            FOREIGN KEY(food_id) REFERENCES foods(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS consumption_logs (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            ts TEXT NOT NULL,
-            food_id INTEGER NOT NULL,
-            grams REAL NOT NULL,
-            meal TEXT,
-            note TEXT,
-            FOREIGN KEY(food_id) REFERENCES foods(id)
-        );
-
-        CREATE TABLE IF NOT EXISTS user_settings (
-            id INTEGER PRIMARY KEY CHECK (id = 1),
-            weight_kg REAL DEFAULT 75,
-            height_cm REAL DEFAULT 175,
-            age INTEGER DEFAULT 30,
-            sex TEXT DEFAULT 'M',               -- 'M' or 'F'
-            activity_level REAL DEFAULT 1.5,    -- 1.2..1.9
-            kcal_target REAL,                   -- if NULL, use TDEE
-            protein_g_per_kg REAL DEFAULT 1.8,
-            fat_g_per_kg REAL DEFAULT 0.8,
-            llm_api_key TEXT
-        );
-        """
-    )
-
-    # ensure new column exists for existing installations
-    cur.execute("PRAGMA table_info(user_settings)")
-    cols = [r[1] for r in cur.fetchall()]
-    if "llm_api_key" not in cols:
-        cur.execute("ALTER TABLE user_settings ADD COLUMN llm_api_key TEXT")
 
     # Seed settings
     cur.execute("INSERT OR IGNORE INTO user_settings(id) VALUES (1)")
@@ -120,4 +412,3 @@ def init_db():
         )
 
     conn.commit()
-    conn.close()
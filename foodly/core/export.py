@@ -0,0 +1,247 @@
+"""Streaming exports of consumption logs and pantry rows.
+
+Rows are read from one SQLite cursor in batches of ``EXPORT_BATCH_ROWS``
+(``fetchmany``) and each batch is encoded and handed to the caller before the
+next one is read, so memory stays flat whatever the date range. Every row
+carries the food's name and nutrients: consumption logs with the nutrients of
+the logged grams, pantry rows with the values per 100 g.
+
+Formats: ``csv`` and ``ndjson`` always; ``parquet`` and ``arrow`` (IPC
+stream) when ``pyarrow`` is installed, one row group / record batch per batch.
+"""
+import csv
+import io
+import json
+import sqlite3
+from datetime import date, timedelta
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from foodly.core.context import current_user
+from foodly.core.db import get_db
+from foodly.core.migrations import LOG_NUTRIENT_EXPRS
+
+EXPORT_BATCH_ROWS = 1000
+
+FORMATS = ("csv", "ndjson", "parquet", "arrow")
+MEDIA_TYPES = {
+    "csv": "text/csv; charset=utf-8",
+    "ndjson": "application/x-ndjson",
+    "parquet": "application/vnd.apache.parquet",
+    "arrow": "application/vnd.apache.arrow.stream",
+}
+COLUMNAR_FORMATS = ("parquet", "arrow")
+
+_LOG_NUTRIENTS = ", ".join(
+    f"{expr.format(g='c.grams')} AS {name}"
+    for expr, name in zip(LOG_NUTRIENT_EXPRS, ("kcal", "prot_g", "carb_g", "fat_g", "fiber_g", "sodium_mg"))
+)
+
+# nome -> (query con i filtri {where}, colonne con tipo)
+EXPORTS: Dict[str, Tuple[str, Sequence[Tuple[str, str]]]] = {
+    "consumption": (
+        f"""
+        SELECT c.id, c.ts, c.meal, c.food_id, f.name AS food_name, f.brand, c.grams, {_LOG_NUTRIENTS}, c.note
+        FROM consumption_logs c JOIN foods f ON f.id = c.food_id
+        WHERE 1{{where}}
+        ORDER BY c.ts, c.id
+        """,
+        (
+            ("id", "int"), ("ts", "str"), ("meal", "str"), ("food_id", "int"), ("food_name", "str"),
+            ("brand", "str"), ("grams", "float"), ("kcal", "float"), ("prot_g", "float"), ("carb_g", "float"),
+            ("fat_g", "float"), ("fiber_g", "float"), ("sodium_mg", "float"), ("note", "str"),
+        ),
+    ),
+    "pantry": (
+        """
+        SELECT p.id, p.created_at, p.food_id, f.name AS food_name, f.brand, p.qty_g, p.package_g,
+               p.location, p.best_before, f.kcal_100g, f.prot_100g, f.carb_100g, f.fat_100g,
+               f.fiber_100g, f.sodium_mg_100g
+        FROM pantry p JOIN foods f ON f.id = p.food_id
+        WHERE 1{where}
+        ORDER BY p.id
+        """,
+        (
+            ("id", "int"), ("created_at", "str"), ("food_id", "int"), ("food_name", "str"), ("brand", "str"),
+            ("qty_g", "float"), ("package_g", "float"), ("location", "str"), ("best_before", "str"),
+            ("kcal_100g", "float"), ("prot_100g", "float"), ("carb_100g", "float"), ("fat_100g", "float"),
+            ("fiber_100g", "float"), ("sodium_mg_100g", "float"),
+        ),
+    ),
+}
+# colonna su cui si applica l'intervallo di date
+_DATE_COLUMNS = {"consumption": "c.ts", "pantry": "p.created_at"}
+
+
+class ExportError(ValueError):
+    pass
+
+
+class ExportUnavailable(ExportError):
+    """Format needing an optional dependency that is not installed."""
+
+
+def columns(kind: str) -> List[str]:
+    return [name for name, _ in EXPORTS[kind][1]]
+
+
+def iter_batches(
+    conn: sqlite3.Connection,
+    kind: str,
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> Iterator[List[Tuple]]:
+    """Row tuples of export ``kind`` in batches; ``start``/``end`` are inclusive days."""
+    check_export(kind, "csv", start, end)
+    sql, _ = EXPORTS[kind]
+    where, params = "", []
+    column = _DATE_COLUMNS[kind]
+    if start:
+        where += f" AND {column} >= ?"
+        params.append(start.isoformat())
+    if end:
+        # fine inclusa: tutto ciò che precede il giorno successivo
+        where += f" AND {column} < ?"
+        params.append((end + timedelta(days=1)).isoformat())
+    cur = conn.cursor()
+    cur.row_factory = None
+    cur.arraysize = batch_rows
+    cur.execute(sql.format(where=where), params)
+    try:
+        while True:
+            rows = cur.fetchmany()
+            if not rows:
+                return
+            yield rows
+    finally:
+        cur.close()
+
+
+def encode_csv(kind: str, batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    buf = io.StringIO()
+    writer = csv.writer(buf)
+    writer.writerow(columns(kind))
+    for rows in batches:
+        writer.writerows(rows)
+        yield buf.getvalue().encode()
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode()
+
+
+def encode_ndjson(kind: str, batches: Iterator[List[Tuple]]) -> Iterator[bytes]:
+    names = columns(kind)
+    for rows in batches:
+        yield "".join(
+            json.dumps(dict(zip(names, row)), ensure_ascii=False, separators=(",", ":")) + "\n" for row in rows
+        ).encode()
+
+
+def _require_pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ExportUnavailable("i formati parquet e arrow richiedono pyarrow (pip install pyarrow)") from None
+    return pyarrow
+
+
+class _Chunks:
+    """Write-only file object whose bytes are collected and drained by the generator."""
+
+    def __init__(self):
+        self.parts: List[bytes] = []
+        self.closed = False
+        self._pos = 0
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self.parts.append(data)
+        self._pos += len(data)
+        return len(data)
+
+    def tell(self) -> int:
+        return self._pos
+
+    def writable(self) -> bool:
+        return True
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self) -> bytes:
+        out, self.parts = b"".join(self.parts), []
+        return out
+
+
+def encode_columnar(kind: str, batches: Iterator[List[Tuple]], fmt: str) -> Iterator[bytes]:
+    pa = _require_pyarrow()
+    types = {"int": pa.int64(), "float": pa.float64(), "str": pa.string()}
+    schema = pa.schema([(name, types[t]) for name, t in EXPORTS[kind][1]])
+    sink = _Chunks()
+    if fmt == "parquet":
+        import pyarrow.parquet as pq
+        writer = pq.ParquetWriter(pa.PythonFile(sink, mode="w"), schema)
+    else:
+        writer = pa.ipc.new_stream(pa.PythonFile(sink, mode="w"), schema)
+    try:
+        for rows in batches:
+            cols = list(zip(*rows))
+            writer.write_table(pa.Table.from_arrays([pa.array(c, type=f.type) for c, f in zip(cols, schema)], schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+
+def check_export(kind: str, fmt: str, start: Optional[date] = None, end: Optional[date] = None):
+    """Raise ``ExportError`` for a request that cannot be served (before any byte is sent)."""
+    if kind not in EXPORTS:
+        raise ExportError(f"export sconosciuto: {kind}")
+    if start and end and start > end:
+        raise ExportError("'from' deve precedere 'to'")
+    if fmt not in FORMATS:
+        raise ExportError(f"formato non supportato: {fmt}")
+    if fmt in COLUMNAR_FORMATS:
+        _require_pyarrow()
+
+
+def export_stream(
+    kind: str,
+    fmt: str = "csv",
+    start: Optional[date] = None,
+    end: Optional[date] = None,
+    batch_rows: int = EXPORT_BATCH_ROWS,
+) -> Iterator[bytes]:
+    """Encoded export on its own pooled connection, released when the stream ends or is closed."""
+    check_export(kind, fmt, start, end)
+    # l'utente si fissa ora: il generatore può girare fuori dal contesto della richiesta
+    return _stream(kind, fmt, start, end, batch_rows, current_user())
+
+
+def _stream(
+    kind: str, fmt: str, start: Optional[date], end: Optional[date], batch_rows: int, user_id: Optional[str]
+) -> Iterator[bytes]:
+    conn = get_db(user_id)
+    try:
+        batches = iter_batches(conn, kind, start, end, batch_rows)
+        if fmt == "csv":
+            chunks = encode_csv(kind, batches)
+        elif fmt == "ndjson":
+            chunks = encode_ndjson(kind, batches)
+        else:
+            chunks = encode_columnar(kind, batches, fmt)
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+    finally:
+        conn.close()
+
+
+def export_filename(kind: str, fmt: str, start: Optional[date] = None, end: Optional[date] = None) -> str:
+    span = "".join(f"_{d.isoformat()}" for d in (start, end) if d)
+    return f"foodly_{kind}{span}.{fmt}"
+
@@ -0,0 +1,128 @@
+"""Conditional GET and a response cache for polled read endpoints.
+
+Dashboards poll the day summary every few seconds, and the answer changes
+only when a consumption is logged or the settings are edited. Endpoints served
+through :func:`cached_json` name the tables their answer is built from. The
+``table_versions`` counters of those tables (bumped by triggers, so they see
+writes from any connection, process or the writer) identify the data:
+
+- the ``ETag`` is a hash of endpoint, parameters, database and those
+  counters. A request whose ``If-None-Match`` matches gets ``304 Not
+  Modified`` after one primary-key read, without building the answer;
+- otherwise the encoded body is served from an in-process LRU keyed by
+  (database, endpoint, parameters) while the counters are unchanged, and
+  rebuilt once they move.
+
+Responses carry ``Cache-Control: no-cache``: clients may keep them but must
+revalidate, so a poll never shows stale data.
+"""
+import hashlib
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Hashable, Optional, Sequence, Tuple
+
+from foodly.core import metrics
+from foodly.core.db import db_path, on_evict, table_versions
+
+RESPONSE_CACHE_SIZE = int(os.getenv("FOODLY_RESPONSE_CACHE_SIZE", "256"))
+
+# riepiloghi e obiettivi: totali giornalieri (consumi, rollup) e impostazioni utente
+SUMMARY_TABLES = ("daily_totals", "user_settings")
+
+Key = Tuple[Optional[Path], str, Hashable]
+
+
+def _matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    # confronto debole (RFC 9110): W/"x" vale "x"
+    tags = {t.strip().removeprefix("W/") for t in if_none_match.split(",")}
+    return "*" in tags or etag in tags
+
+
+class ResponseCache:
+    def __init__(self, size: int = RESPONSE_CACHE_SIZE):
+        self.size = max(1, size)
+        self._entries: "OrderedDict[Key, Tuple[Tuple[int, ...], bytes]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def get(self, key: Key, versions: Tuple[int, ...]) -> Optional[bytes]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] != versions:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Key, versions: Tuple[int, ...], body: bytes):
+        with self._lock:
+            # una sola voce per chiave: quella di versioni precedenti viene sostituita
+            self._entries[key] = (versions, body)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.size:
+                self._entries.popitem(last=False)
+
+    def forget(self, db: Optional[Path]):
+        """Drop the responses cached for ``db`` (e.g. a shard that was closed)."""
+        with self._lock:
+            for key in [k for k in self._entries if k[0] == db]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size": self.size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified,
+            }
+
+
+response_cache = ResponseCache()
+on_evict(response_cache.forget)
+metrics.register_stats("foodly_response_cache", response_cache.stats, ("entries", "hits", "misses", "not_modified"))
+
+
+def cached_json(
+    request,
+    conn: sqlite3.Connection,
+    endpoint: str,
+    params: Hashable,
+    build: Callable[[], Any],
+    tables: Sequence[str] = SUMMARY_TABLES,
+):
+    """JSON response of ``build()`` with ``ETag`` revalidation and caching.
+
+    ``params`` must identify the answer together with the data of ``tables``
+    (e.g. the resolved date, never ``None`` for "today").
+    """
+    from fastapi.responses import JSONResponse, Response
+
+    db = db_path(conn)
+    versions = table_versions(conn, tables)
+    digest = hashlib.sha1(repr((str(db), endpoint, params, tuple(tables), versions)).encode()).hexdigest()
+    headers = {"ETag": f'"{digest[:32]}"', "Cache-Control": "no-cache"}
+    if _matches(request.headers.get("if-none-match"), headers["ETag"]):
+        response_cache.not_modified += 1
+        return Response(status_code=304, headers=headers)
+    key = (db, endpoint, params)
+    body = response_cache.get(key, versions)
+    if body is None:
+        body = JSONResponse(build()).body
+        # database in memoria: nessuna identità stabile, la risposta non viene tenuta
+        if db is not None:
+            response_cache.put(key, versions, body)
+    return Response(body, media_type="application/json", headers=headers)
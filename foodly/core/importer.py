@@ -0,0 +1,393 @@
+"""Streaming bulk import of the food catalogue.
+
+Reads CSV/TSV or JSON Lines (optionally gzip-compressed) one row at a time, so
+memory stays constant whatever the file size, and understands both Foodly's own
+column names and the Open Food Facts export (``code``, ``product_name``,
+``energy-kcal_100g``, ``proteins_100g``, ``salt_100g``, nested ``nutriments``
+in JSONL, ...). Rows are validated and written in chunks with ``executemany``;
+a row whose barcode already exists updates that food instead of adding a
+duplicate. When that changes the nutrients of a food that was already logged,
+the ``daily_totals`` rollup of the days it was logged on is rebuilt together
+with the update; the ids of those foods are reported as ``nutrients_changed``.
+
+For large loads the triggers and secondary indexes on ``foods`` (FTS sync,
+name index) are dropped first and recreated at the end, followed by a single
+FTS ``rebuild``: building an index once is much cheaper than updating it row by
+row. Dropping, loading and recreating happen in one transaction, so a failed or
+interrupted import (even a killed process) leaves the catalogue and its schema
+as they were, but holds the write lock for the whole load. With
+``rebuild_indexes=False`` (``--keep-indexes``) the rows are instead committed
+every ``txn_rows`` rows, the lock is released while the next chunk is read and
+the chunks already committed stay: that is how uploads to a running service
+are loaded (``ONLINE_TXN_ROWS``).
+
+Command line::
+
+    python -m foodly.core.importer FILE [--format csv|tsv|jsonl] [--source off] [--keep-indexes] [--user ID]
+
+The catalogue lives in each database: ``--user`` loads it into that user's
+shard (created if needed) instead of the default one. New shards are never
+filled from another database, so a large catalogue is only copied for the
+users it is loaded for.
+"""
+import argparse
+import codecs
+import csv
+import gzip
+import io
+import json
+import sqlite3
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import IO, Any, Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
+
+from foodly.core.rollup import rebuild_daily_totals
+
+CHUNK_ROWS = 5000
+TXN_ROWS = 100_000
+# import da un servizio in esercizio: transazioni brevi, il writer e le chat non restano in attesa
+ONLINE_TXN_ROWS = 1000
+MAX_ERRORS = 20
+
+# colonna Foodly -> nomi accettati in ingresso (Foodly, poi Open Food Facts)
+COLUMNS = {
+    "name": ("name", "product_name", "product_name_it", "product_name_en", "generic_name"),
+    "brand": ("brand", "brands"),
+    "barcode": ("barcode", "code"),
+    "kcal_100g": ("kcal_100g", "energy-kcal_100g", "energy_kcal_100g"),
+    "prot_100g": ("prot_100g", "proteins_100g"),
+    "carb_100g": ("carb_100g", "carbohydrates_100g"),
+    "fat_100g": ("fat_100g",),
+    "fiber_100g": ("fiber_100g",),
+    "sugar_100g": ("sugar_100g", "sugars_100g"),
+    "satfat_100g": ("satfat_100g", "saturated-fat_100g"),
+    "sodium_mg_100g": ("sodium_mg_100g",),
+}
+REQUIRED = ("kcal_100g", "prot_100g", "carb_100g", "fat_100g")
+OPTIONAL = ("fiber_100g", "sugar_100g", "satfat_100g", "sodium_mg_100g")
+# limiti per 100 g oltre i quali la riga è scartata
+LIMITS = {"kcal_100g": 950.0, "sodium_mg_100g": 40_000.0}
+MAX_G_100G = 100.0
+
+_UPSERT = """
+INSERT INTO foods
+(name, brand, barcode, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sugar_100g, satfat_100g, sodium_mg_100g, source, last_updated)
+VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+ON CONFLICT(barcode) WHERE barcode IS NOT NULL DO UPDATE SET
+    name = excluded.name,
+    brand = COALESCE(excluded.brand, foods.brand),
+    kcal_100g = excluded.kcal_100g,
+    prot_100g = excluded.prot_100g,
+    carb_100g = excluded.carb_100g,
+    fat_100g = excluded.fat_100g,
+    fiber_100g = excluded.fiber_100g,
+    sugar_100g = excluded.sugar_100g,
+    satfat_100g = excluded.satfat_100g,
+    sodium_mg_100g = excluded.sodium_mg_100g,
+    source = excluded.source,
+    last_updated = excluded.last_updated
+"""
+
+# nutrienti usati dal rollup dei consumi: se cambiano, i totali giornalieri vanno ricalcolati
+_ROLLUP_COLUMNS = ("kcal_100g", "prot_100g", "carb_100g", "fat_100g", "fiber_100g", "sodium_mg_100g")
+
+_LOGGED_NUTRIENTS = f"""
+SELECT id, {", ".join(_ROLLUP_COLUMNS)} FROM foods
+WHERE barcode IN (SELECT value FROM json_each(?))
+  AND EXISTS (SELECT 1 FROM consumption_logs c WHERE c.food_id = foods.id)
+"""
+
+Source = Union[str, Path, IO[bytes]]
+
+
+def _number(value: Any) -> Optional[float]:
+    if value is None or value == "":
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(str(value).strip().replace(",", "."))
+
+
+def _first(row: Dict[str, Any], names: Iterable[str]) -> Any:
+    for n in names:
+        v = row.get(n)
+        if v not in (None, ""):
+            return v
+    return None
+
+
+def normalize_row(row: Dict[str, Any]) -> Dict[str, Any]:
+    """Map one input record to ``foods`` columns; raises ``ValueError`` if it is unusable."""
+    nutriments = row.get("nutriments")
+    if isinstance(nutriments, dict):
+        row = {**nutriments, **{k: v for k, v in row.items() if k != "nutriments"}}
+    out: Dict[str, Any] = {}
+    name = _first(row, COLUMNS["name"])
+    if not name or not str(name).strip():
+        raise ValueError("nome mancante")
+    out["name"] = str(name).strip()
+    brand = _first(row, COLUMNS["brand"])
+    # Open Food Facts: "Marca A,Marca B" -> prima marca
+    out["brand"] = str(brand).split(",")[0].strip() or None if brand else None
+    barcode = _first(row, COLUMNS["barcode"])
+    out["barcode"] = str(barcode).strip() or None if barcode is not None else None
+
+    for key in REQUIRED + OPTIONAL:
+        out[key] = _number(_first(row, COLUMNS[key]))
+    if out["kcal_100g"] is None and row.get("energy_100g") not in (None, ""):
+        out["kcal_100g"] = _number(row["energy_100g"]) / 4.184  # kJ -> kcal
+    if out["sodium_mg_100g"] is None:
+        if row.get("sodium_100g") not in (None, ""):
+            out["sodium_mg_100g"] = _number(row["sodium_100g"]) * 1000.0
+        elif row.get("salt_100g") not in (None, ""):
+            out["sodium_mg_100g"] = _number(row["salt_100g"]) * 400.0  # sale = 2.5 x sodio
+
+    for key in REQUIRED:
+        if out[key] is None:
+            raise ValueError(f"{key} mancante")
+    for key in REQUIRED + OPTIONAL:
+        v = out[key]
+        if v is None:
+            out[key] = 0.0
+            continue
+        if v != v or v < 0 or v > LIMITS.get(key, MAX_G_100G):
+            raise ValueError(f"{key} fuori intervallo: {v}")
+    return out
+
+
+def _open_binary(source: Source) -> Tuple[IO[bytes], bool]:
+    if isinstance(source, (str, Path)):
+        return open(source, "rb"), True
+    return source, False
+
+
+def detect_format(name: str) -> str:
+    name = name.lower().removesuffix(".gz")
+    if name.endswith((".jsonl", ".ndjson", ".json")):
+        return "jsonl"
+    if name.endswith((".tsv", ".tab")):
+        return "tsv"
+    return "csv"
+
+
+def iter_records(stream: IO[bytes], fmt: str) -> Iterator[Dict[str, Any]]:
+    """Yield input records one by one (gzip is detected from the magic bytes)."""
+    if hasattr(stream, "peek"):
+        head = stream.peek(2)[:2]
+    else:
+        head = stream.read(2)
+        stream.seek(0)
+    if head == b"\x1f\x8b":
+        stream = gzip.GzipFile(fileobj=stream)
+    text = io.TextIOWrapper(stream, encoding="utf-8-sig", errors="replace", newline="")
+    if fmt == "jsonl":
+        for line in text:
+            line = line.strip()
+            if line:
+                yield json.loads(line)
+        return
+    if fmt == "csv":
+        sample = text.readline()
+        # gli export di Open Food Facts sono separati da tab anche con estensione .csv
+        delimiter = "\t" if sample.count("\t") > sample.count(",") else ","
+        lines = _chain([sample], text)
+    else:
+        delimiter, lines = "\t", text
+    csv.field_size_limit(sys.maxsize)
+    yield from csv.DictReader(lines, delimiter=delimiter)
+
+
+def _chain(first: List[str], rest: Iterable[str]) -> Iterator[str]:
+    yield from first
+    yield from rest
+
+
+class ImportStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.read = 0
+        self.inserted = 0
+        self.updated = 0
+        self.rejected = 0
+        self.errors: List[Dict[str, Any]] = []
+        # alimenti già consumati i cui nutrienti sono cambiati
+        self.changed: Set[int] = set()
+
+    @property
+    def elapsed_s(self) -> float:
+        return time.perf_counter() - self.started
+
+    def as_dict(self) -> Dict[str, Any]:
+        elapsed = self.elapsed_s
+        return {
+            "read": self.read,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "rejected": self.rejected,
+            "elapsed_s": round(elapsed, 3),
+            "rows_per_s": round(self.read / elapsed, 1) if elapsed > 0 else 0.0,
+            "nutrients_changed": sorted(self.changed),
+            "errors": self.errors,
+        }
+
+
+def _suspend(conn: sqlite3.Connection) -> List[Tuple[str, str]]:
+    # trigger e indici secondari di foods (non quello unico su barcode, serve all'upsert)
+    objects = conn.execute(
+        """
+        SELECT type, name, sql FROM sqlite_master
+        WHERE tbl_name = 'foods' AND sql IS NOT NULL
+          AND (type = 'trigger' OR (type = 'index' AND name != 'idx_foods_barcode'))
+        """
+    ).fetchall()
+    for obj_type, name, _ in objects:
+        conn.execute(f'DROP {obj_type.upper()} IF EXISTS "{name}"')
+    return [(name, sql) for _, name, sql in objects]
+
+
+def _restore(conn: sqlite3.Connection, objects: List[Tuple[str, str]]):
+    # dopo un rollback gli oggetti della prima transazione possono essere già tornati
+    existing = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = 'foods'")}
+    for name, sql in objects:
+        if name not in existing:
+            conn.execute(sql)
+    # i trigger di versione erano sospesi: le cache sugli alimenti vanno invalidate comunque
+    conn.execute("UPDATE table_versions SET version = version + 1 WHERE name = 'foods'")
+    has_fts = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'foods_fts'").fetchone()
+    if has_fts:
+        conn.execute("INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')")
+
+
+def _write_chunk(conn: sqlite3.Connection, chunk: List[Tuple], stats: ImportStats):
+    if not conn.in_transaction:
+        conn.execute("BEGIN IMMEDIATE")
+    barcodes = [row[2] for row in chunk if row[2]]
+    existing = 0
+    logged: Dict[int, Tuple] = {}
+    if barcodes:
+        encoded = json.dumps(barcodes)
+        existing = conn.execute(
+            "SELECT COUNT(*) FROM foods WHERE barcode IN (SELECT value FROM json_each(?))", (encoded,)
+        ).fetchone()[0]
+        # barcode ripetuti nello stesso blocco: dal secondo in poi sono aggiornamenti
+        existing += len(barcodes) - len(set(barcodes))
+        logged = {r[0]: tuple(r[1:]) for r in conn.execute(_LOGGED_NUTRIENTS, (encoded,))}
+    conn.executemany(_UPSERT, chunk)
+    if logged:
+        changed = [r[0] for r in conn.execute(_LOGGED_NUTRIENTS, (encoded,)).fetchall() if tuple(r[1:]) != logged[r[0]]]
+        # stessa transazione dell'aggiornamento: totali e alimenti non divergono anche con commit intermedi
+        for food_id in changed:
+            rebuild_daily_totals(conn, food_id=food_id)
+        stats.changed.update(changed)
+    stats.updated += existing
+    stats.inserted += len(chunk) - existing
+
+
+def import_foods(
+    conn: sqlite3.Connection,
+    source: Source,
+    fmt: Optional[str] = None,
+    food_source: str = "import",
+    chunk_rows: int = CHUNK_ROWS,
+    txn_rows: int = TXN_ROWS,
+    rebuild_indexes: bool = True,
+    progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+) -> Dict[str, Any]:
+    """Import ``source`` (path or binary file object) into ``foods`` and return the stats."""
+    stream, owned = _open_binary(source)
+    if fmt is None:
+        fmt = detect_format(str(getattr(stream, "name", source)))
+    stats = ImportStats()
+    now = datetime.utcnow().isoformat()
+    if conn.in_transaction:
+        conn.commit()
+    suspended: List[Tuple[str, str]] = []
+    try:
+        if rebuild_indexes:
+            conn.execute("BEGIN IMMEDIATE")
+            suspended = _suspend(conn)
+        chunk: List[Tuple] = []
+        pending = 0
+        for record in iter_records(stream, fmt):
+            stats.read += 1
+            try:
+                r = normalize_row(record)
+            except (ValueError, TypeError, AttributeError) as e:
+                stats.rejected += 1
+                if len(stats.errors) < MAX_ERRORS:
+                    stats.errors.append({"row": stats.read, "error": str(e)})
+                continue
+            chunk.append((
+                r["name"], r["brand"], r["barcode"], r["kcal_100g"], r["prot_100g"], r["carb_100g"], r["fat_100g"],
+                r["fiber_100g"], r["sugar_100g"], r["satfat_100g"], r["sodium_mg_100g"], food_source, now,
+            ))
+            if len(chunk) >= chunk_rows:
+                _write_chunk(conn, chunk, stats)
+                pending += len(chunk)
+                chunk = []
+                # con trigger e indici sospesi nessun commit intermedio: i DROP non devono mai arrivare su disco
+                if pending >= txn_rows and not suspended:
+                    # la prossima transazione si apre solo al prossimo blocco: intanto scrivono gli altri
+                    conn.commit()
+                    pending = 0
+                if progress:
+                    progress(stats.as_dict())
+        if chunk:
+            _write_chunk(conn, chunk, stats)
+        if suspended:
+            _restore(conn, suspended)
+        if conn.in_transaction:
+            conn.commit()
+    except BaseException:
+        # il rollback riporta anche trigger e indici sospesi
+        conn.rollback()
+        raise
+    finally:
+        if owned:
+            stream.close()
+    result = stats.as_dict()
+    if progress:
+        progress(result)
+    return result
+
+
+def main(argv=None):
+    from foodly.core.db import get_db
+
+    parser = argparse.ArgumentParser(description="Importa alimenti da CSV/TSV/JSONL (anche .gz, formato Open Food Facts).")
+    parser.add_argument("file", help="file da importare ('-' per stdin)")
+    parser.add_argument("--format", choices=("csv", "tsv", "jsonl"), help="formato (default: dall'estensione)")
+    parser.add_argument("--source", default="import", help="valore della colonna foods.source")
+    parser.add_argument("--chunk", type=int, default=CHUNK_ROWS, help="righe per executemany")
+    parser.add_argument("--txn", type=int, default=TXN_ROWS, help="righe per transazione (solo con --keep-indexes)")
+    parser.add_argument("--keep-indexes", action="store_true", help="non sospendere trigger e indici durante il caricamento")
+    parser.add_argument("--user", help="id utente: lavora sul suo shard invece che su foodly.db")
+    args = parser.parse_args(argv)
+
+    def report(s):
+        print(f"\r{s['read']} righe lette, {s['inserted']} nuove, {s['updated']} aggiornate, "
+              f"{s['rejected']} scartate — {s['rows_per_s']:.0f} righe/s", end="", file=sys.stderr)
+
+    try:
+        # crea e migra il database (o lo shard dell'utente) se serve
+        conn = get_db(args.user)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        source = sys.stdin.buffer if args.file == "-" else args.file
+        stats = import_foods(
+            conn, source, fmt=args.format, food_source=args.source, chunk_rows=args.chunk,
+            txn_rows=args.txn, rebuild_indexes=not args.keep_indexes, progress=report,
+        )
+    finally:
+        conn.close()
+    print(file=sys.stderr)
+    for err in stats["errors"]:
+        print(f"riga {err['row']}: {err['error']}", file=sys.stderr)
+    print(json.dumps({k: v for k, v in stats.items() if k != "errors"}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,367 @@
+"""In-process metrics in the Prometheus text format.
+
+A small registry of counters and histograms (no external dependency):
+
+- HTTP: per-route latency histogram and request counter by status, recorded
+  by the middleware that :func:`instrument` installs on a FastAPI app, which
+  also serves ``GET /metrics``;
+- SQL: every cursor of a pooled connection times its ``execute`` and bulk
+  fetch calls; time and count are aggregated per normalized statement
+  (literals replaced by ``?``) and statements slower than
+  ``FOODLY_SLOW_QUERY_MS`` are counted as slow;
+- agent: per-tool durations in ``execute_actions`` and LLM call durations;
+- gauges read at scrape time from the pool and the caches (:func:`register_collector`).
+
+``FOODLY_METRICS=0`` (or :func:`set_enabled`) turns recording off: pooled
+connections hand out plain cursors again and the middleware only forwards
+the request, so the cost left is one flag check.
+"""
+import bisect
+import functools
+import os
+import re
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+METRICS_ENABLED = os.getenv("FOODLY_METRICS", "1").lower() not in ("0", "false", "no")
+SLOW_QUERY_MS = float(os.getenv("FOODLY_SLOW_QUERY_MS", "100"))
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# istruzioni SQL distinte tenute come etichetta; oltre, finiscono in "other"
+MAX_STATEMENTS = 500
+
+_enabled = METRICS_ENABLED
+
+Sample = Tuple[Dict[str, str], float]
+Collector = Callable[[], List[Tuple[str, str, str, List[Sample]]]]
+
+
+def enabled() -> bool:
+    return _enabled
+
+
+def set_enabled(flag: bool) -> bool:
+    """Turn recording on or off; returns the previous state."""
+    global _enabled
+    previous, _enabled = _enabled, bool(flag)
+    return previous
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[Any], extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _number(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self._values: Dict[Tuple, float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels: Any, value: float = 1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + value
+
+    def value(self, *labels: Any) -> float:
+        return self._values.get(labels, 0.0)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(self._values.items(), key=lambda kv: tuple(map(str, kv[0])))
+        return [f"{self.name}{_labels(self.labelnames, k)} {_number(v)}" for k, v in items]
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labelnames = name, help, tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # etichette -> [conteggi per bucket (non cumulativi, +Inf in coda), somma, totale]
+        self._values: Dict[Tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labels: Any):
+        i = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][i] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels: Any) -> int:
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    @contextmanager
+    def time(self, *labels: Any) -> Iterator[None]:
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            if _enabled:
+                self.observe(time.perf_counter() - t0, *labels)
+
+    def render(self) -> List[str]:
+        with self._lock:
+            items = sorted(((k, [list(v[0]), v[1], v[2]]) for k, v in self._values.items()), key=lambda kv: tuple(map(str, kv[0])))
+        lines = []
+        for labels, (counts, total, n) in items:
+            cumulative = 0
+            for bound, c in zip(self.buckets + (float("inf"),), counts):
+                cumulative += c
+                le = 'le="%s"' % _number(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {n}")
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+        self.collectors: List[Collector] = []
+        self._lock = threading.Lock()
+
+    def _add(self, metric):
+        with self._lock:
+            return self.metrics.setdefault(metric.name, metric)
+
+    def counter(self, name: str, help: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._add(Counter(name, help, labelnames))
+
+    def histogram(self, name: str, help: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self._add(Histogram(name, help, labelnames, buckets))
+
+    def register_collector(self, collector: Collector):
+        with self._lock:
+            if collector not in self.collectors:
+                self.collectors.append(collector)
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self.metrics.values()):
+            lines += [f"# HELP {metric.name} {metric.help}", f"# TYPE {metric.name} {metric.kind}"]
+            lines += metric.render()
+        for collector in list(self.collectors):
+            for name, kind, help, samples in collector():
+                lines += [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+                lines += [f"{name}{_labels(list(l), list(l.values()))} {_number(v)}" for l, v in samples]
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        for metric in self.metrics.values():
+            metric.clear()
+
+
+registry = Registry()
+
+http_requests = registry.counter("foodly_http_requests_total", "HTTP requests by route and status.", ("app", "method", "route", "status"))
+http_latency = registry.histogram("foodly_http_request_duration_seconds", "HTTP request latency (until the response headers).", ("app", "method", "route"))
+tool_latency = registry.histogram("foodly_tool_duration_seconds", "Agent tool execution time in execute_actions.", ("tool", "status"))
+llm_latency = registry.histogram("foodly_llm_call_duration_seconds", "LLM planning calls, retries included.", ("outcome",))
+llm_attempts = registry.counter("foodly_llm_attempts_total", "HTTP attempts to the LLM provider by outcome.", ("outcome",))
+
+register_collector = registry.register_collector
+render = registry.render
+
+
+def clear():
+    registry.clear()
+    sql_stats.clear()
+
+
+def register_stats(prefix: str, stats: Callable[[], Dict[str, Any]], keys: Sequence[str]):
+    """Expose the ``keys`` of a ``stats()`` dict as gauges named ``{prefix}_{key}``."""
+
+    def collect():
+        values = stats()
+        return [(f"{prefix}_{k}", "gauge", f"{prefix.replace('_', ' ')} {k.replace('_', ' ')}.", [({}, values[k])]) for k in keys]
+
+    register_collector(collect)
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+@functools.lru_cache(maxsize=4096)
+def normalize_sql(sql: str) -> str:
+    """``SELECT * FROM foods WHERE id IN (1, 2, 3)`` -> ``SELECT * FROM foods WHERE id IN (?)``."""
+    sql = _LITERALS.sub("?", sql)
+    sql = _IN_LIST.sub("(?)", sql)
+    return _SPACES.sub(" ", sql).strip()[:300]
+
+
+class SqlStats:
+    """Count, time and slow count per normalized statement, under a single lock.
+
+    Entries are ``[statements, seconds, slow]`` lists looked up once per
+    ``execute``; the cursor then adds its fetch time to the same entry.
+    """
+
+    def __init__(self, max_statements: int = MAX_STATEMENTS, slow_ms: float = SLOW_QUERY_MS):
+        self.max_statements = max_statements
+        self.slow_s = slow_ms / 1000
+        self.entries: Dict[str, list] = {}
+        # testo SQL esatto -> voce, evita di rinormalizzare a ogni execute
+        self._by_sql: Dict[str, list] = {}
+        self.lock = threading.Lock()
+
+    def entry(self, sql: str) -> list:
+        entry = self._by_sql.get(sql)
+        if entry is None:
+            label = normalize_sql(sql)
+            with self.lock:
+                if label not in self.entries and len(self.entries) >= self.max_statements:
+                    label = "other"
+                entry = self.entries.setdefault(label, [0, 0.0, 0])
+                if len(self._by_sql) < 8 * self.max_statements:
+                    self._by_sql[sql] = entry
+        return entry
+
+    def statement(self, label: str) -> Tuple[int, float, int]:
+        with self.lock:
+            return tuple(self.entries.get(label, (0, 0.0, 0)))
+
+    def collect(self):
+        with self.lock:
+            items = sorted((k, tuple(v)) for k, v in self.entries.items())
+        return [
+            ("foodly_sql_statements_total", "counter", "SQL statements executed, by normalized statement.",
+             [({"statement": k}, v[0]) for k, v in items]),
+            ("foodly_sql_seconds_total", "counter", "Time spent in execute and fetch calls, by normalized statement.",
+             [({"statement": k}, v[1]) for k, v in items]),
+            ("foodly_sql_slow_statements_total", "counter", f"Statements slower than FOODLY_SLOW_QUERY_MS ({self.slow_s * 1000:g} ms).",
+             [({"statement": k}, v[2]) for k, v in items]),
+        ]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self._by_sql.clear()
+
+
+sql_stats = SqlStats()
+register_collector(sql_stats.collect)
+
+
+class TimedCursor(sqlite3.Cursor):
+    """Cursor that attributes its execute/fetch time to the statement it runs.
+
+    ``execute`` already steps to the first row, so ``fetchone`` is not timed;
+    ``fetchmany``/``fetchall`` are, since they walk the rest of the result.
+    """
+
+    _entry: Optional[list] = None
+    _total = 0.0
+
+    def execute(self, sql, parameters=()):
+        t0 = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            elapsed = self._total = time.perf_counter() - t0
+            entry = self._entry = sql_stats.entry(sql)
+            with sql_stats.lock:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed >= sql_stats.slow_s:
+                    entry[2] += 1
+
+    def executemany(self, sql, seq_of_parameters):
+        t0 = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            elapsed = self._total = time.perf_counter() - t0
+            entry = self._entry = sql_stats.entry(sql)
+            with sql_stats.lock:
+                entry[0] += 1
+                entry[1] += elapsed
+                if elapsed >= sql_stats.slow_s:
+                    entry[2] += 1
+
+    def _fetched(self, elapsed: float):
+        entry = self._entry
+        if entry is None:
+            return
+        before, self._total = self._total, self._total + elapsed
+        with sql_stats.lock:
+            entry[1] += elapsed
+            # lenta una volta sola: quando execute + fetch superano la soglia
+            if before < sql_stats.slow_s <= self._total:
+                entry[2] += 1
+
+    def fetchmany(self, size=None):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchmany(self.arraysize if size is None else size)
+        finally:
+            self._fetched(time.perf_counter() - t0)
+
+    def fetchall(self):
+        t0 = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            self._fetched(time.perf_counter() - t0)
+
+
+def instrument(app, name: str):
+    """Add the metrics middleware and ``GET /metrics`` to a FastAPI ``app``."""
+    from fastapi import Request
+    from fastapi.responses import Response
+
+    @app.middleware("http")
+    async def metrics_middleware(request: Request, call_next):
+        if not _enabled:
+            return await call_next(request)
+        t0 = time.perf_counter()
+        status = 500
+        try:
+            response = await call_next(request)
+            status = response.status_code
+            return response
+        finally:
+            elapsed = time.perf_counter() - t0
+            # etichetta sul percorso della rotta (/api/export/{kind}), non sull'URL
+            route = request.scope.get("route")
+            path = getattr(route, "path", None) or "unmatched"
+            http_latency.observe(elapsed, name, request.method, path)
+            http_requests.inc(name, request.method, path, status)
+
+    @app.get("/metrics", include_in_schema=False)
+    def metrics_endpoint():
+        return Response(render(), media_type=CONTENT_TYPE)
+
+    return app
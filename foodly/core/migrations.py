@@ -0,0 +1,330 @@
+"""Versioned schema migrations.
+
+The schema version lives in ``PRAGMA user_version``. ``MIGRATIONS`` is an
+ordered list: migration ``n`` brings the database from version ``n-1`` to
+``n``. Each one runs in its own ``BEGIN IMMEDIATE`` transaction together with
+the version bump, so a crash leaves the database at the previous version and
+concurrent processes starting up do not apply the same step twice.
+
+Append new migrations at the end; never edit one that has already shipped.
+"""
+import sqlite3
+from typing import Callable, List, Sequence, Tuple, Union
+
+Step = Union[str, Callable[[sqlite3.Connection], None]]
+
+
+def _add_llm_api_key(conn: sqlite3.Connection):
+    # installazioni create prima dell'introduzione della colonna
+    cols = [r[1] for r in conn.execute("PRAGMA table_info(user_settings)").fetchall()]
+    if "llm_api_key" not in cols:
+        conn.execute("ALTER TABLE user_settings ADD COLUMN llm_api_key TEXT")
+
+
+BASE_SCHEMA: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS foods (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        brand TEXT,
+        barcode TEXT,
+        kcal_100g REAL NOT NULL,
+        prot_100g REAL NOT NULL,
+        carb_100g REAL NOT NULL,
+        fat_100g REAL NOT NULL,
+        fiber_100g REAL DEFAULT 0,
+        sugar_100g REAL DEFAULT 0,
+        satfat_100g REAL DEFAULT 0,
+        sodium_mg_100g REAL DEFAULT 0,
+        source TEXT,
+        last_updated TEXT
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS pantry (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        food_id INTEGER NOT NULL,
+        qty_g REAL NOT NULL,
+        package_g REAL,
+        location TEXT,
+        best_before TEXT,
+        created_at TEXT DEFAULT (datetime('now')),
+        FOREIGN KEY(food_id) REFERENCES foods(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS consumption_logs (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        ts TEXT NOT NULL,
+        food_id INTEGER NOT NULL,
+        grams REAL NOT NULL,
+        meal TEXT,
+        note TEXT,
+        FOREIGN KEY(food_id) REFERENCES foods(id)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS user_settings (
+        id INTEGER PRIMARY KEY CHECK (id = 1),
+        weight_kg REAL DEFAULT 75,
+        height_cm REAL DEFAULT 175,
+        age INTEGER DEFAULT 30,
+        sex TEXT DEFAULT 'M',               -- 'M' or 'F'
+        activity_level REAL DEFAULT 1.5,    -- 1.2..1.9
+        kcal_target REAL,                   -- if NULL, use TDEE
+        protein_g_per_kg REAL DEFAULT 1.8,
+        fat_g_per_kg REAL DEFAULT 0.8,
+        llm_api_key TEXT
+    )
+    """,
+    _add_llm_api_key,
+]
+
+HOT_PATH_INDEXES: List[Step] = [
+    # day_summary: range su ts
+    "CREATE INDEX IF NOT EXISTS idx_consumption_logs_ts ON consumption_logs(ts)",
+    "CREATE INDEX IF NOT EXISTS idx_consumption_logs_food ON consumption_logs(food_id)",
+    # decremento FIFO: WHERE food_id=? AND qty_g>0
+    "CREATE INDEX IF NOT EXISTS idx_pantry_food_qty ON pantry(food_id, qty_g)",
+    # ORDER BY name senza ordinamento temporaneo
+    "CREATE INDEX IF NOT EXISTS idx_foods_name ON foods(name)",
+    "CREATE INDEX IF NOT EXISTS idx_foods_barcode ON foods(barcode)",
+]
+
+FOODS_FTS: List[Step] = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS foods_fts USING fts5(
+        name, brand,
+        content='foods', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    # ORDER BY rank: il nome pesa 10 volte la marca
+    "INSERT INTO foods_fts(foods_fts, rank) VALUES ('rank', 'bm25(10.0, 1.0)')",
+    """
+    CREATE TRIGGER IF NOT EXISTS foods_fts_ai AFTER INSERT ON foods BEGIN
+        INSERT INTO foods_fts(rowid, name, brand) VALUES (new.id, new.name, new.brand);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS foods_fts_ad AFTER DELETE ON foods BEGIN
+        INSERT INTO foods_fts(foods_fts, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS foods_fts_au AFTER UPDATE OF name, brand ON foods BEGIN
+        INSERT INTO foods_fts(foods_fts, rowid, name, brand) VALUES ('delete', old.id, old.name, old.brand);
+        INSERT INTO foods_fts(rowid, name, brand) VALUES (new.id, new.name, new.brand);
+    END
+    """,
+    "INSERT INTO foods_fts(foods_fts) VALUES ('rebuild')",
+]
+
+# Contributo di un log: nutriente/100 g * grammi, sommato sul giorno (primi 10 caratteri di ts)
+LOG_NUTRIENT_EXPRS = [
+    "f.kcal_100g * ({g} / 100.0)",
+    "f.prot_100g * ({g} / 100.0)",
+    "f.carb_100g * ({g} / 100.0)",
+    "f.fat_100g * ({g} / 100.0)",
+    "COALESCE(f.fiber_100g, 0) * ({g} / 100.0)",
+    "COALESCE(f.sodium_mg_100g, 0) * ({g} / 100.0)",
+]
+
+
+def _rollup_trigger(name: str, event: str, row: str, sign: str) -> str:
+    nutrients = ", ".join(n.format(g=f"{sign}{row}.grams") for n in LOG_NUTRIENT_EXPRS)
+    return f"""
+    CREATE TRIGGER IF NOT EXISTS {name} AFTER {event} ON consumption_logs BEGIN
+        INSERT INTO daily_totals(day, kcal, prot_g, carb_g, fat_g, fiber_g, sodium_mg, n_logs)
+        SELECT substr({row}.ts, 1, 10), {nutrients}, {sign}1
+        FROM foods f WHERE f.id = {row}.food_id
+        ON CONFLICT(day) DO UPDATE SET
+            kcal = kcal + excluded.kcal,
+            prot_g = prot_g + excluded.prot_g,
+            carb_g = carb_g + excluded.carb_g,
+            fat_g = fat_g + excluded.fat_g,
+            fiber_g = fiber_g + excluded.fiber_g,
+            sodium_mg = sodium_mg + excluded.sodium_mg,
+            n_logs = n_logs + excluded.n_logs;
+    END
+    """
+
+
+DAILY_TOTALS: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS daily_totals (
+        day TEXT PRIMARY KEY,
+        kcal REAL NOT NULL DEFAULT 0,
+        prot_g REAL NOT NULL DEFAULT 0,
+        carb_g REAL NOT NULL DEFAULT 0,
+        fat_g REAL NOT NULL DEFAULT 0,
+        fiber_g REAL NOT NULL DEFAULT 0,
+        sodium_mg REAL NOT NULL DEFAULT 0,
+        n_logs INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    _rollup_trigger("daily_totals_ai", "INSERT", "new", ""),
+    _rollup_trigger("daily_totals_ad", "DELETE", "old", "-"),
+    # un UPDATE del log equivale a togliere la vecchia riga e aggiungere la nuova
+    _rollup_trigger("daily_totals_au_old", "UPDATE OF ts, food_id, grams", "old", "-"),
+    _rollup_trigger("daily_totals_au_new", "UPDATE OF ts, food_id, grams", "new", ""),
+    # backfill dei log esistenti
+    f"""
+    INSERT INTO daily_totals(day, kcal, prot_g, carb_g, fat_g, fiber_g, sodium_mg, n_logs)
+    SELECT substr(c.ts, 1, 10) AS day, {", ".join(f"SUM({n.format(g='c.grams')})" for n in LOG_NUTRIENT_EXPRS)}, COUNT(*)
+    FROM consumption_logs c JOIN foods f ON c.food_id = f.id
+    GROUP BY day
+    """,
+]
+
+# Piani di tool call prodotti dall'LLM, chiave = hash di messaggio normalizzato e prompt
+PLAN_CACHE: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS plan_cache (
+        key TEXT PRIMARY KEY,
+        actions TEXT NOT NULL,
+        created_at REAL NOT NULL,
+        last_used REAL NOT NULL,
+        hits INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_plan_cache_last_used ON plan_cache(last_used)",
+]
+
+# Sinonimi per il parser rule-based ("tonno in scatola" -> "Tonno al naturale (scatoletta)")
+FOOD_ALIASES: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS food_aliases (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        food_id INTEGER NOT NULL,
+        alias TEXT NOT NULL,
+        FOREIGN KEY(food_id) REFERENCES foods(id)
+    )
+    """,
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_food_aliases_alias ON food_aliases(alias)",
+]
+
+# Upsert per barcode durante l'import: il barcode diventa unico (se presente).
+# Eventuali duplicati storici restano sulla riga più vecchia, le altre perdono il barcode.
+FOODS_BARCODE_UNIQUE: List[Step] = [
+    "UPDATE foods SET barcode = NULL WHERE trim(barcode) = ''",
+    """
+    UPDATE foods SET barcode = NULL
+    WHERE barcode IS NOT NULL
+      AND id > (SELECT MIN(f2.id) FROM foods f2 WHERE f2.barcode = foods.barcode)
+    """,
+    "DROP INDEX IF EXISTS idx_foods_barcode",
+    "CREATE UNIQUE INDEX IF NOT EXISTS idx_foods_barcode ON foods(barcode) WHERE barcode IS NOT NULL",
+]
+
+# Contatore di modifiche per tabella, per invalidare le cache di processo senza confrontare i dati
+TABLE_VERSIONS: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS table_versions (
+        name TEXT PRIMARY KEY,
+        version INTEGER NOT NULL DEFAULT 0
+    ) WITHOUT ROWID
+    """,
+    "INSERT OR IGNORE INTO table_versions(name) VALUES ('foods')",
+    *(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS foods_version_{suffix} AFTER {event} ON foods BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'foods';
+        END
+        """
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+    ),
+]
+
+# Chiavi di idempotenza di chat e strumenti: la risposta salvata viene restituita ai retry.
+# Finché la richiesta è in corso (status 'pending') expires_at fa da lease.
+IDEMPOTENCY_KEYS: List[Step] = [
+    """
+    CREATE TABLE IF NOT EXISTS idempotency_keys (
+        key TEXT PRIMARY KEY,
+        fingerprint TEXT NOT NULL,
+        status TEXT NOT NULL CHECK (status IN ('pending', 'done')),
+        response TEXT,
+        created_at REAL NOT NULL,
+        expires_at REAL NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_idempotency_keys_expires ON idempotency_keys(expires_at)",
+]
+
+# Contatori anche per ciò che leggono riepiloghi e obiettivi: ETag e cache delle risposte.
+# daily_totals cambia dai trigger dei consumi e dalla ricostruzione del rollup.
+SUMMARY_VERSIONS: List[Step] = [
+    "INSERT OR IGNORE INTO table_versions(name) VALUES ('daily_totals'), ('user_settings')",
+    *(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS {table}_version_{suffix} AFTER {event} ON {table} BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+        END
+        """
+        for table in ("daily_totals", "user_settings")
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+    ),
+]
+
+# Il matcher del parser è compilato da alimenti e sinonimi: ricompilato quando cambiano.
+ALIAS_VERSIONS: List[Step] = [
+    "INSERT OR IGNORE INTO table_versions(name) VALUES ('food_aliases')",
+    *(
+        f"""
+        CREATE TRIGGER IF NOT EXISTS food_aliases_version_{suffix} AFTER {event} ON food_aliases BEGIN
+            UPDATE table_versions SET version = version + 1 WHERE name = 'food_aliases';
+        END
+        """
+        for suffix, event in (("ai", "INSERT"), ("au", "UPDATE"), ("ad", "DELETE"))
+    ),
+]
+
+MIGRATIONS: List[Tuple[str, Sequence[Step]]] = [
+    ("base_schema", BASE_SCHEMA),
+    ("hot_path_indexes", HOT_PATH_INDEXES),
+    ("foods_fts", FOODS_FTS),
+    ("daily_totals", DAILY_TOTALS),
+    ("plan_cache", PLAN_CACHE),
+    ("food_aliases", FOOD_ALIASES),
+    ("foods_barcode_unique", FOODS_BARCODE_UNIQUE),
+    ("table_versions", TABLE_VERSIONS),
+    ("idempotency_keys", IDEMPOTENCY_KEYS),
+    ("summary_versions", SUMMARY_VERSIONS),
+    ("alias_versions", ALIAS_VERSIONS),
+]
+
+LATEST_VERSION = len(MIGRATIONS)
+
+
+def schema_version(conn: sqlite3.Connection) -> int:
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn: sqlite3.Connection, target: int = LATEST_VERSION) -> List[str]:
+    """Apply pending migrations up to ``target`` and return their names."""
+    if conn.in_transaction:
+        conn.commit()
+    applied: List[str] = []
+    for version, (name, steps) in enumerate(MIGRATIONS[:target], start=1):
+        if schema_version(conn) >= version:
+            continue
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # un altro processo potrebbe averla applicata mentre aspettavamo il lock
+            if schema_version(conn) >= version:
+                conn.rollback()
+                continue
+            for step in steps:
+                if callable(step):
+                    step(conn)
+                else:
+                    conn.execute(step)
+            conn.execute(f"PRAGMA user_version = {version}")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(name)
+    return applied
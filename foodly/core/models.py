@@ -18,16 +18,33 @@ class MealType(str, Enum):
     snack = "snack"
 
 
+class Granularity(str, Enum):
+    day = "day"
+    week = "week"
+    month = "month"
+
+
+class SuggestMode(str, Enum):
+    single = "single"   # un alimento per il macro più carente
+    combo = "combo"     # combinazione di alimenti su tutti i residui
+
+
 class Consume(BaseModel):
     food_id: int
     grams: float = Field(..., gt=0)
     meal: MealType = MealType.snack
     note: Optional[str] = None
 
+class ConsumeBatch(BaseModel):
+    items: List[Consume] = Field(..., min_length=1)
+
 class FindFood(BaseModel):
     query: str
     limit: int = 10
 
+class FindByBarcode(BaseModel):
+    barcodes: List[str] = Field(..., min_length=1, max_length=500)
+
 class Summary(BaseModel):
     date_str: Optional[str] = None
 
@@ -41,6 +58,8 @@ class ChatRequest(BaseModel):
     use_rule_based: bool = True
     dry_run: bool = False
     require_confirm: bool = True
+    suggest_mode: SuggestMode = SuggestMode.single
+    bypass_cache: bool = False  # ignora i piani LLM in cache (il nuovo piano la aggiorna)
     idempotency_key: Optional[str] = None
 
 class ChatResponse(BaseModel):
@@ -0,0 +1,230 @@
+"""Daily nutrient totals backed by the ``daily_totals`` rollup table.
+
+Triggers on ``consumption_logs`` keep one row per day up to date inside the
+same transaction as the log write, so reading a day's totals is a single
+primary-key lookup. The rollup uses the nutrients a food had when the log was
+written: after editing a food run ``rebuild_daily_totals(conn, food_id=...)``,
+or from the command line::
+
+    python -m foodly.core.rollup [--from YYYY-MM-DD] [--to YYYY-MM-DD] [--food-id N] [--user ID]
+
+``--user`` works on that user's shard instead of the default database.
+"""
+import argparse
+import sqlite3
+from datetime import date, timedelta
+from typing import Any, Dict, List, Optional, Sequence
+
+from foodly.core.calculations import day_bounds, progress
+from foodly.core.context import memoized
+from foodly.core.migrations import LOG_NUTRIENT_EXPRS
+
+TOTAL_KEYS = ("kcal", "prot_g", "carb_g", "fat_g", "fiber_g", "sodium_mg")
+
+MAX_RANGE_DAYS = 3660
+
+# Chiave del bucket calcolata da SQLite: giorno, lunedì della settimana, primo del mese
+_BUCKET_SQL = {
+    "day": "day",
+    "week": "date(day, 'weekday 0', '-6 days')",
+    "month": "substr(day, 1, 7) || '-01'",
+}
+
+_SUMS = ", ".join(f"SUM({expr.format(g='c.grams')})" for expr in LOG_NUTRIENT_EXPRS)
+
+
+def _scan_day_totals(conn: sqlite3.Connection, date_str: str) -> Dict[str, float]:
+    # database senza rollup: somma dei log del giorno
+    start, end = day_bounds(date_str)
+    totals = {"kcal":0.0, "prot_g":0.0, "carb_g":0.0, "fat_g":0.0, "fiber_g":0.0, "sodium_mg":0.0}
+    rows = conn.execute(
+        """
+        SELECT c.ts, c.grams, f.*
+        FROM consumption_logs c JOIN foods f ON c.food_id=f.id
+        WHERE c.ts BETWEEN ? AND ?
+        """, (start, end)
+    ).fetchall()
+    for r in rows:
+        g = float(r["grams"]) / 100.0
+        totals["kcal"] += r["kcal_100g"] * g
+        totals["prot_g"] += r["prot_100g"] * g
+        totals["carb_g"] += r["carb_100g"] * g
+        totals["fat_g"]  += r["fat_100g"] * g
+        totals["fiber_g"] += r["fiber_100g"] * g
+        totals["sodium_mg"] += r["sodium_mg_100g"] * g
+    return totals
+
+
+@memoized
+def day_totals(conn: sqlite3.Connection, date_str: Optional[str] = None) -> Dict[str, float]:
+    """Return the rounded nutrient totals logged on ``date_str`` (default: today)."""
+    if not date_str:
+        return day_totals(conn, date.today().isoformat())
+    try:
+        row = conn.execute(
+            f"SELECT {', '.join(TOTAL_KEYS)} FROM daily_totals WHERE day=?", (date_str,)
+        ).fetchone()
+    except sqlite3.OperationalError as e:
+        if "no such table" not in str(e):
+            raise
+        totals = _scan_day_totals(conn, date_str)
+    else:
+        totals = dict(zip(TOTAL_KEYS, row)) if row else dict.fromkeys(TOTAL_KEYS, 0.0)
+    return {k: round(v, 1) for k, v in totals.items()}
+
+
+def _bucket_bounds(d: date, granularity: str):
+    if granularity == "week":
+        first = d - timedelta(days=d.weekday())
+        return first, first + timedelta(days=6)
+    if granularity == "month":
+        first = d.replace(day=1)
+        following = (first + timedelta(days=32)).replace(day=1)
+        return first, following - timedelta(days=1)
+    return d, d
+
+
+def _averages(totals: Dict[str, float], days: int) -> Dict[str, float]:
+    return {k: round(v / days, 1) for k, v in totals.items()}
+
+
+def range_summary(
+    conn: sqlite3.Connection,
+    start: date,
+    end: date,
+    granularity: str = "day",
+    targets: Optional[Dict[str, float]] = None,
+) -> List[Dict[str, Any]]:
+    """Totals for every day/week/month bucket between ``start`` and ``end``.
+
+    All buckets come from one grouped query over ``daily_totals``; buckets with
+    no logs are filled with zeros so charts get a continuous series. Partial
+    buckets at the edges are clipped to the requested range and ``daily_avg``
+    divides by the days actually covered.
+    """
+    if end < start:
+        raise ValueError("la data finale precede quella iniziale")
+    if (end - start).days >= MAX_RANGE_DAYS:
+        raise ValueError(f"intervallo massimo {MAX_RANGE_DAYS} giorni")
+    rows = conn.execute(
+        f"""
+        SELECT {_BUCKET_SQL[granularity]} AS bucket, {', '.join(f'SUM({k})' for k in TOTAL_KEYS)},
+               SUM(n_logs), COUNT(*)
+        FROM daily_totals
+        WHERE day BETWEEN ? AND ? AND n_logs > 0
+        GROUP BY bucket
+        """,
+        (start.isoformat(), end.isoformat()),
+    ).fetchall()
+    found = {r[0]: r for r in rows}
+
+    buckets = []
+    first, last = _bucket_bounds(start, granularity)
+    while first <= end:
+        lo, hi = max(first, start), min(last, end)
+        days = (hi - lo).days + 1
+        r = found.get(first.isoformat())
+        totals = dict(zip(TOTAL_KEYS, r[1:1 + len(TOTAL_KEYS)])) if r else dict.fromkeys(TOTAL_KEYS, 0.0)
+        daily_avg = _averages(totals, days)
+        bucket = {
+            "start": lo.isoformat(),
+            "end": hi.isoformat(),
+            "days": days,
+            "days_logged": r[-1] if r else 0,
+            "logs": r[-2] if r else 0,
+            "totals": {k: round(v, 1) for k, v in totals.items()},
+            "daily_avg": daily_avg,
+        }
+        if targets:
+            bucket["progress"] = progress(daily_avg, targets)
+        buckets.append(bucket)
+        first, last = _bucket_bounds(last + timedelta(days=1), granularity)
+    return buckets
+
+
+def rolling_averages(
+    conn: sqlite3.Connection,
+    end: date,
+    windows: Sequence[int] = (7, 30),
+    targets: Optional[Dict[str, float]] = None,
+) -> Dict[str, Dict[str, Any]]:
+    """Average daily intake over the last N days ending on ``end`` (days without logs count as zero)."""
+    since = end - timedelta(days=max(windows) - 1)
+    rows = conn.execute(
+        f"SELECT day, {', '.join(TOTAL_KEYS)} FROM daily_totals WHERE day BETWEEN ? AND ?",
+        (since.isoformat(), end.isoformat()),
+    ).fetchall()
+    result = {}
+    for n in windows:
+        first = (end - timedelta(days=n - 1)).isoformat()
+        totals = dict.fromkeys(TOTAL_KEYS, 0.0)
+        for r in rows:
+            if r[0] >= first:
+                for k, v in zip(TOTAL_KEYS, r[1:]):
+                    totals[k] += v
+        window = {"from": first, "to": end.isoformat(), "daily_avg": _averages(totals, n)}
+        if targets:
+            window["progress"] = progress(window["daily_avg"], targets)
+        result[f"{n}d"] = window
+    return result
+
+
+def rebuild_daily_totals(
+    conn: sqlite3.Connection,
+    start: Optional[str] = None,
+    end: Optional[str] = None,
+    food_id: Optional[int] = None,
+) -> int:
+    """Recompute rollup rows from ``consumption_logs`` and return how many were written.
+
+    ``start``/``end`` (inclusive ``YYYY-MM-DD``) limit the rebuild to a range of
+    days; ``food_id`` limits it to the days on which that food was logged.
+    Without arguments the whole table is rebuilt. The caller commits.
+    """
+    days, logs, params = [], [], []
+    if start:
+        days.append("day >= ?"); logs.append("c.ts >= ?"); params.append(start)
+    if end:
+        days.append("day <= ?"); logs.append("c.ts < date(?, '+1 day')"); params.append(end)
+    if food_id is not None:
+        touched = "(SELECT DISTINCT substr(ts, 1, 10) FROM consumption_logs WHERE food_id = ?)"
+        days.append(f"day IN {touched}"); logs.append(f"substr(c.ts, 1, 10) IN {touched}"); params.append(food_id)
+    conn.execute(f"DELETE FROM daily_totals {'WHERE ' + ' AND '.join(days) if days else ''}", params)
+    cur = conn.execute(
+        f"""
+        INSERT INTO daily_totals(day, kcal, prot_g, carb_g, fat_g, fiber_g, sodium_mg, n_logs)
+        SELECT substr(c.ts, 1, 10) AS day, {_SUMS}, COUNT(*)
+        FROM consumption_logs c JOIN foods f ON c.food_id = f.id
+        {'WHERE ' + ' AND '.join(logs) if logs else ''}
+        GROUP BY day
+        """,
+        params,
+    )
+    return cur.rowcount
+
+
+def main(argv=None):
+    from foodly.core.db import get_db
+
+    parser = argparse.ArgumentParser(description="Ricostruisce la tabella daily_totals dai log di consumo.")
+    parser.add_argument("--from", dest="start", help="primo giorno (YYYY-MM-DD)")
+    parser.add_argument("--to", dest="end", help="ultimo giorno (YYYY-MM-DD)")
+    parser.add_argument("--food-id", type=int, help="solo i giorni in cui compare questo alimento")
+    parser.add_argument("--user", help="id utente: lavora sul suo shard invece che su foodly.db")
+    args = parser.parse_args(argv)
+
+    try:
+        # crea e migra il database (o lo shard dell'utente) se serve
+        conn = get_db(args.user)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        n = rebuild_daily_totals(conn, args.start, args.end, args.food_id)
+        conn.commit()
+    finally:
+        conn.close()
+    print(f"daily_totals: {n} giorni ricostruiti")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+"""Full-text food search over the ``foods_fts`` FTS5 index.
+
+The index folds accents (``unicode61 remove_diacritics 2``) and ranks with
+BM25, weighting ``name`` above ``brand``. Italian singular/plural forms are
+handled on the query side: a word ending in a vowel also matches its stem as a
+prefix, so "scatolette" finds "scatoletta" while an exact match still ranks
+first. Databases without the index (older schemas, minimal test fixtures) fall
+back to the plain ``LIKE`` lookup.
+"""
+import re
+import sqlite3
+import unicodedata
+from typing import Any, Dict, List, Sequence
+
+FOOD_COLUMNS = ("id", "name", "brand", "kcal_100g", "prot_100g", "carb_100g", "fat_100g")
+
+STOPWORDS = {
+    "a", "ad", "al", "alla", "allo", "ai", "agli", "alle", "con", "da", "dal", "dalla",
+    "de", "dei", "del", "della", "delle", "dello", "degli", "di", "e", "ed", "in", "il",
+    "la", "le", "lo", "gli", "i", "per", "su", "un", "una", "uno",
+}
+
+_WORD = re.compile(r"[0-9a-z]+")
+
+
+def fold(text: str) -> str:
+    """Lowercase ``text`` and strip diacritics ("Caffè" -> "caffe")."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(ch for ch in decomposed if not unicodedata.combining(ch)).lower()
+
+
+def words(text: str) -> List[str]:
+    return _WORD.findall(fold(text))
+
+
+def fts_query(text: str) -> str:
+    """Build an FTS5 MATCH expression from free text; empty if nothing to search."""
+    terms = []
+    for word in words(text):
+        if word in STOPWORDS:
+            continue
+        if len(word) >= 4 and word[-1] in "aeiou":
+            # scatolett* copre scatoletta/scatolette, il termine esatto pesa di più
+            terms.append(f'("{word}" OR "{word[:-1]}"*)')
+        else:
+            terms.append(f'"{word}"*')
+    return " AND ".join(terms)
+
+
+def search_foods(
+    conn: sqlite3.Connection,
+    query: str,
+    limit: int = 10,
+    columns: Sequence[str] = FOOD_COLUMNS,
+) -> List[Dict[str, Any]]:
+    match = fts_query(query)
+    if match:
+        cols = ", ".join(f"f.{c}" for c in columns)
+        try:
+            rows = conn.execute(
+                f"""
+                SELECT {cols}
+                FROM foods_fts JOIN foods f ON f.id = foods_fts.rowid
+                WHERE foods_fts MATCH ?
+                ORDER BY rank
+                LIMIT ?
+                """,
+                (match, limit),
+            ).fetchall()
+            return [dict(r) for r in rows]
+        except sqlite3.OperationalError as e:
+            if "no such table" not in str(e):
+                raise
+    like = f"%{query.strip()}%"
+    rows = conn.execute(
+        f"SELECT {', '.join(columns)} FROM foods WHERE name LIKE ? ORDER BY name LIMIT ?",
+        (like, limit),
+    ).fetchall()
+    return [dict(r) for r in rows]
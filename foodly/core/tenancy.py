@@ -0,0 +1,51 @@
+"""Per-user routing of requests to database shards.
+
+Foodly runs behind an authenticating reverse proxy that puts the user's id in
+a header (``X-Foodly-User`` by default, ``FOODLY_USER_HEADER`` to change it).
+The middleware installed by :func:`route_by_user` reads it and runs the
+request inside :func:`foodly.core.context.user_scope`, so ``get_db()`` and the
+writer use that user's shard (:func:`foodly.core.db.shard_path`), created and
+migrated on first use.
+
+Requests without the header use the default database (``DB_PATH``), which keeps
+single-user installations working as before; with ``FOODLY_REQUIRE_USER=1``
+they are refused instead. The header is trusted as is: it must not be
+reachable by clients without going through the proxy.
+"""
+import os
+from typing import Iterable
+
+from foodly.core.context import user_scope
+from foodly.core.db import USER_ID_RE
+
+USER_HEADER = os.getenv("FOODLY_USER_HEADER", "X-Foodly-User")
+REQUIRE_USER = os.getenv("FOODLY_REQUIRE_USER", "0").lower() in ("1", "true", "yes")
+# servono anche senza utente: metriche e file statici non toccano gli shard
+PUBLIC_PREFIXES = ("/metrics", "/static")
+
+
+def route_by_user(app, require: bool = REQUIRE_USER, public: Iterable[str] = PUBLIC_PREFIXES):
+    """Add the middleware that routes every request of ``app`` to its user's shard."""
+    from fastapi import Request
+    from fastapi.responses import JSONResponse
+
+    public = tuple(public)
+
+    @app.middleware("http")
+    async def user_routing(request: Request, call_next):
+        user_id = request.headers.get(USER_HEADER) or None
+        if user_id is None:
+            if require and not request.url.path.startswith(public):
+                return JSONResponse(status_code=401, content={"detail": f"header {USER_HEADER} mancante"})
+        elif not USER_ID_RE.match(user_id):
+            return JSONResponse(status_code=400, content={"detail": f"header {USER_HEADER} non valido"})
+        with user_scope(user_id):
+            return await call_next(request)
+
+    return app
+
+
+def forward_headers(request) -> dict:
+    """Headers to pass on when proxying ``request`` to the agent service."""
+    user_id = request.headers.get(USER_HEADER)
+    return {USER_HEADER: user_id} if user_id else {}
@@ -0,0 +1,257 @@
+"""Single writer per database file, with group commit.
+
+Every mutation of the application data (pantry lots, consumption logs, new
+foods, settings, cache bookkeeping) goes through :func:`write` or
+:func:`awrite` instead of a pooled connection. Operations are callables
+``fn(conn, *args)`` queued to one thread that owns the only writing connection
+of the process:
+
+- the thread takes whatever is queued (up to ``max_batch`` operations) and
+  runs it in one ``BEGIN IMMEDIATE`` transaction, so N concurrent writes cost
+  one lock acquisition and one WAL commit instead of N;
+- each operation runs inside its own savepoint: one that raises is rolled back
+  alone and its exception goes to its caller, the others still commit;
+- results go back through a ``concurrent.futures.Future`` once the batch is
+  committed, so a caller never sees a result whose data is not durable.
+
+Nothing waits for a batch to fill: an idle writer commits a lone operation
+immediately, and batches form by themselves while a commit is in progress.
+Readers keep using the pool and are never blocked, thanks to WAL.
+
+Operations must not commit (the connection's ``commit()`` is a no-op) nor run
+for long: bulk loads such as :mod:`foodly.core.importer` keep their own
+transactions. Two processes still each have their own writer; SQLite's lock
+and ``busy_timeout`` arbitrate between them.
+
+With per-user shards (:func:`foodly.core.db.resolve_db`) every shard has its
+own writer, started on first use and closed when the shard's pool is evicted.
+"""
+import asyncio
+import os
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from foodly.core import db as core_db
+from foodly.core import metrics
+from foodly.core.context import bump_write_generation
+
+WRITER_BATCH = int(os.getenv("FOODLY_WRITER_BATCH", "256"))
+
+Op = Tuple[Future, Callable[..., Any], tuple]
+
+
+class WriterClosed(RuntimeError):
+    """The writer was closed before the operation could be queued."""
+
+
+class WriterConnection(core_db.PooledConnection):
+    """The writer's connection: the transaction belongs to the batch, not to the operation."""
+
+    def commit(self):
+        pass
+
+
+class Writer:
+    def __init__(self, path: Path, max_batch: int = WRITER_BATCH):
+        self.path = Path(path)
+        self.max_batch = max(1, max_batch)
+        self._queue: "queue.SimpleQueue[Optional[Op]]" = queue.SimpleQueue()
+        self._closed = False
+        self._lock = threading.Lock()
+        self.ops = 0
+        self.batches = 0
+        self.failed_batches = 0
+        self.max_batch_seen = 0
+        self.busy_s = 0.0
+        # aperta qui: un errore di apertura arriva al chiamante, non al thread
+        self._conn = self._connect()
+        self._thread = threading.Thread(target=self._run, name=f"foodly-writer-{self.path.name}", daemon=True)
+        self._thread.start()
+
+    def _connect(self) -> WriterConnection:
+        conn = sqlite3.connect(self.path, factory=WriterConnection, check_same_thread=False, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        for key, value in core_db.PRAGMAS.items():
+            conn.execute(f"PRAGMA {key}={value}")
+        return conn
+
+    def submit(self, fn: Callable[..., Any], *args: Any) -> Future:
+        future: Future = Future()
+        with self._lock:
+            if self._closed:
+                raise WriterClosed(f"writer for {self.path} is closed")
+            self._queue.put((future, fn, args))
+        return future
+
+    def _run(self):
+        conn = self._conn
+        try:
+            while True:
+                op = self._queue.get()
+                if op is None:
+                    return
+                batch = [op]
+                stop = False
+                # raggruppa quello che si è accumulato durante il commit precedente
+                while len(batch) < self.max_batch:
+                    try:
+                        op = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if op is None:
+                        stop = True
+                        break
+                    batch.append(op)
+                self._commit(conn, batch)
+                if stop:
+                    return
+        finally:
+            sqlite3.Connection.close(conn)
+
+    def _commit(self, conn: WriterConnection, batch: List[Op]):
+        t0 = time.perf_counter()
+        outcomes: List[Tuple[Future, bool, Any]] = []
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            for future, fn, args in batch:
+                if not future.set_running_or_notify_cancel():
+                    continue
+                conn.execute("SAVEPOINT op")
+                try:
+                    result = fn(conn, *args)
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, True, result))
+                except Exception as e:
+                    conn.execute("ROLLBACK TO op")
+                    conn.execute("RELEASE op")
+                    outcomes.append((future, False, e))
+            conn.execute("COMMIT")
+        except Exception as e:
+            # lock non ottenuto o commit fallito: nessuna operazione del gruppo è stata scritta
+            if conn.in_transaction:
+                conn.execute("ROLLBACK")
+            self.failed_batches += 1
+            for future, _, _ in batch:
+                if not future.done():
+                    if not future.running():
+                        future.set_running_or_notify_cancel()
+                    future.set_exception(e)
+            return
+        finally:
+            self.busy_s += time.perf_counter() - t0
+        bump_write_generation()
+        self.ops += len(batch)
+        self.batches += 1
+        self.max_batch_seen = max(self.max_batch_seen, len(batch))
+        for future, ok, value in outcomes:
+            if ok:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def close(self, timeout: Optional[float] = None):
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join(timeout)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "queued": self._queue.qsize(),
+            "ops": self.ops,
+            "batches": self.batches,
+            "failed_batches": self.failed_batches,
+            "avg_batch": round(self.ops / self.batches, 2) if self.batches else 0.0,
+            "max_batch": self.max_batch_seen,
+            "busy_s": round(self.busy_s, 6),
+        }
+
+
+_writers: Dict[Path, Writer] = {}
+_writers_lock = threading.Lock()
+
+
+def get_writer(path: Optional[Path] = None) -> Writer:
+    """Writer of ``path``; by default of the current user's database (see :func:`foodly.core.db.resolve_db`)."""
+    path = Path(path or core_db.resolve_db())
+    with _writers_lock:
+        writer = _writers.get(path)
+        if writer is None:
+            writer = _writers[path] = Writer(path)
+        return writer
+
+
+def _submit(fn: Callable[..., Any], args: tuple) -> Future:
+    try:
+        return get_writer().submit(fn, *args)
+    except WriterClosed:
+        # shard evicted tra get_writer() e submit(): il prossimo get_writer() ne apre uno nuovo
+        return get_writer().submit(fn, *args)
+
+
+def submit(fn: Callable[..., Any], *args: Any) -> Future:
+    """Queue ``fn(conn, *args)`` and return its future, resolved once the batch is committed."""
+    return _submit(fn, args)
+
+
+def write(fn: Callable[..., Any], *args: Any) -> Any:
+    """Run ``fn(conn, *args)`` in the writer's next batch and return its result once committed."""
+    return _submit(fn, args).result()
+
+
+def _execute(conn: sqlite3.Connection, sql: str, params: Any) -> int:
+    return conn.execute(sql, params).rowcount
+
+
+def execute(sql: str, params: Any = ()) -> int:
+    """Single statement through the writer; returns its ``rowcount``."""
+    return write(_execute, sql, params)
+
+
+async def awrite(fn: Callable[..., Any], *args: Any) -> Any:
+    # attende il commit senza occupare un thread del threadpool
+    return await asyncio.wrap_future(_submit(fn, args))
+
+
+def writer_stats() -> Dict[str, Dict[str, Any]]:
+    with _writers_lock:
+        writers = list(_writers.items())
+    return {str(path): writer.stats() for path, writer in writers}
+
+
+def close_writers():
+    with _writers_lock:
+        writers = list(_writers.values())
+        _writers.clear()
+    for writer in writers:
+        writer.close()
+
+
+def _evict(path: Path):
+    with _writers_lock:
+        writer = _writers.pop(path, None)
+    if writer is not None:
+        # non si aspetta: il thread svuota la coda e chiude la connessione da solo
+        writer.close(timeout=0)
+
+
+core_db.on_evict(_evict)
+
+
+def _writer_samples():
+    stats = writer_stats()
+    return [
+        (f"foodly_writer_{key}", "gauge", f"Writer {key.replace('_', ' ')}.",
+         [({"db": path}, values[key]) for path, values in stats.items()])
+        for key in ("queued", "ops", "batches", "failed_batches", "busy_s")
+    ]
+
+
+metrics.register_collector(_writer_samples)
@@ -0,0 +1,94 @@
+import sqlite3
+import time
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+from foodly.core.barcode import BarcodeCache
+from foodly.core.migrations import migrate
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'foods.db')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.executemany(
+        'INSERT INTO foods(name, barcode, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (?, ?, 100, 10, 10, 1)',
+        [('Pasta di semola', '8001'), ('Passata di pomodoro', '8002'), ('Riso sfuso', None)],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_barcode_is_unique_when_present(conn):
+    with pytest.raises(sqlite3.IntegrityError):
+        conn.execute("INSERT INTO foods(name, barcode, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Doppio', '8001', 1, 1, 1, 1)")
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Senza codice', 1, 1, 1, 1)")
+    plan = ' '.join(r[3] for r in conn.execute("EXPLAIN QUERY PLAN SELECT id FROM foods WHERE barcode = '8001'"))
+    assert 'idx_foods_barcode' in plan
+
+
+def test_batch_lookup_is_cached_until_foods_change(conn):
+    cache = BarcodeCache()
+    found = cache.lookup(conn, ['8002', ' 8001 ', '0000'])
+    assert list(found) == ['8002', '8001', '0000']
+    assert found['8001']['name'] == 'Pasta di semola'
+    assert found['0000'] is None
+
+    statements = []
+    conn.set_trace_callback(statements.append)
+    again = cache.lookup(conn, ['8001', '0000'])
+    conn.set_trace_callback(None)
+    assert again == {'8001': found['8001'], '0000': None}
+    assert not [s for s in statements if 'FROM foods' in s]  # solo la lettura della versione
+    assert cache.stats()['hits'] == 2
+
+    # modifica da un'altra connessione: la cache viene svuotata
+    other = sqlite3.connect(conn.execute('PRAGMA database_list').fetchone()[2])
+    other.execute("UPDATE foods SET name = 'Pasta integrale' WHERE barcode = '8001'")
+    other.execute("INSERT INTO foods(name, barcode, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Nuovo', '0000', 1, 1, 1, 1)")
+    other.commit()
+    other.close()
+    fresh = cache.lookup(conn, ['8001', '0000'])
+    assert fresh['8001']['name'] == 'Pasta integrale'
+    assert fresh['0000']['name'] == 'Nuovo'
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_cached_lookup_is_sub_millisecond(conn):
+    cache = BarcodeCache()
+    cache.lookup(conn, ['8001'])
+    t0 = time.perf_counter()
+    for _ in range(200):
+        cache.lookup(conn, ['8001'])
+    assert (time.perf_counter() - t0) / 200 < 1e-3
+
+
+def test_barcode_endpoints_and_tool(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    conn = core_db.get_db()
+    conn.execute("UPDATE foods SET barcode = '8076809513753' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    from foodly.agent.main import app, execute_actions, tools_schema
+    from foodly.core.models import ToolCall
+
+    client = TestClient(app)
+    resp = client.get('/tools/food_by_barcode', params={'barcode': '8076809513753'})
+    assert resp.status_code == 200
+    assert resp.json()['data']['id'] == 1
+    assert client.get('/tools/food_by_barcode', params={'barcode': '123'}).status_code == 404
+    resp = client.post('/tools/food_by_barcode', json={'barcodes': ['123', '8076809513753']})
+    assert {k: v and v['id'] for k, v in resp.json()['data'].items()} == {'123': None, '8076809513753': 1}
+
+    assert 'find_by_barcode' in {t['function']['name'] for t in tools_schema()}
+    conn = core_db.get_db()
+    try:
+        result = execute_actions(conn, [ToolCall(name='find_by_barcode', arguments={'barcodes': ['8076809513753']})])
+    finally:
+        conn.close()
+    assert result[0]['data']['8076809513753']['id'] == 1
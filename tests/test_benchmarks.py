@@ -0,0 +1,53 @@
+import json
+
+from benchmarks import startup, suite
+from benchmarks.data import build_db
+
+
+def _dump(conn):
+    return [
+        [tuple(r) for r in conn.execute(f'SELECT * FROM {table} ORDER BY id')]
+        for table in ('foods', 'pantry', 'consumption_logs')
+    ]
+
+
+def test_generator_is_deterministic():
+    a = build_db(foods=50, lots=30, days=10, seed=7)
+    b = build_db(foods=50, lots=30, days=10, seed=7)
+    c = build_db(foods=50, lots=30, days=10, seed=8)
+    assert _dump(a) == _dump(b)
+    assert _dump(a) != _dump(c)
+    assert tuple(a.execute('SELECT COUNT(DISTINCT name), COUNT(DISTINCT barcode) FROM foods').fetchone()) == (50, 50)
+    assert a.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0] == 60
+    assert a.execute('SELECT COUNT(*) FROM daily_totals').fetchone()[0] == 10
+
+
+def test_compare_flags_only_real_regressions():
+    baseline = {'results': {'a': {'median_ms': 10.0}, 'b': {'median_ms': 0.01}, 'c': {'median_ms': 5.0}}}
+    current = {'results': {'a': {'median_ms': 13.0}, 'b': {'median_ms': 0.05}, 'c': {'median_ms': 5.5}, 'new': {'median_ms': 1.0}}}
+    assert [r['name'] for r in suite.compare(current, baseline, threshold=0.25)] == ['a']
+    assert suite.compare(current, baseline, threshold=0.5) == []
+
+
+def test_suite_writes_results_and_fails_on_regression(tmp_path):
+    out, baseline = tmp_path / 'results.json', tmp_path / 'baseline.json'
+    args = ['--foods', '40', '--lots', '20', '--days', '5', '--repeat', '2', '--warmup', '0',
+            '--out', str(out), '--baseline', str(baseline)]
+    assert suite.main(args + ['--update-baseline']) == 0
+    results = json.loads(out.read_text())
+    assert {'micro.naive_parse', 'micro.tool_consume', 'http.agent.chat_dry_run', 'http.web.pantry_page'} <= set(results['results'])
+
+    # baseline 100 volte più veloce: tutto è una regressione
+    data = json.loads(baseline.read_text())
+    for res in data['results'].values():
+        res['median_ms'] /= 100
+    baseline.write_text(json.dumps(data))
+    assert suite.main(args + ['--only', 'micro.suggest*']) == 1
+
+
+def test_services_start_without_heavy_imports(tmp_path):
+    for service in ('agent', 'web'):
+        res = startup._run_child(service, tmp_path / f'{service}.db')
+        # numpy, jinja2 e httpx arrivano solo con suggerimenti, pagine HTML e chat
+        assert res['status'] == 200 and res['heavy_modules'] == []
+        assert (tmp_path / f'{service}.db').exists()
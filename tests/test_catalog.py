@@ -0,0 +1,94 @@
+import sqlite3
+from importlib import reload
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+from foodly.core.catalog import decode_cursor, list_foods, list_pantry
+from foodly.core.migrations import migrate
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'foods.db')
+    migrate(conn)
+    names = [f'Alimento {i:03d}' for i in range(120)] + ['Mela golden', 'Mele renette', 'Caffè macinato']
+    conn.executemany(
+        'INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (?, 1, 1, 1, 1)',
+        [(n,) for n in names],
+    )
+    conn.executemany(
+        'INSERT INTO pantry(food_id, qty_g, location, best_before) VALUES (?, 100, ?, ?)',
+        [(121, 'Frigo', '2026-01-10'), (122, 'dispensa', '2026-03-01'), (121, 'frigo', None), (1, 'dispensa', '2025-12-31')],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _walk(fetch):
+    items, cursor, pages = [], None, 0
+    while True:
+        page = fetch(cursor)
+        items += page['items']
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            return items, pages
+
+
+def test_foods_keyset_pages_cover_catalogue_once(conn):
+    items, pages = _walk(lambda c: list_foods(conn, cursor=c, limit=50))
+    assert pages == 3
+    assert len(items) == 123 and len({f['id'] for f in items}) == 123
+    assert [f['name'] for f in items] == sorted(f['name'] for f in items)
+
+    # una riga inserita prima del cursore non sposta le pagine successive
+    first = list_foods(conn, limit=50)
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Aaa', 1, 1, 1, 1)")
+    second = list_foods(conn, cursor=first['next_cursor'], limit=50)
+    assert second['items'][0]['name'] == 'Alimento 050'
+
+
+def test_foods_name_filter_uses_full_text(conn):
+    assert [f['name'] for f in list_foods(conn, q='mela')['items']] == ['Mela golden', 'Mele renette']
+    assert [f['name'] for f in list_foods(conn, q='caffe')['items']] == ['Caffè macinato']
+
+
+def test_foods_page_is_an_index_range_scan(conn):
+    cursor = list_foods(conn, limit=50)['next_cursor']
+    assert decode_cursor(cursor) == ('Alimento 049', 50)
+    plan = ' '.join(r[3] for r in conn.execute(
+        'EXPLAIN QUERY PLAN SELECT id FROM foods f WHERE (f.name, f.id) > (?, ?) ORDER BY f.name, f.id LIMIT 51',
+        decode_cursor(cursor),
+    ))
+    assert 'idx_foods_name' in plan and 'TEMP B-TREE' not in plan
+
+
+def test_pantry_filters(conn):
+    assert [p['pid'] for p in list_pantry(conn, location='frigo')['items']] == [1, 3]
+    assert [p['pid'] for p in list_pantry(conn, best_before='2026-01-31')['items']] == [4, 1]
+    assert [p['pid'] for p in list_pantry(conn, q='mele')['items']] == [1, 3, 2]
+    items, pages = _walk(lambda c: list_pantry(conn, cursor=c, limit=1))
+    assert [p['pid'] for p in items] == [4, 1, 3, 2] and pages == 4
+
+
+def test_list_endpoints_and_lazy_index(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'test.db')
+    from foodly.app import main as app_module
+    reload(app_module)
+    client = TestClient(app_module.app)
+
+    resp = client.get('/api/foods', params={'limit': 2})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert len(body['items']) == 2 and body['next_cursor']
+    assert len(client.get('/api/foods', params={'cursor': body['next_cursor']}).json()['items']) == 1
+    assert client.get('/api/foods', params={'cursor': 'xyz'}).status_code == 400
+    assert client.get('/api/pantry', params={'best_before': 'ieri'}).status_code == 422
+    assert client.get('/api/pantry', params={'location': 'dispensa'}).json()['items']
+
+    resp = client.get('/')
+    assert resp.status_code == 200
+    assert 'Tonno al naturale' not in resp.text
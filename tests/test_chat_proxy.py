@@ -0,0 +1,62 @@
+from importlib import reload
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent.plan_cache import plan_cache
+from foodly.core import db as core_db
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'test.db')
+    plan_cache.clear()
+    from foodly.app import main as app_module
+    reload(app_module)
+    return app_module
+
+
+def test_proxy_reuses_one_client_and_sends_chat_request(app_module):
+    from foodly.agent.main import app as agent_app
+    seen = []
+
+    async def record(request):
+        seen.append(request)
+
+    transport = httpx.ASGITransport(app=agent_app)
+    with TestClient(app_module.app) as client:
+        # nessun client (né httpx) finché non arriva una chat; qui uno che parla con l'agente in memoria
+        assert getattr(app_module.app.state, 'agent_client', None) is None
+        app_module.app.state.agent_client = httpx.AsyncClient(
+            transport=transport, base_url='http://agent', event_hooks={'request': [record]}
+        )
+        for text in ('ho mangiato 56 g di tonno', 'come sto?'):
+            resp = client.post('/chat', data={'user_message': text})
+            assert resp.status_code == 200
+            assert resp.json()['message'].startswith('Riepilogo:')
+        proxied = app_module.app.state.agent_client
+        assert [r.url.path for r in seen] == ['/agent/chat', '/agent/chat']
+    assert proxied.is_closed  # chiuso dal lifespan
+
+
+def test_agent_errors_are_reported(app_module):
+    async def fail(request):
+        return httpx.Response(503)
+
+    with TestClient(app_module.app) as client:
+        app_module.app.state.agent_client = httpx.AsyncClient(transport=httpx.MockTransport(fail), base_url='http://agent')
+        resp = client.post('/chat', data={'user_message': 'ciao'})
+    assert resp.status_code == 500
+    assert 'error' in resp.json()
+
+
+def test_in_process_mode_skips_http(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'AGENT_IN_PROCESS', True)
+    with TestClient(app_module.app) as client:
+        assert getattr(app_module.app.state, 'agent_client', None) is None
+        resp = client.post('/chat', data={'user_message': 'ho mangiato 56 g di tonno'})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body['actions'][0]['name'] == 'consume'
+    assert body['results']['totals']['kcal'] == pytest.approx(65.0)
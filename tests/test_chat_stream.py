@@ -0,0 +1,141 @@
+import asyncio
+import json
+import time
+from importlib import reload
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent import main as agent_main
+from foodly.core import db as core_db
+from foodly.core.models import ChatRequest
+
+EVENTS = ['actions', 'tool_result', 'summary', 'suggestion', 'message', 'done']
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+
+
+def _logs():
+    conn = core_db.get_db()
+    try:
+        return conn.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _ndjson(text):
+    return [json.loads(line) for line in text.splitlines() if line]
+
+
+def test_agent_streams_ndjson_events_in_order(db):
+    client = TestClient(agent_main.app)
+    resp = client.post('/agent/chat/stream', json={'user_message': 'ho mangiato 56 g di tonno'})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('application/x-ndjson')
+    events = _ndjson(resp.text)
+    assert [e['event'] for e in events] == EVENTS
+    assert events[0]['data'][0]['name'] == 'consume'
+    assert events[2]['data']['totals']['kcal'] == pytest.approx(65.0)
+    assert events[4]['data']['message'].startswith('Riepilogo:')
+    assert events[5]['data']['queries'] > 0
+
+
+def test_agent_streams_sse(db):
+    client = TestClient(agent_main.app)
+    resp = client.post('/agent/chat/stream', json={'user_message': 'come va?'}, headers={'Accept': 'text/event-stream'})
+    assert resp.headers['content-type'].startswith('text/event-stream')
+    blocks = [b for b in resp.text.split('\n\n') if b]
+    assert [b.split('\n')[0] for b in blocks] == ['event: actions', 'event: summary', 'event: suggestion', 'event: message', 'event: done']
+    assert json.loads(blocks[0].split('\n')[1][len('data: '):]) == []
+
+
+def test_first_event_does_not_wait_for_suggestion(db, monkeypatch):
+    suggest = agent_main.suggest_from_pantry
+
+    def slow_suggest(*args, **kwargs):
+        time.sleep(0.3)
+        return suggest(*args, **kwargs)
+
+    monkeypatch.setattr(agent_main, 'suggest_from_pantry', slow_suggest)
+
+    async def collect():
+        t0 = time.perf_counter()
+        return [(event, time.perf_counter() - t0) async for event, _ in agent_main.chat_events(ChatRequest(user_message='ho mangiato 56 g di tonno'))]
+
+    timeline = dict(asyncio.run(collect()))
+    assert timeline['actions'] < 0.2
+    assert timeline['summary'] < 0.2
+    assert timeline['suggestion'] >= 0.3
+
+
+def test_tool_results_stream_as_each_action_runs(db, monkeypatch):
+    run_action = agent_main._run_action
+    calls = []
+
+    def slow_second(conn, action):
+        calls.append(action)
+        if len(calls) == 2:
+            time.sleep(0.3)
+        return run_action(conn, action)
+
+    monkeypatch.setattr(agent_main, '_run_action', slow_second)
+
+    async def collect():
+        t0 = time.perf_counter()
+        req = ChatRequest(user_message='ho mangiato 56 g di tonno e 20 g di gallette')
+        return [(event, time.perf_counter() - t0) async for event, _ in agent_main.chat_events(req)]
+
+    timeline = asyncio.run(collect())
+    results = [t for event, t in timeline if event == 'tool_result']
+    assert len(results) == 2
+    assert results[0] < 0.2 <= 0.3 <= results[1]
+    assert _logs() == 2
+
+
+def test_failed_action_writes_nothing(db, monkeypatch):
+    run_action = agent_main._run_action
+    calls = []
+
+    def fail_second(conn, action):
+        calls.append(action)
+        if len(calls) == 2:
+            raise RuntimeError('guasto')
+        return run_action(conn, action)
+
+    monkeypatch.setattr(agent_main, '_run_action', fail_second)
+    client = TestClient(agent_main.app)
+    events = _ndjson(client.post('/agent/chat/stream', json={'user_message': 'ho mangiato 56 g di tonno e 20 g di gallette'}).text)
+    assert [e['event'] for e in events] == ['actions', 'tool_result', 'error']
+    assert _logs() == 0
+
+
+def test_web_app_relays_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'test.db')
+    from foodly.app import main as app_module
+    reload(app_module)
+    with TestClient(app_module.app) as client:
+        app_module.app.state.agent_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=agent_main.app), base_url='http://agent'
+        )
+        resp = client.post('/chat/stream', data={'user_message': 'ho mangiato 56 g di tonno'})
+        assert resp.status_code == 200
+        assert [e['event'] for e in _ndjson(resp.text)] == EVENTS
+        # la chiave di idempotenza arriva all'agente, via HTTP e in processo
+        form = {'user_message': 'ho mangiato 80 g di tonno', 'idempotency_key': 'web-1'}
+        for in_process in (False, True):
+            monkeypatch.setattr(app_module, 'AGENT_IN_PROCESS', in_process)
+            events = _ndjson(client.post('/chat/stream', data=form).text)
+            assert [e['event'] for e in events] == EVENTS
+        assert events[-1]['data']['replayed'] is True
+        assert _logs() == 2
+        monkeypatch.setattr(app_module, 'AGENT_IN_PROCESS', False)
+
+        monkeypatch.setattr(app_module, 'AGENT_IN_PROCESS', True)
+        resp = client.post('/chat/stream', params={'format': 'sse'}, data={'user_message': 'come va?'})
+        assert resp.headers['content-type'].startswith('text/event-stream')
+        assert resp.text.startswith('event: actions\n')
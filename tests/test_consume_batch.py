@@ -0,0 +1,71 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent.tools import tool_consume_batch
+from foodly.core import db as core_db
+from foodly.core.migrations import migrate
+from foodly.core.models import Consume
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.executemany(
+        "INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (?, 100, 10, 10, 1)",
+        [('Riso',), ('Pollo',), ('Mela',)],
+    )
+    conn.executemany(
+        'INSERT INTO pantry(food_id, qty_g, best_before, created_at) VALUES (?,?,?,?)',
+        [
+            (1, 100, None, '2024-01-01'),
+            (1, 100, '2024-06-01', '2024-02-01'),   # scade prima: va consumato per primo
+            (1, 100, None, '2024-01-15'),
+            (2, 50, None, '2024-01-01'),
+        ],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _qty(conn):
+    return [r[0] for r in conn.execute('SELECT qty_g FROM pantry ORDER BY id')]
+
+
+def test_fifo_across_lots_and_items(conn):
+    shortfall = tool_consume_batch(conn, [Consume(food_id=1, grams=120), Consume(food_id=1, grams=30)])
+    assert shortfall == []
+    assert _qty(conn) == [50.0, 0.0, 100.0, 50.0]
+    assert conn.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0] == 2
+
+
+def test_reports_shortfall_per_food(conn):
+    shortfall = tool_consume_batch(conn, [Consume(food_id=2, grams=80), Consume(food_id=3, grams=20)])
+    assert shortfall == [{'food_id': 2, 'missing_g': 30.0}, {'food_id': 3, 'missing_g': 20.0}]
+    assert _qty(conn)[3] == 0.0
+    assert conn.execute('SELECT kcal FROM daily_totals').fetchone()[0] == pytest.approx(100.0)
+
+
+def test_endpoint_is_atomic(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    from foodly.agent.main import app
+    client = TestClient(app)
+    resp = client.post('/tools/consume_batch', json={'items': [
+        {'food_id': 1, 'grams': 100, 'meal': 'lunch'},
+        {'food_id': 2, 'grams': 300, 'meal': 'lunch'},
+    ]})
+    assert resp.status_code == 200
+    body = resp.json()
+    assert body['logged'] == 2
+    assert body['shortfall'] == [{'food_id': 2, 'missing_g': 100.0}]
+    assert client.post('/tools/consume_batch', json={'items': []}).status_code == 422
+    bad = client.post('/tools/consume_batch', json={'items': [{'food_id': 1, 'grams': 10}, {'food_id': 1, 'grams': -5}]})
+    assert bad.status_code == 422
+    conn = sqlite3.connect(tmp_path / 'agent.db')
+    assert conn.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0] == 2
+    conn.close()
@@ -0,0 +1,82 @@
+import threading
+import time
+
+import pytest
+
+from foodly.core import db as core_db
+
+
+@pytest.fixture
+def pool(tmp_path):
+    pool = core_db.ConnectionPool(tmp_path / 'pool.db', size=2, timeout=2.0)
+    yield pool
+    pool.close()
+
+
+def test_pragmas_applied(pool):
+    conn = pool.acquire()
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    assert conn.execute('PRAGMA synchronous').fetchone()[0] == 1  # NORMAL
+    assert conn.execute('PRAGMA busy_timeout').fetchone()[0] == 5000
+    assert conn.execute('PRAGMA cache_size').fetchone()[0] == -16000
+    conn.close()
+
+
+def test_close_returns_connection_to_pool(pool):
+    conn = pool.acquire()
+    conn.close()
+    again = pool.acquire()
+    assert again is conn
+    stats = pool.stats()
+    assert stats['open'] == 1
+    assert stats['misses'] == 1
+    assert stats['hits'] == 1
+    assert stats['thread_hits'] == 1
+    again.close()
+    again.close()  # doppia close: ignorata
+    assert pool.stats()['idle'] == 1
+
+
+def test_uncommitted_work_is_rolled_back(pool):
+    conn = pool.acquire()
+    conn.execute('CREATE TABLE t (x INTEGER)')
+    conn.commit()
+    conn.execute('INSERT INTO t VALUES (1)')
+    conn.close()
+    conn = pool.acquire()
+    assert conn.execute('SELECT COUNT(*) FROM t').fetchone()[0] == 0
+    conn.close()
+
+
+def test_waits_when_exhausted(pool):
+    a, b = pool.acquire(), pool.acquire()
+
+    def release_later():
+        time.sleep(0.05)
+        a.close()
+
+    threading.Thread(target=release_later).start()
+    c = pool.acquire()
+    assert c is a
+    stats = pool.stats()
+    assert stats['waits'] == 1
+    assert stats['open'] == 2
+    assert stats['in_use'] == 2
+    b.close(); c.close()
+
+
+def test_timeout_when_exhausted(tmp_path):
+    pool = core_db.ConnectionPool(tmp_path / 'small.db', size=1, timeout=0.05)
+    conn = pool.acquire()
+    with pytest.raises(TimeoutError):
+        pool.acquire()
+    conn.close()
+    pool.close()
+
+
+def test_get_db_follows_db_path(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'other.db')
+    conn = core_db.get_db()
+    assert conn.pool is core_db.get_pool()
+    conn.close()
+    assert str(tmp_path / 'other.db') in core_db.pool_stats()
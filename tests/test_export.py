@@ -0,0 +1,93 @@
+import csv
+import io
+import json
+from datetime import date
+from importlib import reload
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+from foodly.core import export
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'test.db')
+    from foodly.app import main as app_module
+    reload(app_module)
+    conn = core_db.get_db()
+    # tonno (id 1, 116 kcal/100 g): 3 anni di log, uno al giorno
+    conn.executemany(
+        "INSERT INTO consumption_logs(ts, food_id, grams, meal) VALUES (date('2023-01-01', ?) || 'T12:00:00', 1, 50, 'lunch')",
+        [(f'+{d} days',) for d in range(3 * 365)],
+    )
+    conn.commit()
+    conn.close()
+    with TestClient(app_module.app) as client:
+        yield client
+
+
+def test_csv_export_with_date_range_and_nutrients(client):
+    resp = client.get('/api/export/consumption', params={'from': '2024-02-28', 'to': '2024-03-01'})
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/csv')
+    assert 'foodly_consumption_2024-02-28_2024-03-01.csv' in resp.headers['content-disposition']
+    rows = list(csv.DictReader(io.StringIO(resp.text)))
+    assert [r['ts'][:10] for r in rows] == ['2024-02-28', '2024-02-29', '2024-03-01']
+    assert rows[0]['food_name'].startswith('Tonno')
+    assert float(rows[0]['kcal']) == pytest.approx(58.0)
+
+
+def test_ndjson_export_streams_in_batches(client, monkeypatch):
+    batches = []
+    iter_batches = export.iter_batches
+
+    def spy(*args, **kwargs):
+        for rows in iter_batches(*args, **kwargs):
+            batches.append(len(rows))
+            yield rows
+
+    monkeypatch.setattr(export, 'iter_batches', spy)
+    resp = client.get('/api/export/consumption', params={'format': 'ndjson'})
+    lines = [json.loads(line) for line in resp.text.splitlines()]
+    assert len(lines) == 3 * 365
+    assert max(batches) == export.EXPORT_BATCH_ROWS and len(batches) == 2
+    assert lines[-1]['ts'].startswith('2025-12-30')  # 2024 è bisestile
+
+
+def test_pantry_export_and_errors(client):
+    rows = list(csv.DictReader(io.StringIO(client.get('/api/export/pantry').text)))
+    assert {r['location'] for r in rows} == {'dispensa', 'frigo'}
+    assert 'kcal_100g' in rows[0]
+    assert client.get('/api/export/consumption', params={'from': '2024-02-01', 'to': '2024-01-01'}).status_code == 400
+    assert client.get('/api/export/users').status_code == 422
+
+
+def test_columnar_formats_need_pyarrow(client):
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        assert client.get('/api/export/consumption', params={'format': 'parquet'}).status_code == 501
+        return
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    resp = client.get('/api/export/consumption', params={'format': 'parquet', 'from': '2024-01-01', 'to': '2024-12-31'})
+    table = pq.read_table(io.BytesIO(resp.content))
+    assert table.num_rows == 366
+    assert table.schema.field('kcal').type == pa.float64()
+    resp = client.get('/api/export/pantry', params={'format': 'arrow'})
+    assert pa.ipc.open_stream(resp.content).read_all().num_rows == 3
+
+
+def test_iter_batches_filters_inclusive_days(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'plain.db')
+    core_db.init_db()
+    conn = core_db.get_db()
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-05-01T23:59:59', 1, 10)")
+    try:
+        rows = [r for b in export.iter_batches(conn, 'consumption', date(2024, 5, 1), date(2024, 5, 1)) for r in b]
+    finally:
+        conn.close()
+    assert len(rows) == 1
@@ -0,0 +1,90 @@
+import sqlite3
+from datetime import date
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+from foodly.core import httpcache
+from foodly.core.context import QUERY_COUNT_HEADER
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'cache.db')
+    core_db.init_db()
+    httpcache.response_cache.clear()
+    yield tmp_path / 'cache.db'
+
+
+@pytest.fixture
+def web(db):
+    from foodly.app.main import app
+    with TestClient(app) as client:
+        yield client
+
+
+def test_summary_revalidates_until_data_changes(web):
+    today = date.today().isoformat()
+    first = web.get('/api/summary')
+    etag = first.headers['etag']
+    assert first.status_code == 200 and first.headers['cache-control'] == 'no-cache'
+    assert first.json()['date'] == today
+
+    again = web.get('/api/summary', headers={'If-None-Match': etag})
+    assert again.status_code == 304 and again.content == b'' and again.headers['etag'] == etag
+    # stessa data esplicita: stessa risorsa
+    assert web.get('/api/summary', params={'date_str': today}, headers={'If-None-Match': etag}).status_code == 304
+    assert web.get('/api/summary', params={'date_str': '2020-01-01'}, headers={'If-None-Match': etag}).status_code == 200
+
+    web.post('/api/consume', data={'food_id': 1, 'grams': 56}, follow_redirects=False)
+    changed = web.get('/api/summary', headers={'If-None-Match': etag})
+    assert changed.status_code == 200 and changed.headers['etag'] != etag
+    assert changed.json()['totals']['kcal'] > first.json()['totals']['kcal']
+
+    # anche le impostazioni cambiano gli obiettivi
+    etag = changed.headers['etag']
+    web.post('/settings', data={'weight_kg': 90, 'height_cm': 180, 'age': 40, 'sex': 'M', 'activity_level': 1.5},
+             follow_redirects=False)
+    assert web.get('/api/summary', headers={'If-None-Match': etag}).status_code == 200
+
+
+def test_body_is_served_from_cache_while_versions_hold(web, db):
+    params = {'from': '2025-01-01', 'to': '2025-01-31', 'granularity': 'week'}
+    before = httpcache.response_cache.stats()
+    first = web.get('/api/summary/range', params=params)
+    second = web.get('/api/summary/range', params=params)
+    assert second.content == first.content
+    stats = httpcache.response_cache.stats()
+    assert (stats['hits'] - before['hits'], stats['misses'] - before['misses']) == (1, 1)
+
+    # scrittura da un'altra connessione (o processo): i trigger aggiornano comunque la versione
+    conn = sqlite3.connect(db)
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2025-01-10T12:00:00', 1, 100)")
+    conn.commit()
+    conn.close()
+    third = web.get('/api/summary/range', params=params)
+    assert third.headers['etag'] != first.headers['etag']
+    assert third.json()['buckets'] != first.json()['buckets']
+    assert web.get('/api/summary/range', params={**params, 'from': '2025-02-01'}).status_code == 400
+
+
+def test_agent_summary_not_modified_costs_one_query(db):
+    from foodly.agent.main import app
+    before = httpcache.response_cache.stats()['not_modified']
+    with TestClient(app) as client:
+        first = client.get('/tools/summary', params={'date_str': '2025-01-01'})
+        assert 'kcal' in first.json()['data']
+        resp = client.get('/tools/summary', params={'date_str': '2025-01-01'},
+                          headers={'If-None-Match': f'W/{first.headers["etag"]}'})
+    assert resp.status_code == 304
+    assert resp.headers[QUERY_COUNT_HEADER] == '1'
+    assert httpcache.response_cache.stats()['not_modified'] == before + 1
+
+
+def test_if_none_match_parsing():
+    assert httpcache._matches('"a", "b"', '"b"')
+    assert httpcache._matches('W/"b"', '"b"')
+    assert httpcache._matches('*', '"b"')
+    assert not httpcache._matches('"a"', '"b"')
+    assert not httpcache._matches(None, '"b"')
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent import idempotency as idem
+from foodly.agent import llm
+from foodly.core import db as core_db
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    yield tmp_path / 'agent.db'
+
+
+@pytest.fixture
+def client(db):
+    from foodly.agent.main import app
+    with TestClient(app) as client:
+        yield client
+
+
+def _count(sql):
+    conn = core_db.get_db()
+    try:
+        return conn.execute(sql).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def test_tool_retry_returns_stored_response_without_writing_again(client):
+    pantry = _count('SELECT SUM(qty_g) FROM pantry WHERE food_id = 1')
+    headers = {'Idempotency-Key': 'k-1'}
+    for _ in range(3):
+        resp = client.post('/tools/consume', json={'food_id': 1, 'grams': 56}, headers=headers)
+        assert resp.status_code == 200 and resp.json() == {'status': 'ok'}
+    assert _count('SELECT COUNT(*) FROM consumption_logs') == 1
+    assert _count('SELECT SUM(qty_g) FROM pantry WHERE food_id = 1') == pantry - 56
+
+    # stessa chiave, richiesta diversa
+    assert client.post('/tools/consume', json={'food_id': 1, 'grams': 80}, headers=headers).status_code == 422
+    # senza chiave ogni richiesta scrive
+    client.post('/tools/consume', json={'food_id': 1, 'grams': 10})
+    assert _count('SELECT COUNT(*) FROM consumption_logs') == 2
+
+
+def test_chat_retry_skips_tools_and_llm(client, monkeypatch):
+    monkeypatch.setenv('FOODLY_API', 'test-key')
+    calls = []
+
+    class Stub:
+        model = 'stub'
+
+        async def complete(self, api_key, messages, tools=None):
+            calls.append(messages)
+            return {'tool_calls': [{'function': {'name': 'consume', 'arguments': json.dumps({'food_id': 1, 'grams': 56})}}]}
+
+    previous = llm.set_backend(Stub())
+    try:
+        body = {'user_message': 'ho mangiato una scatoletta di tonno', 'use_rule_based': False,
+                'bypass_cache': True, 'idempotency_key': 'chat-1'}
+        first = client.post('/agent/chat', json=body).json()
+        second = client.post('/agent/chat', json=body).json()
+    finally:
+        llm.set_backend(previous)
+    assert first == second
+    assert len(calls) == 1
+    assert _count('SELECT COUNT(*) FROM consumption_logs') == 1
+
+
+def test_stream_retry_replays_stored_events(client):
+    def stream(body):
+        resp = client.post('/agent/chat/stream', json=body)
+        return resp.status_code, [json.loads(line) for line in resp.text.splitlines() if line]
+
+    body = {'user_message': 'ho mangiato 56 g di tonno', 'idempotency_key': 'stream-1'}
+    status, first = stream(body)
+    assert status == 200 and first[-1]['event'] == 'done' and 'replayed' not in first[-1]['data']
+    status, second = stream(body)
+    assert status == 200 and second[-1]['data']['replayed'] is True
+    assert second[:-1] == first[:-1]
+    assert _count('SELECT COUNT(*) FROM consumption_logs') == 1
+
+    # stessa chiave di /agent/chat: la risposta salvata è la stessa
+    assert client.post('/agent/chat', json=body).json()['message'] == first[-2]['data']['message']
+    assert stream({**body, 'user_message': 'ho mangiato 80 g di tonno'})[0] == 422
+    assert _count('SELECT COUNT(*) FROM consumption_logs') == 1
+
+
+def test_failed_llm_call_releases_the_key(client, monkeypatch):
+    monkeypatch.setenv('FOODLY_API', 'test-key')
+    answers = [llm.LLMError('giù'), {'content': 'ok'}]
+
+    class Flaky:
+        model = 'stub'
+
+        async def complete(self, api_key, messages, tools=None):
+            answer = answers.pop(0)
+            if isinstance(answer, Exception):
+                raise answer
+            return answer
+
+    previous = llm.set_backend(Flaky())
+    try:
+        body = {'user_message': 'ciao', 'use_rule_based': False, 'bypass_cache': True, 'idempotency_key': 'chat-2'}
+        assert 'non risponde' in client.post('/agent/chat', json=body).json()['message']
+        assert client.post('/agent/chat', json=body).json()['message'].startswith('Riepilogo:')
+    finally:
+        llm.set_backend(previous)
+    assert answers == []
+
+
+def test_concurrent_duplicates_run_once(db):
+    store = idem.IdempotencyStore(ttl=60)
+    runs = []
+
+    async def work():
+        runs.append(1)
+        await asyncio.sleep(0.05)
+        return {'n': len(runs)}, True
+
+    async def main():
+        return await asyncio.gather(*(store.run('consume', 'k', {'a': 1}, work) for _ in range(5)))
+
+    assert asyncio.run(main()) == [{'n': 1}] * 5
+    assert len(runs) == 1
+    stats = store.stats()
+    assert (stats['executed'], stats['coalesced']) == (1, 4)
+
+
+def test_waits_for_request_running_in_another_process(db, monkeypatch):
+    monkeypatch.setattr(idem, 'POLL_S', 0.01)
+    other, store = idem.IdempotencyStore(ttl=60), idem.IdempotencyStore(ttl=60)
+    fp = idem.fingerprint({'a': 1})
+    state, token = other.claim('consume:k', fp)
+    assert state == 'claimed'
+    threading.Timer(0.1, other.complete, ('consume:k', token, {'status': 'ok'})).start()
+
+    async def never():
+        raise AssertionError('eseguita due volte')
+
+    assert asyncio.run(store.run('consume', 'k', {'a': 1}, never)) == {'status': 'ok'}
+    assert store.stats()['replayed'] == 1
+
+
+def test_expired_keys_are_reclaimed_and_purged(db, monkeypatch):
+    store = idem.IdempotencyStore(ttl=60, lease=5)
+    fp = idem.fingerprint({})
+    assert store.claim('a', fp)[0] == 'claimed'  # lease abbandonato
+    state, token = store.claim('b', fp)
+    store.complete('b', token, {'ok': True})
+    assert store.claim('a', fp) == ('pending', None)
+    assert store.claim('b', fp) == ('done', {'ok': True})
+
+    now = idem.time.time()
+    monkeypatch.setattr(idem.time, 'time', lambda: now + 30)
+    assert store.claim('a', fp)[0] == 'claimed'
+    assert store.claim('b', fp) == ('done', {'ok': True})
+    monkeypatch.setattr(idem.time, 'time', lambda: now + 120)
+    conn = core_db.get_db()
+    try:
+        assert store.purge(conn) == 2
+        conn.commit()
+    finally:
+        conn.close()
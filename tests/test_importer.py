@@ -0,0 +1,176 @@
+import gzip
+import io
+import json
+import sqlite3
+import subprocess
+import sys
+from importlib import reload
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+from foodly.core.db import table_version
+from foodly.core import importer
+from foodly.core.importer import import_foods, normalize_row
+from foodly.core.migrations import migrate
+from foodly.core.search import search_foods
+
+OFF_HEADER = 'code\tproduct_name\tbrands\tenergy-kcal_100g\tproteins_100g\tcarbohydrates_100g\tfat_100g\tsugars_100g\tsalt_100g\n'
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'foods.db')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    yield conn
+    conn.close()
+
+
+def _schema(conn):
+    return sorted(tuple(r) for r in conn.execute("SELECT type, name FROM sqlite_master WHERE tbl_name = 'foods'"))
+
+
+def test_off_tsv_with_upsert_and_rejects(conn, tmp_path):
+    path = tmp_path / 'off.csv.gz'
+    with gzip.open(path, 'wt', encoding='utf-8') as f:
+        f.write(OFF_HEADER)
+        f.write('8001\tPasta di semola\tBarilla,Voiello\t359\t12.5\t71\t2\t3.5\t0.01\n')
+        f.write('8002\tPassata di pomodoro\tMutti\t36\t1.6\t5.6\t0.2\t4.7\t0.5\n')
+        f.write('8003\t\tSenza nome\t100\t1\t1\t1\t1\t0\n')
+        f.write('8004\tOlio sbagliato\t\t9000\t0\t0\t100\t0\t0\n')
+        f.write('8001\tPasta di semola integrale\tBarilla\t350\t13\t66\t2.5\t3\t0.01\n')
+    before = _schema(conn)
+    version = table_version(conn, 'foods')
+    progress = []
+
+    stats = import_foods(conn, path, food_source='off', chunk_rows=2, progress=progress.append)
+
+    assert (stats['read'], stats['inserted'], stats['updated'], stats['rejected']) == (5, 2, 1, 2)
+    assert [e['row'] for e in stats['errors']] == [3, 4]
+    assert progress[-1]['read'] == 5 and len(progress) > 1
+    rows = conn.execute('SELECT barcode, name, brand, sodium_mg_100g, source FROM foods ORDER BY barcode').fetchall()
+    assert [tuple(r) for r in rows] == [
+        ('8001', 'Pasta di semola integrale', 'Barilla', pytest.approx(4.0), 'off'),
+        ('8002', 'Passata di pomodoro', 'Mutti', pytest.approx(200.0), 'off'),
+    ]
+    # indici e trigger ricreati, indice full-text ricostruito
+    assert _schema(conn) == before
+    assert table_version(conn, 'foods') > version  # cache dei barcode invalidata
+    assert [r['name'] for r in search_foods(conn, 'integrale')] == ['Pasta di semola integrale']
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Farro perlato', 1, 1, 1, 1)")
+    assert [r['name'] for r in search_foods(conn, 'farro')] == ['Farro perlato']
+
+
+def test_jsonl_with_nested_nutriments(conn):
+    lines = [
+        {'code': '9001', 'product_name': 'Yogurt greco', 'nutriments': {'energy_100g': 418.4, 'proteins_100g': 10, 'carbohydrates_100g': 4, 'fat_100g': 0}},
+        {'name': 'Mela', 'kcal_100g': '52', 'prot_100g': '0,3', 'carb_100g': '14', 'fat_100g': '0,2'},
+    ]
+    data = io.BytesIO(''.join(json.dumps(line) + '\n' for line in lines).encode())
+
+    stats = import_foods(conn, data, fmt='jsonl', rebuild_indexes=False)
+
+    assert (stats['inserted'], stats['rejected']) == (2, 0)
+    yogurt, mela = conn.execute('SELECT kcal_100g, prot_100g, barcode FROM foods ORDER BY id').fetchall()
+    assert yogurt['kcal_100g'] == pytest.approx(100.0)
+    assert mela['prot_100g'] == pytest.approx(0.3)
+    assert mela['barcode'] is None
+
+
+def test_reimport_rebuilds_totals_of_logged_foods(conn):
+    def load(kcal_pasta, kcal_riso):
+        body = OFF_HEADER + f'8001\tPasta\t\t{kcal_pasta}\t12\t71\t2\t3\t0\n8002\tRiso\t\t{kcal_riso}\t7\t80\t1\t0\t0\n'
+        return import_foods(conn, io.BytesIO(body.encode()), fmt='tsv')
+
+    load(350, 360)
+    pasta = conn.execute("SELECT id FROM foods WHERE barcode = '8001'").fetchone()[0]
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2025-01-10T12:00:00', ?, 100)", (pasta,))
+    conn.commit()
+
+    assert load(350, 360)['nutrients_changed'] == []
+    # il riso non è mai stato consumato: nessun totale da ricostruire
+    stats = load(400, 370)
+    assert (stats['updated'], stats['nutrients_changed']) == (2, [pasta])
+    kcal = conn.execute("SELECT kcal FROM daily_totals WHERE day = '2025-01-10'").fetchone()[0]
+    assert kcal == pytest.approx(400.0)
+
+
+def test_failed_import_restores_indexes(conn):
+    before = _schema(conn)
+    bad = io.BytesIO(b'{"name": "Riso", "kcal_100g": 1, "prot_100g": 1, "carb_100g": 1, "fat_100g": 1}\n{not json\n')
+    with pytest.raises(ValueError):
+        import_foods(conn, bad, fmt='jsonl')
+    assert _schema(conn) == before
+    assert conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0] == 0
+
+
+def test_killed_import_leaves_schema_intact(conn, tmp_path):
+    before = _schema(conn)
+    conn.commit()
+    rows = ''.join(f'{{"code": "{n}", "name": "Cibo {n}", "kcal_100g": 1, "prot_100g": 1, "carb_100g": 1, "fat_100g": 1}}\n'
+                   for n in range(10))
+    (tmp_path / 'foods.jsonl').write_text(rows)
+    # processo ucciso a metà caricamento, dopo diversi blocchi: nessun finally, nessun rollback esplicito
+    script = (
+        'import os, sqlite3\n'
+        'from foodly.core.importer import import_foods\n'
+        f'conn = sqlite3.connect({str(tmp_path / "foods.db")!r})\n'
+        'def kill(stats):\n'
+        '    if stats["read"] >= 6:\n'
+        '        os._exit(1)\n'
+        f'import_foods(conn, {str(tmp_path / "foods.jsonl")!r}, chunk_rows=2, txn_rows=2, progress=kill)\n'
+    )
+    assert subprocess.run([sys.executable, '-c', script]).returncode == 1
+
+    fresh = sqlite3.connect(tmp_path / 'foods.db')
+    try:
+        assert _schema(fresh) == before
+        assert fresh.execute('SELECT COUNT(*) FROM foods').fetchone()[0] == 0
+    finally:
+        fresh.close()
+
+
+def test_kept_indexes_release_the_write_lock_between_chunks(conn, tmp_path):
+    other = sqlite3.connect(tmp_path / 'foods.db', timeout=0)
+    rows = ''.join(f'{{"name": "Cibo {n}", "kcal_100g": 1, "prot_100g": 1, "carb_100g": 1, "fat_100g": 1}}\n' for n in range(6))
+
+    def write_meanwhile(stats):
+        # senza attesa: fallirebbe se l'import tenesse il lock
+        other.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2025-01-01T12:00:00', 1, ?)", (stats['read'],))
+        other.commit()
+
+    import_foods(conn, io.BytesIO(rows.encode()), fmt='jsonl', chunk_rows=2, txn_rows=2,
+                 rebuild_indexes=False, progress=write_meanwhile)
+    other.close()
+    assert conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0] == 6
+    assert conn.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0] == 4
+
+
+def test_normalize_row_rejects_missing_macros():
+    with pytest.raises(ValueError, match='prot_100g'):
+        normalize_row({'name': 'Acqua', 'kcal_100g': 0})
+
+
+def test_import_endpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'test.db')
+    from foodly.app import main as app_module
+    reload(app_module)
+    client = TestClient(app_module.app)
+    suspend = importer._suspend
+    suspended = []
+    monkeypatch.setattr(importer, '_suspend', lambda conn: suspended.append(True) or suspend(conn))
+    body = OFF_HEADER + '8001\tPasta di semola\tBarilla\t359\t12.5\t71\t2\t3.5\t0.01\n'
+    resp = client.post('/api/foods/import', files={'file': ('off.tsv', body.encode(), 'text/tab-separated-values')})
+    assert resp.status_code == 200
+    assert resp.json()['inserted'] == 1
+    # upload piccolo: indici e trigger restano, nessuna ricostruzione del catalogo
+    assert suspended == []
+    body = OFF_HEADER + '8002\tPassata\tMutti\t36\t1.6\t5.6\t0.2\t4.7\t0.5\n'
+    resp = client.post('/api/foods/import', params={'bulk': 'true'}, files={'file': ('off.tsv', body.encode())})
+    assert resp.json()['inserted'] == 1 and suspended == [True]
+
+    form = {'name': 'Altra pasta', 'kcal_100g': 1, 'prot_100g': 1, 'carb_100g': 1, 'fat_100g': 1, 'barcode': '8001'}
+    resp = client.post('/api/foods', data=form, follow_redirects=False)
+    assert resp.status_code == 409
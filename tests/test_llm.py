@@ -0,0 +1,118 @@
+import asyncio
+import json
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent import llm
+from foodly.agent.plan_cache import plan_cache
+from foodly.core import db as core_db
+
+
+def _completion(message):
+    return httpx.Response(200, json={'choices': [{'message': message}]})
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(llm, 'BACKOFF_BASE_S', 0.0)
+
+
+def test_retries_transient_errors_then_succeeds():
+    answers = [httpx.Response(503), httpx.ConnectError('down'), _completion({'content': 'ok'})]
+    seen = []
+
+    def handler(request):
+        seen.append(request)
+        answer = answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+    backend = llm.OpenAICompatibleBackend(base_url='http://stub/v1', max_retries=2, transport=httpx.MockTransport(handler))
+    msg = asyncio.run(backend.complete('key', [{'role': 'user', 'content': 'ciao'}]))
+    assert msg == {'content': 'ok'}
+    assert backend.retries == 2
+    assert seen[0].headers['authorization'] == 'Bearer key'
+    assert json.loads(seen[0].content)['model'] == backend.model
+
+
+def test_client_errors_are_not_retried():
+    calls = []
+
+    def handler(request):
+        calls.append(request)
+        return httpx.Response(401, json={'error': 'bad key'})
+
+    backend = llm.OpenAICompatibleBackend(base_url='http://stub/v1', max_retries=3, transport=httpx.MockTransport(handler))
+    with pytest.raises(llm.LLMError):
+        asyncio.run(backend.complete('key', []))
+    assert len(calls) == 1
+    assert backend.failures == 1
+
+
+def test_concurrency_is_capped_and_client_reused():
+    active = peak = 0
+
+    async def handler(request):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.01)
+        active -= 1
+        return _completion({'content': 'ok'})
+
+    backend = llm.OpenAICompatibleBackend(base_url='http://stub/v1', concurrency=2, transport=httpx.MockTransport(handler))
+
+    async def run():
+        client = backend._http()
+        await asyncio.gather(*(backend.complete('key', []) for _ in range(8)))
+        assert backend._http() is client
+        await backend.aclose()
+
+    asyncio.run(run())
+    assert peak == 2
+    assert backend.calls == 8
+
+
+class StubBackend:
+    model = 'stub'
+
+    def __init__(self, message):
+        self.message = message
+        self.requests = []
+        self.closed = False
+
+    async def complete(self, api_key, messages, tools=None):
+        self.requests.append((api_key, messages, tools))
+        return self.message
+
+    async def aclose(self):
+        self.closed = True
+
+
+def test_agent_chat_uses_pluggable_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    monkeypatch.setenv('FOODLY_API', 'test-key')
+    core_db.init_db()
+    plan_cache.clear()
+    stub = StubBackend({'tool_calls': [
+        {'function': {'name': 'consume', 'arguments': json.dumps({'food_id': 1, 'grams': 56})}},
+    ]})
+    previous = llm.set_backend(stub)
+    try:
+        from foodly.agent.main import app
+        with TestClient(app) as client:
+            resp = client.post('/agent/chat', json={'user_message': 'ho mangiato una scatoletta di tonno', 'use_rule_based': False})
+        assert resp.status_code == 200
+        body = resp.json()
+        assert body['actions'] == [{'name': 'consume', 'arguments': {'food_id': 1, 'grams': 56}}]
+        assert body['results']['totals']['kcal'] == pytest.approx(65.0)
+        api_key, messages, tools = stub.requests[0]
+        assert api_key == 'test-key'
+        assert messages[-1]['content'] == 'ho mangiato una scatoletta di tonno'
+        assert {t['function']['name'] for t in tools} >= {'consume', 'find_food'}
+        assert stub.closed  # chiuso dal lifespan
+    finally:
+        llm.set_backend(previous)
@@ -0,0 +1,112 @@
+import sqlite3
+
+import pytest
+
+from foodly.agent import matcher
+from foodly.agent.main import naive_parse
+from foodly.core import db as core_db
+from foodly.core.migrations import migrate
+
+FOODS = [
+    'Riso basmati',
+    'Petto di pollo',
+    'Tonno al naturale (scatoletta)',
+    'Gallette di mais',
+    'Yogurt bianco',
+    'Mele golden',
+    'Latte parzialmente scremato',
+    'Latte intero',
+]
+
+
+@pytest.fixture
+def conn(tmp_path):
+    conn = sqlite3.connect(tmp_path / 'foods.db')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.executemany(
+        'INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (?, 100, 10, 10, 1)',
+        [(n,) for n in FOODS],
+    )
+    conn.commit()
+    yield conn
+    matcher.invalidate(conn)
+    conn.close()
+
+
+def _items(conn, text):
+    return [(i.intent, i.food_id, i.grams) for i in matcher.extract_items(conn, text)]
+
+
+def test_several_items_in_one_message(conn):
+    assert _items(conn, 'ho mangiato 150 g di riso e 100 g di pollo') == [
+        ('consume', 1, 150.0),
+        ('consume', 2, 100.0),
+    ]
+    assert _items(conn, 'aggiungi 2 vasetti di yogurt da 125 g, 1 kg di riso e 3 mele da 150 g') == [
+        ('add', 5, 250.0),
+        ('add', 1, 1000.0),
+        ('add', 6, 450.0),
+    ]
+
+
+def test_plural_variants_and_packages(conn):
+    assert _items(conn, 'aggiungi 2 scatolette di tonno') == [('add', 3, 112.0)]
+    assert _items(conn, 'ho mangiato una galletta da 8 g') == [('consume', 4, 8.0)]
+    assert _items(conn, 'metti 2 etti di riso in dispensa') == [('add', 1, 200.0)]
+
+
+def test_longest_name_wins(conn):
+    # "latte" da solo: il nome più corto; "latte intero": il nome completo
+    assert _items(conn, 'ho bevuto 200 ml di latte')[0][1] == 8
+    assert _items(conn, 'ho bevuto 200 ml di latte parzialmente scremato')[0][1] == 7
+
+
+def test_new_foods_and_aliases_recompile(conn):
+    m = matcher.get_matcher(conn)
+    assert m.foods == len(FOODS)
+    assert matcher.get_matcher(conn) is m
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Quinoa', 1, 1, 1, 1)")
+    conn.execute("INSERT INTO food_aliases(food_id, alias) VALUES (3, 'tonno in scatola')")
+    conn.commit()
+    assert matcher.get_matcher(conn).foods == len(FOODS) + 1
+    assert _items(conn, 'ho mangiato 80 g di quinoa e 50 g di tonno in scatola') == [
+        ('consume', 9, 80.0),
+        ('consume', 3, 50.0),
+    ]
+
+
+def test_renames_and_deletes_from_another_connection(conn, tmp_path):
+    assert _items(conn, 'ho mangiato 100 g di tonno') == [('consume', 3, 100.0)]
+    other = sqlite3.connect(tmp_path / 'foods.db')
+    other.execute("UPDATE foods SET name = 'Salmone affumicato' WHERE id = 3")
+    other.execute("DELETE FROM foods WHERE id = 2")
+    other.commit()
+    other.close()
+    assert _items(conn, 'ho mangiato 100 g di salmone') == [('consume', 3, 100.0)]
+    # niente più id sparito o nome vecchio: resta la ricerca full-text
+    assert [i.food_id for i in matcher.extract_items(conn, 'ho mangiato 100 g di tonno e 50 g di pollo')] == [None, None]
+
+
+def test_matching_reads_only_the_versions_once_compiled(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'pool.db')
+    core_db.init_db()
+    conn = core_db.get_db()  # connessione del pool, come nei servizi
+    try:
+        matcher.get_matcher(conn)
+        statements = []
+        conn.set_trace_callback(statements.append)
+        assert [i.food_id for i in matcher.extract_items(conn, 'ho mangiato 56 g di tonno')] == [1]
+        conn.set_trace_callback(None)
+        assert len(statements) == 1 and 'table_versions' in statements[0]
+    finally:
+        conn.close()
+
+
+def test_naive_parse_falls_back_to_search(conn):
+    conn.execute(
+        "INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Cracker integrali', 1, 1, 1, 1)"
+    )
+    actions = naive_parse(conn, 'aggiungi 200 g di integrale')
+    assert [(a.name, a.arguments['food_id'], a.arguments['qty_g']) for a in actions] == [('add_to_pantry', 9, 200.0)]
+    assert naive_parse(conn, 'ciao, come va?') == []
@@ -0,0 +1,130 @@
+import asyncio
+import json
+import re
+import sqlite3
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent import llm
+from foodly.core import db as core_db
+from foodly.core import metrics
+
+
+@pytest.fixture(autouse=True)
+def fresh_metrics():
+    previous = metrics.set_enabled(True)
+    metrics.clear()
+    yield
+    metrics.set_enabled(previous)
+
+
+def _sample(text, name, **labels):
+    for line in text.splitlines():
+        if line.startswith(name + '{') or line.startswith(name + ' '):
+            found = dict(re.findall(r'(\w+)="((?:[^"\\]|\\.)*)"', line.split('} ')[0]))
+            if all(found.get(k) == str(v) for k, v in labels.items()):
+                return float(line.rsplit(' ', 1)[1])
+    return None
+
+
+def test_normalize_sql_collapses_literals_and_in_lists():
+    assert metrics.normalize_sql("SELECT *  FROM foods\n WHERE id IN (1, 2, 3) AND name = 'O''Neil'") == \
+        'SELECT * FROM foods WHERE id IN (?) AND name = ?'
+    assert metrics.normalize_sql('SELECT * FROM t WHERE a IN (?,?,?)') == 'SELECT * FROM t WHERE a IN (?)'
+
+
+def test_histogram_renders_cumulative_buckets():
+    h = metrics.Histogram('t_seconds', 'test', ('route',), buckets=(0.1, 1.0))
+    for v in (0.05, 0.5, 5.0):
+        h.observe(v, '/a"b')
+    lines = h.render()
+    assert 't_seconds_bucket{route="/a\\"b",le="0.1"} 1' in lines
+    assert 't_seconds_bucket{route="/a\\"b",le="+Inf"} 3' in lines
+    assert 't_seconds_count{route="/a\\"b"} 3' in lines
+
+
+def test_pooled_connections_time_statements(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'm.db')
+    core_db.init_db()
+    conn = core_db.get_db()
+    try:
+        for food_id in (1, 2, 3):
+            conn.execute(f'SELECT name FROM foods WHERE id = {food_id}').fetchone()
+        conn.execute('SELECT * FROM foods').fetchall()
+    finally:
+        conn.close()
+    count, seconds, slow = metrics.sql_stats.statement('SELECT name FROM foods WHERE id = ?')
+    assert count == 3 and seconds > 0 and slow == 0
+    assert metrics.sql_stats.statement('SELECT * FROM foods')[0] == 1
+
+    metrics.set_enabled(False)
+    conn = core_db.get_db()
+    try:
+        assert type(conn.cursor()) is sqlite3.Cursor
+        conn.execute('SELECT * FROM foods').fetchall()
+    finally:
+        conn.close()
+    assert metrics.sql_stats.statement('SELECT * FROM foods')[0] == 1
+
+
+def test_slow_statements_are_flagged_once(monkeypatch):
+    monkeypatch.setattr(metrics.sql_stats, 'slow_s', 0.0)
+    conn = sqlite3.connect(':memory:', factory=core_db.PooledConnection)
+    conn.execute('SELECT 1').fetchall()
+    count, _, slow = metrics.sql_stats.statement('SELECT ?')
+    assert count == 1 and slow == 1
+    conn.close()
+
+
+def test_statement_labels_are_bounded():
+    stats = metrics.SqlStats(max_statements=2)
+    for table in ('a', 'b', 'c', 'd'):
+        stats.entry(f'SELECT * FROM {table}')
+    assert sorted(stats.entries) == ['SELECT * FROM a', 'SELECT * FROM b', 'other']
+
+
+def test_metrics_endpoint_reports_routes_tools_and_pool(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    from foodly.agent.main import app
+    with TestClient(app) as client:
+        client.get('/tools/summary', params={'date_str': '2025-01-01'})
+        client.get('/tools/food_by_barcode', params={'barcode': '000'})
+        client.post('/agent/chat', json={'user_message': 'ho mangiato 100 g di tonno', 'date_str': '2025-01-01'})
+        resp = client.get('/metrics')
+    assert resp.status_code == 200
+    assert resp.headers['content-type'].startswith('text/plain; version=0.0.4')
+    text = resp.text
+    assert _sample(text, 'foodly_http_requests_total', app='agent', route='/tools/summary', status=200) == 1
+    assert _sample(text, 'foodly_http_requests_total', route='/tools/food_by_barcode', status=404) == 1
+    assert _sample(text, 'foodly_http_request_duration_seconds_count', route='/tools/summary') == 1
+    assert _sample(text, 'foodly_tool_duration_seconds_count', tool='consume', status='ok') == 1
+    assert _sample(text, 'foodly_db_pool_in_use', db=str(tmp_path / 'agent.db')) == 0
+    assert _sample(text, 'foodly_sql_statements_total') > 0
+    assert '# TYPE foodly_barcode_cache_misses gauge' in text
+
+
+def test_llm_attempts_and_durations_are_recorded(monkeypatch):
+    monkeypatch.setattr(llm, 'BACKOFF_BASE_S', 0.0)
+    answers = [httpx.Response(503), httpx.Response(200, json={'choices': [{'message': {'content': 'ok'}}]})]
+    backend = llm.OpenAICompatibleBackend(base_url='http://stub/v1', max_retries=2, transport=httpx.MockTransport(lambda r: answers.pop(0)))
+    asyncio.run(backend.complete('key', [{'role': 'user', 'content': 'ciao'}]))
+    assert metrics.llm_attempts.value('503') == 1 and metrics.llm_attempts.value('200') == 1
+
+    from foodly.agent.main import _llm_plan
+    from foodly.core.models import ChatRequest
+
+    class Stub:
+        model = 'stub'
+
+        async def complete(self, api_key, messages, tools=None):
+            return {'tool_calls': [{'function': {'name': 'find_food', 'arguments': json.dumps({'query': 'riso'})}}]}
+
+    previous = llm.set_backend(Stub())
+    try:
+        asyncio.run(_llm_plan('key', ChatRequest(user_message='riso', use_rule_based=False)))
+    finally:
+        llm.set_backend(previous)
+    assert metrics.llm_latency.count('ok') == 1
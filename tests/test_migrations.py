@@ -0,0 +1,96 @@
+import sqlite3
+
+import pytest
+
+from foodly.agent.tools import day_summary, tool_consume, tool_find_food
+from foodly.core import migrations
+from foodly.core.models import Consume, FindFood
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrations.migrate(conn)
+    conn.execute(
+        "INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Riso', 360, 7, 79, 1)"
+    )
+    conn.execute("INSERT INTO pantry(food_id, qty_g) VALUES (1, 500)")
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _traced(conn, fn, *args):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn(conn, *args)
+    finally:
+        conn.set_trace_callback(None)
+    return [s for s in statements if s.lstrip().upper().startswith(('SELECT', 'UPDATE', 'DELETE', 'WITH'))]
+
+
+def _full_scans(conn, sql):
+    # SCAN di tabelle reali; subquery, CTE materializzate e indici FTS non contano
+    details = [r['detail'] for r in conn.execute(f'EXPLAIN QUERY PLAN {sql}')]
+    ctes = {d.split()[1] for d in details if d.startswith('MATERIALIZE')}
+    return [
+        d for d in details
+        if d.startswith('SCAN') and 'USING' not in d and 'VIRTUAL TABLE' not in d
+        and not d.startswith('SCAN (') and d.split()[1] not in ctes
+    ]
+
+
+def test_migrate_sets_user_version_and_is_idempotent(conn):
+    assert migrations.schema_version(conn) == migrations.LATEST_VERSION
+    assert migrations.migrate(conn) == []
+
+
+def test_upgrades_legacy_database():
+    conn = sqlite3.connect(':memory:')
+    conn.execute('CREATE TABLE user_settings (id INTEGER PRIMARY KEY CHECK (id = 1), weight_kg REAL)')
+    conn.execute('INSERT INTO user_settings(id, weight_kg) VALUES (1, 80)')
+    conn.commit()
+    applied = migrations.migrate(conn)
+    assert applied == [name for name, _ in migrations.MIGRATIONS]
+    cols = [r[1] for r in conn.execute('PRAGMA table_info(user_settings)')]
+    assert 'llm_api_key' in cols
+    assert conn.execute('SELECT weight_kg FROM user_settings').fetchone()[0] == 80
+
+
+def test_init_db_skips_current_schema(tmp_path, monkeypatch):
+    from foodly.core import db as core_db
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'init.db')
+    core_db.init_db()
+    conn = sqlite3.connect(tmp_path / 'init.db')
+    conn.execute('DELETE FROM pantry')
+    conn.commit()
+    core_db.close_pools()
+    core_db.init_db()  # nuovo pool, schema aggiornato: niente migrazioni né dati di esempio
+    assert conn.execute('SELECT COUNT(*) FROM pantry').fetchone()[0] == 0
+    conn.close()
+    core_db.close_pools()
+
+
+def test_hot_path_indexes_exist(conn):
+    names = {r[0] for r in conn.execute("SELECT name FROM sqlite_master WHERE type='index'")}
+    assert {
+        'idx_consumption_logs_ts',
+        'idx_consumption_logs_food',
+        'idx_pantry_food_qty',
+        'idx_foods_name',
+        'idx_foods_barcode',
+    } <= names
+
+
+@pytest.mark.parametrize('call', [
+    lambda c: day_summary(c, '2024-01-01'),
+    lambda c: tool_consume(c, Consume(food_id=1, grams=50)),
+    lambda c: tool_find_food(c, FindFood(query='ris')),
+])
+def test_hot_paths_avoid_full_scans(conn, call):
+    statements = _traced(conn, call)
+    assert statements
+    for sql in statements:
+        assert _full_scans(conn, sql) == [], sql
@@ -0,0 +1,96 @@
+import sqlite3
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from benchmarks.suggest import build_db
+from foodly.agent.optimizer import optimize_combination, suggest_combination
+from foodly.agent.tools import suggest_from_pantry
+from foodly.core import db as core_db
+from foodly.core.migrations import migrate
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.execute('INSERT INTO user_settings(id, weight_kg, kcal_target) VALUES (1, 70, 2000)')
+    conn.executemany(
+        'INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g) VALUES (?,?,?,?,?,?)',
+        [
+            ('Petto di pollo', 110, 23, 0, 1.5, 0),
+            ('Riso', 360, 7, 79, 1, 1),
+            ('Olio', 900, 0, 0, 100, 0),
+            ('Mela', 52, 0.3, 14, 0.2, 2.4),
+        ],
+    )
+    # due lotti di riso: la disponibilità si somma
+    conn.executemany('INSERT INTO pantry(food_id, qty_g) VALUES (?,?)', [(1, 300), (2, 100), (2, 150), (3, 40), (4, 0)])
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_combination_respects_pantry_and_rounding(conn):
+    res = suggest_combination(conn, '2024-01-01', max_items=3)
+    assert res['mode'] == 'combo'
+    assert 1 <= len(res['options']) <= 3
+    available = {1: 300, 2: 250, 3: 40}
+    for opt in res['options']:
+        assert opt['food_id'] in available
+        assert 0 < opt['grams'] <= available[opt['food_id']]
+        assert opt['grams'] % 5 == 0
+    assert res['distance']['after'] < res['distance']['before']
+    assert not res['solver']['timed_out']
+
+
+def test_max_items_one(conn):
+    res = suggest_combination(conn, '2024-01-01', max_items=1)
+    assert len(res['options']) == 1
+
+
+def test_targets_met_or_empty_pantry(conn):
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 3, 1000)")
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 2, 2000)")
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 1, 2000)")
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 4, 2000)")
+    assert suggest_combination(conn, '2024-01-01')['options'] == []
+    conn.execute('UPDATE pantry SET qty_g = 0')
+    assert suggest_combination(conn, '2024-01-02')['note'] == 'Dispensa vuota o esaurita.'
+
+
+def test_exact_solution_is_found():
+    # residuo ottenibile esattamente con 100 g del primo + 50 g del terzo
+    per_gram = np.array([[1.0, 2.0, 3.0], [0.2, 0.0, 0.1], [0.0, 0.5, 0.4]])
+    residual = per_gram @ np.array([100.0, 0.0, 50.0])
+    res = optimize_combination(per_gram, np.array([500.0, 500.0, 500.0]), residual, np.ones(3), max_items=2)
+    assert sorted(zip(res['indices'], res['grams'])) == [(0, 100), (2, 50)]
+    assert res['distance'] == pytest.approx(0.0, abs=1e-9)
+
+
+def test_time_budget_with_many_candidates():
+    conn = build_db(2000, seed=3)
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 1, 300)")
+    suggest_combination(conn, '2024-01-01')
+    res = suggest_combination(conn, '2024-01-01', time_budget_s=0.05)
+    assert res['solver']['candidates'] > 400
+    assert res['solver']['elapsed_ms'] < 200
+    assert res['distance']['after'] < res['distance']['before']
+
+
+def test_single_mode_unchanged(conn):
+    assert suggest_from_pantry(conn, '2024-01-01') == suggest_from_pantry(conn, '2024-01-01', mode='single')
+    assert suggest_from_pantry(conn, '2024-01-01', mode='combo')['mode'] == 'combo'
+
+
+def test_suggest_endpoint(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    from foodly.agent.main import app
+    client = TestClient(app)
+    resp = client.get('/tools/suggest', params={'mode': 'combo', 'max_items': 2})
+    assert resp.status_code == 200
+    assert len(resp.json()['data']['options']) <= 2
+    assert client.get('/tools/suggest', params={'max_items': 9}).status_code == 422
@@ -0,0 +1,102 @@
+import json
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent import llm, plan_cache as pc
+from foodly.core import db as core_db
+from foodly.core.models import ToolCall
+
+TOOLS = [{'type': 'function', 'function': {'name': 'consume'}}]
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    pc.plan_cache.clear()
+    yield tmp_path / 'agent.db'
+    pc.plan_cache.clear()
+
+
+def test_key_normalizes_message_and_tracks_prompt():
+    key = pc.plan_key('Ho  mangiato 100 g di Riso!', 'p', TOOLS, True, 'm')
+    assert key == pc.plan_key('ho mangiato 100 g di riso', 'p', TOOLS, True, 'm')
+    assert key != pc.plan_key('ho mangiato 100 g di riso', 'p', TOOLS, False, 'm')
+    assert key != pc.plan_key('ho mangiato 100 g di riso', 'p2', TOOLS, True, 'm')
+    assert key != pc.plan_key('ho mangiato 100 g di riso', 'p', [], True, 'm')
+    assert key != pc.plan_key('ho mangiato 100 g di riso', 'p', TOOLS, True, 'm2')
+
+
+def test_lru_ttl_and_persistence(db, monkeypatch):
+    cache = pc.PlanCache(size=2, ttl=60)
+    plan = [ToolCall(name='consume', arguments={'food_id': 1, 'grams': 100})]
+    assert cache.get('a') is None
+    cache.put('a', plan)
+    cache.put('b', [])
+    cache.put('c', [])
+    assert cache.stats()['evictions'] == 1
+    assert cache.get('a') == plan  # dalla tabella, poi di nuovo in memoria
+    assert cache.get('a') == plan
+    stats = cache.stats()
+    assert (stats['db_hits'], stats['memory_hits'], stats['misses']) == (1, 1, 1)
+
+    # un nuovo processo ritrova i piani salvati
+    assert pc.PlanCache(ttl=60).get('c') == []
+
+    now = pc.time.time()
+    monkeypatch.setattr(pc.time, 'time', lambda: now + 120)
+    assert cache.get('a') is None
+    conn = core_db.get_db()
+    assert cache.prune(conn) == 3
+    conn.commit()
+    conn.close()
+
+
+def test_prune_keeps_most_recent_rows(db):
+    cache = pc.PlanCache(size=10, ttl=60, max_rows=2)
+    for key in 'abc':
+        cache.put(key, [])
+    conn = core_db.get_db()
+    assert cache.prune(conn) == 1
+    assert {r[0] for r in conn.execute('SELECT key FROM plan_cache')} == {'b', 'c'}
+    conn.close()
+
+
+class CountingBackend:
+    model = 'stub'
+
+    def __init__(self):
+        self.calls = 0
+
+    async def complete(self, api_key, messages, tools=None):
+        self.calls += 1
+        args = json.dumps({'query': 'riso'})
+        return {'tool_calls': [{'function': {'name': 'find_food', 'arguments': args}}]}
+
+    async def aclose(self):
+        pass
+
+
+def test_agent_chat_reuses_cached_plan(db, monkeypatch):
+    monkeypatch.setenv('FOODLY_API', 'test-key')
+    backend = CountingBackend()
+    previous = llm.set_backend(backend)
+    try:
+        from foodly.agent.main import app
+        client = TestClient(app)
+        before = client.get('/agent/plan_cache').json()['data']
+        for text in ('Cerca il riso', 'cerca il  riso.', 'cerca il riso'):
+            resp = client.post('/agent/chat', json={'user_message': text, 'use_rule_based': False})
+            assert resp.json()['actions'][0]['name'] == 'find_food'
+        assert backend.calls == 1
+        client.post('/agent/chat', json={'user_message': 'cerca il riso', 'use_rule_based': False, 'bypass_cache': True})
+        assert backend.calls == 2
+        client.post('/agent/chat', json={'user_message': 'cerca il riso', 'use_rule_based': False, 'require_confirm': False})
+        assert backend.calls == 3
+        stats = client.get('/agent/plan_cache').json()['data']
+        assert stats['memory_hits'] - before['memory_hits'] == 2
+        assert stats['bypassed'] - before['bypassed'] == 1
+        assert 0 < stats['hit_rate'] <= 1
+    finally:
+        llm.set_backend(previous)
@@ -0,0 +1,67 @@
+import sqlite3
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent.tools import day_summary, suggest_from_pantry, tool_consume
+from foodly.core import context
+from foodly.core import db as core_db
+from foodly.core.calculations import compute_targets
+from foodly.core.migrations import migrate
+from foodly.core.models import Consume
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.execute('INSERT INTO user_settings(id) VALUES (1)')
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Riso', 360, 7, 79, 1)")
+    conn.execute('INSERT INTO pantry(food_id, qty_g) VALUES (1, 500)')
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def test_memo_inside_scope_only(conn):
+    with context.request_scope() as ctx:
+        ctx.track(conn)
+        assert compute_targets(conn) is compute_targets(conn)
+        day_summary(conn, '2024-01-01')
+        suggest_from_pantry(conn, '2024-01-01')
+    # targets, totali del giorno, candidati e nomi: una query ciascuno
+    assert ctx.queries == 4
+    assert ctx.memo_hits == 3
+    assert compute_targets(conn) is not compute_targets(conn)
+
+
+def test_writes_invalidate_memo(conn):
+    with context.request_scope():
+        assert day_summary(conn, '2024-01-01')['kcal'] == 0
+        conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2024-01-01T12:00:00', 1, 100)")
+        assert day_summary(conn, '2024-01-01')['kcal'] == 360
+        tool_consume(conn, Consume(food_id=1, grams=100))
+        assert suggest_from_pantry(conn) != suggest_from_pantry(conn, mode='combo')
+
+
+def test_chat_reports_query_count(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'agent.db')
+    core_db.init_db()
+    statements = []
+    trace = context.RequestContext._trace
+
+    def record(self, sql):
+        statements.append(sql)
+        trace(self, sql)
+
+    monkeypatch.setattr(context.RequestContext, '_trace', record)
+    from foodly.agent.main import app
+    client = TestClient(app)
+    resp = client.post('/agent/chat', json={'user_message': 'ho mangiato 50 g di tonno', 'use_rule_based': True})
+    assert resp.status_code == 200
+    assert int(resp.headers[context.QUERY_COUNT_HEADER]) > 0
+    selects = [s for s in statements if s.lstrip().upper().startswith('SELECT')]
+    assert len(selects) == len(set(selects))
+    assert sum('FROM daily_totals' in s for s in selects) == 1
+    assert sum('FROM user_settings' in s for s in selects) == 1
@@ -0,0 +1,72 @@
+import sqlite3
+
+import pytest
+
+from foodly.core.migrations import migrate
+from foodly.core.rollup import _scan_day_totals, day_totals, rebuild_daily_totals
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.executemany(
+        'INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g, sodium_mg_100g) VALUES (?,?,?,?,?,?,?)',
+        [('Riso', 360, 7, 79, 1, 1.5, 5), ('Pollo', 110, 23, 0, 1.5, 0, 70)],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _log(conn, ts, food_id, grams):
+    conn.execute('INSERT INTO consumption_logs(ts, food_id, grams) VALUES (?,?,?)', (ts, food_id, grams))
+
+
+def test_insert_updates_rollup(conn):
+    _log(conn, '2024-03-01T08:00:00.123', 1, 100)
+    _log(conn, '2024-03-01T20:00:00', 2, 200)
+    _log(conn, '2024-03-02T08:00:00', 1, 50)
+    assert day_totals(conn, '2024-03-01') == {
+        'kcal': 580.0, 'prot_g': 53.0, 'carb_g': 79.0, 'fat_g': 4.0, 'fiber_g': 1.5, 'sodium_mg': 145.0,
+    }
+    assert day_totals(conn, '2024-03-02')['kcal'] == 180.0
+    assert day_totals(conn, '2024-03-03')['kcal'] == 0.0
+
+
+def test_rollup_matches_scan(conn):
+    for i in range(30):
+        _log(conn, f'2024-03-01T{i % 24:02d}:00:00', 1 + i % 2, 10 + i)
+    expected = {k: round(v, 1) for k, v in _scan_day_totals(conn, '2024-03-01').items()}
+    assert day_totals(conn, '2024-03-01') == expected
+
+
+def test_delete_and_update_keep_rollup_consistent(conn):
+    _log(conn, '2024-03-01T08:00:00', 1, 100)
+    _log(conn, '2024-03-01T09:00:00', 2, 100)
+    conn.execute('DELETE FROM consumption_logs WHERE food_id=2')
+    assert day_totals(conn, '2024-03-01')['kcal'] == 360.0
+    conn.execute("UPDATE consumption_logs SET ts='2024-03-02T08:00:00', grams=50")
+    assert day_totals(conn, '2024-03-01')['kcal'] == 0.0
+    assert day_totals(conn, '2024-03-02')['kcal'] == 180.0
+
+
+def test_rebuild_after_food_edit(conn):
+    _log(conn, '2024-03-01T08:00:00', 1, 100)
+    _log(conn, '2024-03-02T08:00:00', 2, 100)
+    conn.execute('UPDATE foods SET kcal_100g=400 WHERE id=1')
+    assert day_totals(conn, '2024-03-01')['kcal'] == 360.0
+    assert rebuild_daily_totals(conn, food_id=1) == 1
+    assert day_totals(conn, '2024-03-01')['kcal'] == 400.0
+    assert day_totals(conn, '2024-03-02')['kcal'] == 110.0
+
+
+def test_migration_backfills_existing_logs():
+    conn = sqlite3.connect(':memory:')
+    migrate(conn, target=3)
+    conn.execute("INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES ('Riso', 360, 7, 79, 1)")
+    _log(conn, '2024-03-01T08:00:00', 1, 100)
+    conn.commit()
+    migrate(conn)
+    assert day_totals(conn, '2024-03-01')['kcal'] == 360.0
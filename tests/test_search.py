@@ -0,0 +1,65 @@
+import sqlite3
+
+import pytest
+
+from foodly.core.migrations import migrate
+from foodly.core.search import fts_query, search_foods
+
+
+@pytest.fixture
+def conn():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    migrate(conn)
+    conn.executemany(
+        'INSERT INTO foods(name, brand, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (?, ?, 100, 1, 1, 1)',
+        [
+            ('Tonno al naturale (scatoletta)', None),
+            ('Caffè macinato', 'Lavazza'),
+            ('Pasta di semola', 'Tonno Rio'),
+            ('Risotto ai funghi', None),
+            ('Riso', None),
+        ],
+    )
+    conn.commit()
+    yield conn
+    conn.close()
+
+
+def _names(rows):
+    return [r['name'] for r in rows]
+
+
+def test_fts_query_drops_stopwords_and_stems():
+    assert fts_query('tonno al naturale') == '("tonno" OR "tonn"*) AND ("naturale" OR "natural"*)'
+    assert fts_query('di la') == ''
+
+
+def test_plural_matches_singular(conn):
+    assert _names(search_foods(conn, 'scatolette')) == ['Tonno al naturale (scatoletta)']
+
+
+def test_accents_are_folded(conn):
+    assert _names(search_foods(conn, 'caffe')) == ['Caffè macinato']
+    assert _names(search_foods(conn, 'CAFFÈ')) == ['Caffè macinato']
+
+
+def test_ranking_prefers_exact_name_match(conn):
+    assert _names(search_foods(conn, 'riso')) == ['Riso', 'Risotto ai funghi']
+    assert _names(search_foods(conn, 'tonno'))[0] == 'Tonno al naturale (scatoletta)'
+    assert 'Pasta di semola' in _names(search_foods(conn, 'tonno'))
+
+
+def test_index_follows_updates_and_deletes(conn):
+    conn.execute("UPDATE foods SET name='Orzo' WHERE name='Riso'")
+    conn.execute("DELETE FROM foods WHERE name LIKE 'Risotto%'")
+    assert search_foods(conn, 'riso') == []
+    assert _names(search_foods(conn, 'orzo')) == ['Orzo']
+
+
+def test_falls_back_to_like_without_index():
+    conn = sqlite3.connect(':memory:')
+    conn.row_factory = sqlite3.Row
+    conn.execute('CREATE TABLE foods (id INTEGER PRIMARY KEY, name TEXT)')
+    conn.execute("INSERT INTO foods(name) VALUES ('Yogurt bianco')")
+    assert search_foods(conn, 'yogurt', columns=('id', 'name')) == [{'id': 1, 'name': 'Yogurt bianco'}]
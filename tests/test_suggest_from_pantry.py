@@ -1,5 +1,8 @@
 import sqlite3
 
+import pytest
+
+from benchmarks.suggest import build_db, legacy_suggest_from_pantry
 from foodly.agent.tools import suggest_from_pantry
 
 
@@ -65,3 +68,26 @@ def test_suggest_from_pantry_prioritizes_carbs():
     option = next(o for o in result['options'] if o['name'] == 'High Carb')
     assert option['grams'] > 0
     assert option['grams'] <= 500
+
+
+@pytest.mark.parametrize('seed', range(6))
+def test_matches_legacy_implementation(seed):
+    conn = build_db(300, seed=seed)
+    # varia il deficit principale registrando consumi diversi per seed
+    conn.execute(
+        "INSERT INTO consumption_logs(ts, food_id, grams) VALUES (?, ?, ?)",
+        ('2024-05-01T12:00:00', 1 + seed, 150 * seed),
+    )
+    for day in (None, '2024-05-01'):
+        assert suggest_from_pantry(conn, day) == legacy_suggest_from_pantry(conn, day)
+
+
+def test_ties_keep_name_order():
+    conn = _setup_db()
+    conn.executemany(
+        "INSERT INTO foods(name, kcal_100g, prot_100g, carb_100g, fat_100g, fiber_100g) VALUES (?, 120, 5, 80, 2, 2)",
+        [(f'Carb {c}',) for c in 'FEDCBA'],
+    )
+    conn.executemany('INSERT INTO pantry(food_id, qty_g) VALUES (?, 500)', [(i,) for i in range(4, 10)])
+    assert suggest_from_pantry(conn) == legacy_suggest_from_pantry(conn)
+    assert [o['name'] for o in suggest_from_pantry(conn)['options']] == ['Carb A', 'Carb B', 'Carb C']
@@ -0,0 +1,92 @@
+import sqlite3
+import time
+from datetime import date, timedelta
+from importlib import reload
+
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.core import db as core_db
+
+# Budget per una richiesta su un anno di storico (mediana di più chiamate)
+LATENCY_BUDGET_S = 0.1
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    db_path = tmp_path / 'test.db'
+    monkeypatch.setattr(core_db, 'DB_PATH', db_path)
+    from foodly.app import main as app_module
+    reload(app_module)
+    with TestClient(app_module.app) as client:
+        yield client, db_path
+
+
+def _log_days(db_path, first, n_days, per_day=4, grams=100):
+    conn = sqlite3.connect(db_path)
+    rows = []
+    for i in range(n_days):
+        d = (first + timedelta(days=i)).isoformat()
+        rows += [(f'{d}T{8 + h:02d}:00:00', 1, grams) for h in range(per_day)]
+    conn.executemany('INSERT INTO consumption_logs(ts, food_id, grams) VALUES (?,?,?)', rows)
+    conn.commit()
+    conn.close()
+
+
+def test_daily_buckets_are_zero_filled(client):
+    client, db_path = client
+    _log_days(db_path, date(2024, 3, 1), 1, per_day=1)
+    data = client.get('/api/summary/range', params={'from': '2024-03-01', 'to': '2024-03-03'}).json()
+    assert [b['start'] for b in data['buckets']] == ['2024-03-01', '2024-03-02', '2024-03-03']
+    assert data['buckets'][0]['totals']['kcal'] == 116.0  # 100 g di tonno
+    assert data['buckets'][0]['logs'] == 1
+    assert data['buckets'][1]['totals']['kcal'] == 0.0
+    assert 'kcal_pct' in data['buckets'][0]['progress']
+
+
+def test_week_and_month_buckets(client):
+    client, db_path = client
+    _log_days(db_path, date(2024, 1, 1), 60, per_day=1)
+    weeks = client.get('/api/summary/range', params={'from': '2024-01-03', 'to': '2024-01-21', 'granularity': 'week'}).json()['buckets']
+    assert [(b['start'], b['end'], b['days']) for b in weeks] == [
+        ('2024-01-03', '2024-01-07', 5),
+        ('2024-01-08', '2024-01-14', 7),
+        ('2024-01-15', '2024-01-21', 7),
+    ]
+    assert weeks[1]['totals']['kcal'] == 7 * 116.0
+    assert weeks[1]['daily_avg']['kcal'] == 116.0
+    months = client.get('/api/summary/range', params={'from': '2024-01-15', 'to': '2024-03-10', 'granularity': 'month'}).json()['buckets']
+    assert [(b['start'], b['days'], b['days_logged']) for b in months] == [
+        ('2024-01-15', 17, 17), ('2024-02-01', 29, 29), ('2024-03-01', 10, 0),
+    ]
+
+
+def test_rolling_averages(client):
+    client, db_path = client
+    _log_days(db_path, date(2024, 3, 1), 7, per_day=1)
+    rolling = client.get('/api/summary/range', params={'from': '2024-03-01', 'to': '2024-03-07'}).json()['rolling']
+    assert rolling['7d']['daily_avg']['kcal'] == 116.0
+    assert rolling['30d']['from'] == '2024-02-07'
+    assert rolling['30d']['daily_avg']['kcal'] == round(7 * 116.0 / 30, 1)
+    assert rolling['7d']['progress']['kcal_pct'] > rolling['30d']['progress']['kcal_pct']
+
+
+def test_invalid_ranges(client):
+    client, _ = client
+    assert client.get('/api/summary/range', params={'from': '2024-03-02', 'to': '2024-03-01'}).status_code == 400
+    assert client.get('/api/summary/range', params={'from': '2000-01-01', 'to': '2024-03-01'}).status_code == 400
+    assert client.get('/api/summary/range', params={'from': '2024-03-01', 'to': '2024-03-02', 'granularity': 'year'}).status_code == 422
+
+
+def test_year_of_history_within_budget(client):
+    client, db_path = client
+    _log_days(db_path, date(2023, 1, 1), 365, per_day=6)
+    params = {'from': '2023-01-01', 'to': '2023-12-31', 'granularity': 'day'}
+    timings = []
+    for _ in range(5):
+        t0 = time.perf_counter()
+        resp = client.get('/api/summary/range', params=params)
+        timings.append(time.perf_counter() - t0)
+        assert resp.status_code == 200
+    assert len(resp.json()['buckets']) == 365
+    assert sorted(timings)[len(timings) // 2] < LATENCY_BUDGET_S
@@ -0,0 +1,166 @@
+from importlib import reload
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from foodly.agent.plan_cache import plan_cache
+from foodly.core import db as core_db
+from foodly.core import writer
+from foodly.core.context import user_scope
+from foodly.core.migrations import LATEST_VERSION
+
+
+@pytest.fixture
+def shards(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'default.db')
+    monkeypatch.setattr(core_db, 'SHARDS_DIR', tmp_path / 'shards')
+    core_db.init_db()
+    plan_cache.clear()
+    yield tmp_path / 'shards'
+    writer.close_writers()
+    core_db.close_pools()
+
+
+def _logs(user_id=None):
+    conn = core_db.get_db(user_id)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM consumption_logs').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _foods(user_id=None):
+    conn = core_db.get_db(user_id)
+    try:
+        return conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0]
+    finally:
+        conn.close()
+
+
+def _log(conn, grams):
+    conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2025-01-01T12:00:00', 1, ?)", (grams,))
+
+
+def test_shards_are_created_lazily_and_isolated(shards):
+    assert not shards.exists()
+    with user_scope('anna'):
+        writer.write(_log, 50)
+        writer.write(_log, 60)
+    with user_scope('bruno'):
+        writer.write(_log, 70)
+    assert _logs('anna') == 2 and _logs('bruno') == 1 and _logs() == 0
+    path = core_db.shard_path('anna')
+    assert path.exists() and path.parent.parent == shards
+    # migrato e con il catalogo di base
+    conn = core_db.get_db('anna')
+    try:
+        assert conn.execute('PRAGMA user_version').fetchone()[0] == LATEST_VERSION
+        assert conn.execute('SELECT COUNT(*) FROM foods').fetchone()[0] > 0
+    finally:
+        conn.close()
+
+
+def test_invalid_user_id_is_rejected(shards):
+    for user_id in ('', '../etc', 'a/b', 'x' * 200):
+        with pytest.raises(ValueError):
+            core_db.shard_path(user_id)
+
+
+def test_lru_closes_least_recently_used_idle_shards(shards, monkeypatch):
+    monkeypatch.setattr(core_db, 'MAX_OPEN_SHARDS', 2)
+    evicted = []
+    monkeypatch.setattr(core_db, '_evict_hooks', core_db._evict_hooks + [evicted.append])
+    for user_id in ('u1', 'u2'):
+        _logs(user_id)
+    busy = core_db.get_db('u1')  # in uso: non si chiude
+    try:
+        _logs('u3')
+        assert evicted == [core_db.shard_path('u2')]
+        _logs('u4')
+        assert evicted[1:] == [core_db.shard_path('u3')]
+    finally:
+        busy.close()
+    assert str(core_db.shard_path('u1')) in core_db.pool_stats()
+    # un shard chiuso si riapre al prossimo accesso, con i suoi dati
+    with user_scope('u2'):
+        writer.write(_log, 10)
+    assert _logs('u2') == 1
+
+
+def test_idle_shards_are_closed(shards, monkeypatch):
+    _logs('old')
+    monkeypatch.setattr(core_db, 'SHARD_IDLE_S', 0.0)
+    _logs('new')
+    assert core_db.shard_path('old') not in core_db._pools
+    assert core_db.shard_path('new') in core_db._pools
+    assert core_db.DB_PATH in core_db._pools  # il database di default resta aperto
+
+
+def test_header_routes_requests_to_the_user_shard(shards):
+    from foodly.agent.main import app
+    with TestClient(app) as client:
+        body = {'food_id': 1, 'grams': 56}
+        assert client.post('/tools/consume', json=body, headers={'X-Foodly-User': 'anna'}).status_code == 200
+        assert client.post('/tools/consume', json=body).status_code == 200
+        assert client.post('/tools/consume', json=body, headers={'X-Foodly-User': '../x'}).status_code == 400
+    assert _logs('anna') == 1 and _logs() == 1
+
+
+def test_missing_header_is_refused_when_required(shards):
+    from fastapi import FastAPI
+
+    from foodly.core import tenancy
+
+    app = tenancy.route_by_user(FastAPI(), require=True)
+
+    @app.get('/ping')
+    def ping():
+        return {'ok': True}
+
+    @app.get('/metrics')
+    def metrics():
+        return {}
+
+    with TestClient(app) as client:
+        assert client.get('/ping').status_code == 401
+        assert client.get('/ping', headers={'X-Foodly-User': 'anna'}).status_code == 200
+        assert client.get('/metrics').status_code == 200
+
+
+def test_web_proxy_forwards_the_user(shards):
+    from foodly.agent.main import app as agent_app
+    from foodly.app import main as app_module
+    reload(app_module)
+    with TestClient(app_module.app) as client:
+        app_module.app.state.agent_client = httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=agent_app), base_url='http://agent'
+        )
+        resp = client.post('/chat', data={'user_message': 'ho mangiato 56 g di tonno'}, headers={'X-Foodly-User': 'carla'})
+        assert resp.status_code == 200
+        # le API della web app leggono lo stesso shard
+        pantry = client.get('/api/pantry', headers={'X-Foodly-User': 'carla'}).json()
+        default = client.get('/api/pantry').json()
+        assert pantry != default
+    assert _logs('carla') == 1 and _logs() == 0
+
+
+def test_command_line_tools_work_on_a_user_shard(shards, tmp_path, capsys):
+    from foodly.core import importer, rollup
+
+    path = tmp_path / 'catalogo.jsonl'
+    path.write_text('{"code": "8001", "name": "Pasta di semola", "kcal_100g": 359, "prot_100g": 12, "carb_100g": 71, "fat_100g": 2}\n')
+    importer.main([str(path), '--user', 'anna'])
+    assert _foods('anna') == _foods() + 1
+    with user_scope('anna'):
+        writer.write(_log, 100)
+    conn = core_db.get_db('anna')
+    try:
+        conn.execute('DELETE FROM daily_totals')
+        conn.commit()
+    finally:
+        conn.close()
+    rollup.main(['--user', 'anna'])
+    assert 'daily_totals: 1 giorni' in capsys.readouterr().out
+    with pytest.raises(SystemExit):
+        rollup.main(['--user', '../x'])
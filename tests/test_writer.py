@@ -0,0 +1,90 @@
+import sqlite3
+import threading
+
+import pytest
+
+from benchmarks import writes
+from foodly.agent.tools import day_summary
+from foodly.core import context
+from foodly.core import db as core_db
+from foodly.core import writer
+
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    monkeypatch.setattr(core_db, 'DB_PATH', tmp_path / 'w.db')
+    core_db.init_db()
+    yield tmp_path / 'w.db'
+    writer.close_writers()
+
+
+def _insert(conn, grams):
+    return conn.execute("INSERT INTO consumption_logs(ts, food_id, grams) VALUES ('2025-01-01T12:00:00', 1, ?)", (grams,)).lastrowid
+
+
+def test_queued_writes_are_group_committed(db):
+    w = writer.Writer(db)
+    started, gate = threading.Event(), threading.Event()
+    # la prima operazione tiene occupato il writer: le altre si accodano e finiscono in un solo batch
+    first = w.submit(lambda conn: started.set() or gate.wait(5))
+    started.wait(5)
+    futures = [w.submit(_insert, g) for g in range(1, 21)]
+    gate.set()
+    assert first.result(5) is True
+    assert sorted(f.result(5) for f in futures) == list(range(1, 21))
+    stats = w.stats()
+    assert stats['ops'] == 21 and stats['batches'] == 2 and stats['max_batch'] == 20
+    w.close()
+
+
+def test_failing_operation_is_rolled_back_alone(db):
+    w = writer.Writer(db)
+    gate = threading.Event()
+    w.submit(lambda conn: gate.wait(5))
+
+    def fail(conn):
+        _insert(conn, 99)
+        conn.execute('INSERT INTO foods(id, name, kcal_100g, prot_100g, carb_100g, fat_100g) VALUES (1, "x", 1, 1, 1, 1)')
+
+    def with_commit(conn):
+        _insert(conn, 2)
+        conn.commit()  # ignorato: il commit è del batch
+
+    ok, bad, committed = w.submit(_insert, 1), w.submit(fail), w.submit(with_commit)
+    gate.set()
+    ok.result(5)
+    committed.result(5)
+    with pytest.raises(sqlite3.IntegrityError):
+        bad.result(5)
+    w.close()
+    conn = core_db.get_db()
+    try:
+        assert [r[0] for r in conn.execute('SELECT grams FROM consumption_logs ORDER BY id')] == [1, 2]
+    finally:
+        conn.close()
+
+
+def test_writer_commits_invalidate_request_memo(db):
+    conn = core_db.get_db()
+    try:
+        with context.request_scope():
+            before = day_summary(conn, '2025-01-01')
+            writer.write(_insert, 100)
+            after = day_summary(conn, '2025-01-01')
+    finally:
+        conn.close()
+    assert after['kcal'] > before['kcal']
+
+
+def test_closed_writer_rejects_work(db):
+    w = writer.Writer(db)
+    w.close()
+    with pytest.raises(RuntimeError):
+        w.submit(_insert, 1)
+
+
+def test_load_test_runs_both_modes():
+    results = writes.run(threads=4, ops=10, foods=50, lots=100)
+    for mode in ('direct', 'writer'):
+        assert results[mode]['ops'] == 40 and results[mode]['errors'] == 0
+    assert results['writer']['avg_batch'] >= 1